@@ -29,6 +29,32 @@ Current TODO List:
          https://csveda.com/creating-tabbed-interface-using-pysimplegui/
 
 Changelog
+17 Oct 2026: Experiment engine moved to module_experiment_engine (shared with run_experiment_headless.py), digital gain settle wait is capped
+17 Oct 2026: Job queue (module_job_queue) takes turns between several CSVs/protocols with their own run times and priorities, saved so it can run unattended
+17 Oct 2026: Runs start on a fixed schedule (every run time from the experiment start) with an overrun policy, scheduled vs actual starts saved (module_run_scheduler)
+17 Oct 2026: Experiments write a checkpoint journal (module_experiment_journal), "Resume Experiment" continues a stopped/crashed one
+17 Oct 2026: Video experiments record H.264 per well into the experiment folder and mux to MP4 in the background (module_video_recorder)
+17 Oct 2026: get_well_picture can also save a tiled .npy copy, so later stages read tiles instead of 36 MB frames (module_tiled_image)
+17 Oct 2026: Z Stack can be fused into an all-in-focus picture and depth map in the background (module_focus_fusion)
+17 Oct 2026: "Autofocus Wells" keeps a per-well focus map (module_focus_map), refreshed every few runs and saved as JSON
+17 Oct 2026: Z Stack autofocus option, scores small video frames and only captures around the sharpest Z (module_autofocus)
+17 Oct 2026: Raw experiment frames are captured into reused NumPy buffers (module_capture_pipeline.FramePool)
+17 Oct 2026: "Pic x 10" captures a burst (capture_sequence/capture_continuous) with no delay between pictures
+17 Oct 2026: Tracing spans around GCODE, settle, capture, encode/write and metadata (module_trace, ROBOCAM_TRACE=1)
+17 Oct 2026: Experiment loop split out of run_experiment2 (run_experiment_loop) for benchmark_experiment.py
+17 Oct 2026: Printer/camera backends (module_backends), ROBOCAM_BACKEND=sim runs without a 3D Printer or Pi Camera
+17 Oct 2026: All GCODE goes through one serial owner thread with ok-based streaming (module_serial_queue)
+17 Oct 2026: Get Current Location uses one M114 round trip (module_position_query) instead of a 2-20 sec retry loop
+17 Oct 2026: Preview pseudo window start location is picked without building full screen-size sets
+17 Oct 2026: Preview window helpers share one Xlib connection and use translate_coords (module_window_helper)
+17 Oct 2026: GUI loop waits for events (100 ms timeout) and tracks Preview Window moves with Xlib events (module_window_helper)
+17 Oct 2026: Camera settings per picture are buffered and written in batches (module_metadata_recorder)
+17 Oct 2026: Experiment pictures are encoded/saved by background workers (module_capture_pipeline)
+17 Oct 2026: Experiment and Z stack keep the camera at still resolution for the whole session (module_capture_session)
+17 Oct 2026: Optional shortest-path well order and alternating run direction (module_path_optimizer)
+17 Oct 2026: Predict well-to-well travel and cycle time (module_travel_planner)
+17 Oct 2026: Wait for moves with M400/M114 motion sync (module_motion_sync) instead of fixed sleeps
+17 Oct 2026: Tiled .npy copies are written by the capture pipeline from the raw frame, "Pic" shows a thumbnail
 24 Aug 2022: User can choose where to save experiment folder (CAM tab)
 16 May 2022: Removed PiRGBArray Camera Preview and implemented PiCamera Preview + hacks for window control!
 25 Apr 2022: Fixed restart bug, can now run multiple experiments without restarting GUI!
@@ -44,12 +70,9 @@ Changelog
 """
 
 # Import PySimpleGUI, cv2, numpy, time libraries
-# Import picamera libraries
+# picamera is imported by module_backends (not needed with ROBOCAM_BACKEND=sim)
 
 from datetime import datetime
-from picamera.array import PiRGBArray, PiBayerArray
-from picamera import PiCamera
-from Xlib.display import Display
 import csv
 import PySimpleGUI as sg
 import cv2
@@ -57,16 +80,33 @@ import numpy as np
 import os
 import time
 import threading
-import random
 
 # Import modules
 import settings as C
 import get_current_location_m114 as GCL
-import printer_connection as printer
+import module_backends as BK
 import prepare_experiment as P
 import module_get_cam_settings as GCS
 import module_experiment_timer as ET
 import module_well_location_helper as WL
+import module_motion_sync as MS
+import module_capture_session as CS
+import module_capture_pipeline as CP
+import module_window_helper as WH
+import module_position_query as PQ
+import module_serial_queue as SQ
+import module_trace as TR
+import module_autofocus as AF
+import module_focus_fusion as FF
+import module_tiled_image as TI
+import module_video_recorder as VR
+import module_experiment_journal as EJ
+import module_run_scheduler as RS
+import module_job_queue as JQ
+import module_experiment_engine as EE
+
+# printer_connection, or the simulated printer with ROBOCAM_BACKEND=sim
+printer = BK.get_printer_module()
 
 # ==== USER CONSTANTS - GUI ====
 # TODO: Put these in a YAML GUI Settings File?
@@ -79,15 +119,45 @@ STOP_EXPERIMENT = "Stop Experiment"
 MAX_NUMBER_EXPERIMENTAL_RUNS = 1
 
 # ---- RADIO GUI KEYS AND TEXT ----
-EXP_RADIO_PIC_KEY = "-RADIO_PIC-"
-EXP_RADIO_VID_KEY = "-RADIO_VID-"
-EXP_RADIO_PREVIEW_KEY = "-RADIO_PREVIEW-"
+EXP_RADIO_PIC_KEY = EE.EXP_RADIO_PIC_KEY
+EXP_RADIO_VID_KEY = EE.EXP_RADIO_VID_KEY
+EXP_RADIO_PREVIEW_KEY = EE.EXP_RADIO_PREVIEW_KEY
 EXP_RADIO_GROUP = "RADIO_EXP"
 EXP_RADIO_PIC_TEXT = "Picture"
 EXP_RADIO_VID_TEXT = "Video"
 EXP_RADIO_PREVIEW_TEXT = "Preview"
 EXP_RADIO_PROMPT = "For the experiment, choose to take Pictures, Videos, or Preview Only"
 
+# ---- WELL ORDER CHECKBOX KEYS AND TEXT ----
+OPTIMIZE_PATH_KEY = EE.OPTIMIZE_PATH_KEY
+OPTIMIZE_PATH_TEXT = "Optimize Well Order (shortest path)"
+ALTERNATE_DIRECTION_KEY = EE.ALTERNATE_DIRECTION_KEY
+ALTERNATE_DIRECTION_TEXT = "Alternate Direction Each Run"
+FOCUS_MAP_KEY = EE.FOCUS_MAP_KEY
+FOCUS_MAP_TEXT = "Autofocus Wells (focus map)"
+TILED_COPY_KEY = EE.TILED_COPY_KEY
+TILED_COPY_TEXT = "Save Tiled Copy (.npy)"
+
+# ---- VIDEO EXPERIMENT KEYS ----
+VIDEO_DURATION_KEY = EE.VIDEO_DURATION_KEY
+VIDEO_BITRATE_KEY = EE.VIDEO_BITRATE_KEY
+
+# ---- RUN SCHEDULE ----
+OVERRUN_POLICY_KEY = EE.OVERRUN_POLICY_KEY
+
+# ---- JOB QUEUE ----
+ADD_JOB = "Add to Queue"
+RUN_JOB_QUEUE = "Run Queue"
+REMOVE_JOB = "Remove Job"
+JOB_PRIORITY_KEY = "-JOB_PRIORITY-"
+JOB_LIST_KEY = "-JOB_LIST-"
+
+# ---- RESUME EXPERIMENT ----
+RESUME_EXPERIMENT = "Resume Experiment"
+RESUME_FOLDER_KEY = "-RESUME_FOLDER-"
+# GUI values saved in the experiment journal, so a resumed experiment runs the same way
+JOURNAL_VALUE_KEYS = EE.JOURNAL_VALUE_KEYS
+
 # ---- CAMERA TAB ----
 # CONSTANTS
 PIC_SAVE_FOLDER = r"/home/pi/Projects/3dprinter_sampling"
@@ -143,7 +213,9 @@ Y_MINUS = "Y-"
 Z_PLUS = "Z+"
 Z_MINUS = "Z-"
 # WINDOW_GUI_TIMEOUT
-WINDOW_GUI_TIMEOUT = 10 # in ms
+# Max time the GUI loop waits for an event (returns right away when there is one).
+# Was a 0 ms busy loop, which kept a Raspberry Pi core at 100%.
+WINDOW_GUI_TIMEOUT = 100 # in ms
 # TODO: Put in Constants for GCODE Input
 
 # --- Z Stack Constants ----
@@ -151,9 +223,42 @@ WINDOW_GUI_TIMEOUT = 10 # in ms
 Z_START_KEY = "-Z_START_KEY-"
 Z_END_KEY = "-Z_END_KEY-"
 Z_INC_KEY = "-Z_INC_KEY-"
+Z_AUTOFOCUS_KEY = "-Z_AUTOFOCUS_KEY-"
+Z_BRACKET_KEY = "-Z_BRACKET_KEY-"
+Z_AUTOFOCUS_TEXT = "Autofocus (capture only near sharpest Z)"
+Z_FUSE_KEY = "-Z_FUSE_KEY-"
+Z_FUSE_TEXT = "Fuse All-in-Focus Picture + Depth Map"
 
 SAVE_FOLDER_KEY = "-SAVE_FOLDER_KEY-"
 
+# --- Capture Pipeline Constants ---
+# If True, experiment pictures are saved in the background (module_capture_pipeline)
+# so the extruder can move to the next well while the last picture is written.
+USE_CAPTURE_PIPELINE = True
+
+# --- Tiled Image Constants ---
+# Default for the "Save Tiled Copy" checkbox on Tab 1: if checked, experiment pictures, get_well_picture
+# and "Pic" also save a memory mapped .npy copy (well_12.jpg -> well_12.npy, about 36 MB at 12 MP),
+# written by the capture pipeline from the raw frame (no decode of the JPEG).
+# Later stages (the "Pic" thumbnail, processing) read tiles from it instead of loading the whole picture.
+SAVE_TILED_COPY = EE.SAVE_TILED_COPY
+# Size of the picture shown in the window after "Pic"
+PIC_DISPLAY_RES = (480, 360)
+
+# --- Burst Capture Constants ("Pic x 10") ---
+# Delay 0: pictures back to back at the fastest rate the camera can keep up (module_capture_session.capture_burst)
+PIC_X_COUNT = 10
+PIC_X_DELAY_SECONDS = 0
+# Video port is faster (no still port setup per frame) but lower quality and limited resolution
+BURST_USE_VIDEO_PORT = False
+
+# --- Motion Sync Constants ---
+# Fixed sleep (in seconds) used if motion sync is off or fails.
+# See module_motion_sync for sync mode, tolerance, and timeout.
+WELL_MOVE_FALLBACK_TIME = 4
+GUI_MOVE_FALLBACK_TIME = 2
+Z_STACK_MOVE_FALLBACK_TIME = 2
+
 # Button Text
 START_Z_STACK_CREATION_TEXT = "Start Z Stack Creation"
 
@@ -260,10 +365,10 @@ def run_relative(direction, values):
 
     # This is where you would run the GCode
     # Run Relative Mode
-    printer.run_gcode("G91")
+    SQ.run_gcode("G91")
             
     # Run relative_coordinates GCODE created in this function
-    printer.run_gcode(relative_coordinates)
+    SQ.run_gcode(relative_coordinates)
 #   TODO: Extruder Speed Adjustment
 
 
@@ -313,7 +418,7 @@ def run_experiment(event, values, thread_event, camera, preview_win_id):
     gcode_string_list = P.convert_list_to_gcode_strings(path_list)
     
     # Go into Absolute Positioning Mode
-    printer.run_gcode(C.ABSOLUTE_POS)
+    SQ.run_gcode(C.ABSOLUTE_POS)
     
     # Create New Folder If not in "Preview" Mode
     if values[EXP_RADIO_PREVIEW_KEY] == False:
@@ -338,9 +443,9 @@ def run_experiment(event, values, thread_event, camera, preview_win_id):
         well_number = 1
         for location in gcode_string_list:
             # print(gcode_string)
-            printer.run_gcode(location)
+            SQ.run_gcode(location)
             print("Going to Well Number:", well_number)
-            time.sleep(4)
+            MS.wait_for_move(location, WELL_MOVE_FALLBACK_TIME)
             if values[EXP_RADIO_PREVIEW_KEY] == True:
                 print("Preview Mode is On, only showing preview camera \n")
                 # camera.start_preview(fullscreen=False, window=(30, 30, 500, 500))
@@ -369,10 +474,12 @@ def run_experiment(event, values, thread_event, camera, preview_win_id):
                 #start_camera_preview(event, values, camera, preview_win_id)
                 
                 
-                get_well_picture(camera, file_full_path)
+                get_well_picture(camera, file_full_path, values[TILED_COPY_KEY])
                 
-                data_row = GCS.gen_cam_data(file_full_path, camera)
-                GCS.append_to_csv_file(data_row)
+                with TR.span("metadata_snapshot"):
+                    data_row = GCS.gen_cam_data(file_full_path, camera)
+                with TR.span("metadata_csv_write", rows=1):
+                    GCS.append_to_csv_file(data_row)
                 
                 # Return to streaming resolution: 640 x 480 (or it will crash)
                 # Bug: Crashes anyway because of threading
@@ -405,6 +512,7 @@ def run_experiment(event, values, thread_event, camera, preview_win_id):
 def run_experiment2(event, values, thread_event, camera, preview_win_id):
     """
     Description: Runs experiment to take a picture, video, or preview (do nothing)
+                 with the experiment engine (module_experiment_engine)
     
     Input: PySimpleGUI window event and values
     """
@@ -421,147 +529,43 @@ def run_experiment2(event, values, thread_event, camera, preview_win_id):
     # Dummy Data for faster code testing, delete when ready
     # total_seconds = 40
     # run_seconds = 10
-        
-    start_time = time.monotonic()
-    
-    elapsed_seconds = -1
-    
-    run_start = time.monotonic()
-    run_time_left = 0
-    run_elapsed = -1
     
     # Get CSV Filename
     csv_filename = values[OPEN_CSV_FILEBROWSE_KEY]
     
-    # Get Path List from CSV
-    path_list = P.get_path_list_csv(csv_filename)
+    experiment = EE.create_experiment(values, camera, csv_filename, total_seconds, run_seconds, PIC_SAVE_FOLDER,
+                                      (PIC_WIDTH, PIC_HEIGHT), VID_RES)
+    EE.run_single_experiment(experiment, lambda: is_running_experiment)
+    is_running_experiment = False
+
+
+def resume_experiment(folder_path, camera):
+    """
+    Description: Continues a stopped/crashed experiment in folder_path (see EE.open_resumed_experiment)
+    """
+    global is_running_experiment
     
-    # Get GCODE Location List from path_list
-    gcode_string_list = P.convert_list_to_gcode_strings(path_list)
+    if camera.preview:
+        camera.stop_preview()
     
-    # Go into Absolute Positioning Mode
-    printer.run_gcode(C.ABSOLUTE_POS)
+    EE.run_single_experiment(EE.open_resumed_experiment(folder_path, camera, VID_RES),
+                             lambda: is_running_experiment)
+    is_running_experiment = False
+
+
+def run_job_queue(job_queue, camera):
+    """
+    Description: Runs every job in the job queue (module_job_queue) that isn't done, taking turns
+                 between them, until they're done or "Stop Experiment" is pressed (see EE.run_job_queue)
+    """
+    global is_running_experiment
     
-    # Create New Folder If not in "Preview" Mode
-    if values[EXP_RADIO_PREVIEW_KEY] == False:
-        dest_folder = PIC_SAVE_FOLDER
-        # folder_path = P.create_and_get_folder_path(dest_folder)
-        folder_path = P.create_and_get_folder_path2(dest_folder)
-        print("Not in Preview Mode, creating folder:", folder_path)
-        
-    # Get Camera Settings Module
-    # Initialize unique CSV camera settings file
-    GCS.SAVE_CSV_FOLDER = folder_path
-    GCS.init_csv_file()
+    if camera.preview:
+        camera.stop_preview()
     
-    # Create While loop to check if thread_event is not set (closing)
-    count_run = 0
-    # while not thread_event.isSet():
-    # while True:
-    while is_running_experiment:
-        
-        # TODO: Put in the rest of the code for Pic, Video, Preview from 3dprinter_start_experiment or prepare_experiment
-        
-        
-        
-        
-        if run_time_left <= 0:
-            print("=========================")
-            print("Run #", count_run)
-            well_number = 1
-            
-            for location in gcode_string_list:
-                # print(gcode_string)
-                printer.run_gcode(location)
-                print("Going to Well Number:", well_number)
-                time.sleep(4)
-                if values[EXP_RADIO_PREVIEW_KEY] == True:
-                    print("Preview Mode is On, only showing preview camera \n")
-                    # camera.start_preview(fullscreen=False, window=(30, 30, 500, 500))
-                    # time.sleep(5)
-                    
-                    # camera.stop_preview()
-                elif values[EXP_RADIO_VID_KEY] == True:
-                    print("Recording Video Footage")
-                    file_full_path = P.get_file_full_path(folder_path, well_number)
-                    # TODO: Change to Video Captures
-                    # camera.capture(file_full_path)
-                elif values[EXP_RADIO_PIC_KEY] == True:
-                    print("Taking Pictures Only")
-                    file_full_path = P.get_file_full_path(folder_path, well_number)
-                    # print(file_full_path)
-                    
-                    # Change Image Capture Resolution
-                    # pic_width = PIC_WIDTH
-                    # pic_height = PIC_HEIGHT
-                    
-                    #camera.stop_preview()
-                    #camera.resolution = (pic_width, pic_height)
-                    # time.sleep(.1)
-                    #camera.capture(file_full_path)
-                    # camera.start_preview()
-                    #start_camera_preview(event, values, camera, preview_win_id)
-                    
-                    get_well_picture(camera, file_full_path)
-                    
-                    data_row = GCS.gen_cam_data(file_full_path, camera)
-                    GCS.append_to_csv_file(data_row)
-                    
-                    # Return to streaming resolution: 640 x 480 (or it will crash)
-                    # Bug: Crashes anyway because of threading
-                    #camera.resolution = (VID_WIDTH, VID_HEIGHT)
-                    # TODO: Look up Camera settings to remove white balance (to deal with increasing brightness)
-                # Outside if/elif chain
-                well_number += 1
-            # Outside of location for loop
-            count_run += 1
-            # Reset run_time_left
-            run_time_left = run_seconds
-
-            # Reset run_start
-            run_start = time.monotonic()
-
-            print(f"Will wait {run_seconds} sec before doing next run.")
-
-            # Display time left until end of experiment
-            print(f"Time left until end of experiment: {(total_seconds - elapsed_seconds):.1f} sec")
-            # May implement the following to break out of loop first. Helpful for lots of wells
-            """    
-            if is_running_experiment == False:
-                print("Stopping Experiment...")
-                return
-            """
-            
-        # Out of if run_time < 0 statement
-        
-        
-        current_time = time.monotonic()
-        elapsed_seconds = current_time - start_time
-        
-        run_elapsed = current_time - run_start
-        run_time_left = run_seconds - run_elapsed
-        
-        # if elapsed_seconds + run_seconds < total_seconds:
-            # print(f"Will wait {run_seconds} seconds until collecting data again")
-            # time.sleep(run_seconds)
-        if elapsed_seconds + run_seconds > total_seconds:
-            print(f"Doing another run will go over set time limit, stopping experiment.")
-            is_running_experiment = False
-            break
-        
-        
-        # Use For Loop to go through each location
-        # TODO: Preview doesn't show preview camera
-        # Original
-        # for location in gcode_string_list:
-            # # print(location)
-            # printer.run_gcode(location)
-            # time.sleep(5)
-        
-        
-    print("=========================")
-    print("Experiment Stopped")
-    print("=========================")
+    EE.run_job_queue(job_queue, camera, lambda: is_running_experiment, PIC_SAVE_FOLDER, (PIC_WIDTH, PIC_HEIGHT),
+                     VID_RES)
+    is_running_experiment = False
 
 # Takes in event and values to check for radio selection (Pictures, Videos, or Preview)
 # Takes in CSV filename or location list generated from opening CSV file
@@ -602,14 +606,14 @@ def run_experiment_gui(main_values, camera):
     print(f"gcode_string_list_len: {gcode_string_list_len}")
     
     # Go into Absolute Positioning Mode
-    printer.run_gcode(C.ABSOLUTE_POS)
+    SQ.run_gcode(C.ABSOLUTE_POS)
     
     # Move to first well
     print("Moving to first well and waiting a few seconds")
-    printer.run_gcode(gcode_string_list[0])
+    SQ.run_gcode(gcode_string_list[0])
     
     # Wait to go to well
-    time.sleep(2)
+    MS.wait_for_move(gcode_string_list[0], GUI_MOVE_FALLBACK_TIME)
     print("Done waiting to go to WELL")
     
     
@@ -661,9 +665,9 @@ def run_experiment_gui(main_values, camera):
         well_number = index + 1
         print(f"Well Number: {well_number}")
         
-        printer.run_gcode(gcode_string_list[index])
+        SQ.run_gcode(gcode_string_list[index])
         # Wait to go to well
-        time.sleep(2)
+        MS.wait_for_move(gcode_string_list[index], GUI_MOVE_FALLBACK_TIME)
         
         if main_values[EXP_RADIO_PREVIEW_KEY] == True:
             print("Preview Mode is On, only showing preview camera \n")
@@ -681,7 +685,7 @@ def run_experiment_gui(main_values, camera):
             file_full_path = P.get_file_full_path(folder_path, well_number)
             # print(file_full_path)
             
-            get_well_picture(camera, file_full_path)
+            get_well_picture(camera, file_full_path, main_values[TILED_COPY_KEY])
             
             # camera.capture(file_full_path)
             # TODO: Look up Camera settings to remove white balance (to deal with increasing brightness)
@@ -761,108 +765,92 @@ def get_sample(folder_path_sample, well_number, values):
     pass
 
 
-def get_video(camera):
-    
-    # Create Unique Filename
-    current_time = datetime.now()
-    current_time_str = current_time.strftime("%Y-%m-%d_%H%M%S")
-    filename = f"video_{current_time_str}.h264"
+def get_video(camera, duration_seconds=VR.VIDEO_DURATION_SECONDS, bitrate=VR.VIDEO_BITRATE):
     
-    # Set Recording Time (in seconds)
-    recording_time = int(1 * 5)
+    # Create Unique Filename, saved with the pictures (was the current working directory)
+    h264_full_path = f"{PIC_SAVE_FOLDER}/video_{get_unique_id()}{VR.VIDEO_EXTENSION}"
     
-    camera.start_recording(filename)
-    camera.wait_recording(recording_time)
-    camera.stop_recording()
+    VR.record_video(camera, h264_full_path, duration_seconds, bitrate)
     
-    print(f"Recorded Video: {filename}")
+    # Mux to MP4 in the background, the GUI keeps going
+    video_muxer = VR.VideoMuxer(name="Vid Muxer")
+    video_muxer.submit(h264_full_path, camera.framerate)
+    threading.Thread(target=video_muxer.close, name="Vid Muxer Close", daemon=True).start()
 
 
-def get_picture(camera):
+def get_picture(camera, is_tiled_copy=SAVE_TILED_COPY):
     # TODO: Change variables here to Global to match changes in Camera Tab
     # Take a Picture, 12MP: 4056x3040
     pic_width = PIC_WIDTH
     pic_height = PIC_HEIGHT
     unique_id = get_unique_id()
     pic_save_name = f"test_{unique_id}_{pic_width}x{pic_height}.jpg"
+    pic_save_full_path = f"{PIC_SAVE_FOLDER}/{pic_save_name}"
     
-    # TOM edit
-    MAX_CAM_RETRY=20      # number of time to retry camera read if failed
-    camErrorCount=0
-    camSuccess=0
-    while camErrorCount<MAX_CAM_ERROR_COUNT and camSuccess==0: # keep on trying many times if failed to read camera
-        try:
-            camera.resolution = (pic_width, pic_height)     # camera.resolution = (2592, 1944)
-            pic_save_full_path = f"{PIC_SAVE_FOLDER}/{pic_save_name}"
-            camera.capture(pic_save_full_path)
-            print(f"Saved Image: {pic_save_full_path}")
-            camera.resolution = (VID_WIDTH, VID_HEIGHT) # Return to streaming resolution: 640 x 480 (or it will crash)
-            camSuccess=1 # if code got here, must have read camera successfully, so set flag to quit retry loop
-        except:
-            camErrorCount+=1
-            print("Cam error in 'get_picture', attempt:',camErrorCount, ' out of:',MAX_CAM_RETRY)
-            time.delay(1)   # wait one second to give camera a rest before retrying
-    pass
+    # TOM edit: Retry camera if it fails (retries are in module_capture_session)
+    # Returns to streaming resolution after capture (or it will crash)
+    capture_picture(camera, pic_save_full_path, "get_picture", is_tiled_copy)
+    return pic_save_full_path
 
 
-def get_well_picture(camera, file_full_path):
+def get_well_picture(camera, file_full_path, is_tiled_copy=SAVE_TILED_COPY):
     # TODO: Change variables here to Global to match changes in Camera Tab
-    # Take a Picture, 12MP: 4056x3040
-    pic_width = PIC_WIDTH
-    pic_height = PIC_HEIGHT
-    # unique_id = get_unique_id()
-    # pic_save_name = f"well{well_number}_{unique_id}_{pic_width}x{pic_height}.jpg"
-    
-    # TOM edit
-    MAX_CAM_RETRY=20      # number of time to retry camera read if failed
-    camErrorCount=0
-    camSuccess=0
-    while camErrorCount<MAX_CAM_ERROR_COUNT and camSuccess==0: # keep on trying many times if failed to read camera
+    # Take a Picture, 12MP: 4056x3040 (PIC_WIDTH x PIC_HEIGHT)
+    
+    # TOM edit: Retry camera if it fails (retries are in module_capture_session)
+    # For many wells in a row, use a CaptureSession instead so the resolution only changes once
+    capture_picture(camera, file_full_path, "get_well_picture", is_tiled_copy)
+    
+    # Tiled copy written from the raw frame, later stages read tiles from it (module_tiled_image)
+    tiled_full_path = TI.get_tiled_path(file_full_path)
+    if is_tiled_copy and os.path.isfile(tiled_full_path):
+        return TI.TiledImage(tiled_full_path)
+    return None
+
+
+def capture_picture(camera, file_full_path, name, is_tiled_copy=SAVE_TILED_COPY):
+    # With is_tiled_copy the raw frame goes through a capture pipeline, which writes the picture
+    # and its .npy copy from the same frame (the JPEG is never decoded again)
+    pic_res = (PIC_WIDTH, PIC_HEIGHT)
+    with CS.CaptureSession(camera, pic_res, VID_RES, settle_time=0, name=name) as session:
+        if not is_tiled_copy:
+            session.capture(file_full_path)
+            return
+        capture_pipeline = CP.CapturePipeline(num_workers=1, name=f"{name} Capture Pipeline", save_tiled=True)
         try:
-            camera.resolution = (pic_width, pic_height) 
-            # camera.resolution = (2592, 1944)
-            # pic_save_full_path = f"{PIC_SAVE_FOLDER}/{pic_save_name}"
-            camera.capture(file_full_path)
-            print(f"Saved Image: {file_full_path}")
-            camera.resolution = (VID_WIDTH, VID_HEIGHT) # Return to streaming resolution: 640 x 480 (or it will crash)
-            camSuccess=1 # if code got here, must have read camera successfully, so set flag to quit retry loop
-        except:
-            camErrorCount+=1
-            print("Cam error in 'get_well_picture', attempt:',camErrorCount, ' out of:',MAX_CAM_RETRY)
-            time.delay(1)   # wait one second to give camera a rest before retrying
-    pass
+            session.capture_to_pipeline(capture_pipeline, file_full_path)
+        finally:
+            capture_pipeline.close()
 
 
 
-def get_x_pictures(x, delay_seconds, camera):
+def get_x_pictures(x, delay_seconds, camera, use_video_port=BURST_USE_VIDEO_PORT):
     
     # Set Camera Resolution
     pic_width = PIC_WIDTH
     pic_height = PIC_HEIGHT
-    camera.resolution = (pic_width, pic_height)
     
     # Stop Preview?
     camera.stop_preview()
     
-    # Run loop x times
+    # Create all Save Names up front, the index keeps names unique within the same second
+    unique_id = get_unique_id()
+    pic_save_full_path_list = []
     for i in range(x):
+        pic_save_name = f"test_{unique_id}_{i:03d}_{pic_width}x{pic_height}.jpg"
+        pic_save_full_path_list.append(f"{PIC_SAVE_FOLDER}/{pic_save_name}")
     
-        # Create Unique ID
-        unique_id = get_unique_id()
-        # Create Save Name from Unique ID
-        pic_save_name = f"test_{unique_id}_{pic_width}x{pic_height}.jpg"
-        # Create Full Save Path using Save Name and Save Folder
-        pic_save_full_path = f"{PIC_SAVE_FOLDER}/{pic_save_name}"
-        # Capture Image
-        camera.capture(pic_save_full_path)
-        # Print that picture was saved
-        print(f"Saved Image: {pic_save_full_path}")
-        # Wait Delay Amount
-        time.sleep(delay_seconds)
-    
-    print(f"Done taking {x} pictures.")
-    # Return Camera Resolution?
-    camera.resolution = (VID_WIDTH, VID_HEIGHT)
+    # Burst: camera port stays set up between pictures (delay 0 = as fast as the sensor allows),
+    # pictures are kept in memory and saved by background workers
+    capture_pipeline = None
+    if USE_CAPTURE_PIPELINE:
+        capture_pipeline = CP.CapturePipeline(name="Pic x Capture Pipeline")
+    with CS.CaptureSession(camera, (pic_width, pic_height), VID_RES, settle_time=0, name="get_x_pictures") as session:
+        num_captured = session.capture_burst(pic_save_full_path_list, delay_seconds, use_video_port, capture_pipeline)
+    if capture_pipeline is not None:
+        capture_pipeline.close()
+    
+    print(f"Done taking {num_captured} pictures.")
     
     pass
 
@@ -883,8 +871,37 @@ def check_for_digits_in_key(key_str, window, event, values):
             window[key_str].update(values[key_str][:-1])
 
 
-def create_z_stack(z_start, z_end, z_increment, save_folder_location, camera):
+def get_z_stack_inputs(values):
+    # Tab 4 (Z Stack) inputs: (z_start, z_end, z_increment, bracket_slices) with z_start <= z_end and
+    # z_increment > 0, None (and prints why) if not valid
+    try:
+        z_start = float(values[Z_START_KEY])
+        z_end = float(values[Z_END_KEY])
+        z_increment = float(values[Z_INC_KEY])
+        bracket_slices = int(values[Z_BRACKET_KEY])
+    except ValueError:
+        print("Error: Z Start/End/Increment must be numbers and Bracket Slices a whole number")
+        return None
+    if z_increment == 0:
+        print("Error: Z Increment can't be 0")
+        return None
+    if bracket_slices < 0:
+        print("Error: Bracket Slices can't be negative")
+        return None
+    # Descending stacks (Z End below Z Start, or a negative increment) are captured bottom to top,
+    # autofocus (module_autofocus.FocusSearch) only takes an increasing range
+    if z_end < z_start or z_increment < 0:
+        z_start, z_end = min(z_start, z_end), max(z_start, z_end)
+        z_increment = abs(z_increment)
+        print(f"Z Stack: using {z_start} to {z_end} by {z_increment}")
+    return z_start, z_end, z_increment, bracket_slices
+
+
+def create_z_stack(z_start, z_end, z_increment, save_folder_location, camera, is_autofocus=False,
+                   bracket_slices=AF.BRACKET_SLICES):
     # Assumes all inputs are floating or integers, no letters!
+    # is_autofocus: find the sharpest Z on small video frames first (module_autofocus),
+    #               then only capture it and bracket_slices slices on each side
     print("create_z_stack")
     print("Pausing Video Stream")
 
@@ -893,7 +910,7 @@ def create_z_stack(z_start, z_end, z_increment, save_folder_location, camera):
 
     # Go into Absolute Mode, "G90"
     # Run GCODE to go into Absolute Mode
-    printer.run_gcode(C.ABSOLUTE_POS)
+    SQ.run_gcode(C.ABSOLUTE_POS)
 
     # Will use absolute location mode to go to each z
     # Alternative, you could use relative and get current location to get z value.
@@ -913,9 +930,21 @@ def create_z_stack(z_start, z_end, z_increment, save_folder_location, camera):
     
     # Go to first location, wait x seconds?
 
-    # Mark where we think z_focus is?
+    if is_autofocus:
+        # Camera is still at video resolution here, focus frames come from the video port
+        focus_search = AF.FocusSearch(camera, z_start, z_end, z_increment)
+        best_z = focus_search.find_best_z()
+        focus_search.save_scores_csv(f"{save_folder_path}/focus_scores.csv")
+        z_list = focus_search.get_bracket(best_z, bracket_slices)
+    else:
+        z_list = np.arange(z_start, z_end+z_increment, z_increment)
+    
+    # Change to max resolution once for the whole stack
+    capture_session = CS.CaptureSession(camera, PIC_RES, VID_RES, name="Z Stack Capture Session")
+    capture_session.start()
 
-    for z in np.arange(z_start, z_end+z_increment, z_increment):
+    for z in z_list:
+        slice_start_ns = time.monotonic_ns()
         print(f"z: {z}")
         # Make sure number gets rounded to 2 decimal places (ex: 25.23)
 
@@ -933,28 +962,27 @@ def create_z_stack(z_start, z_end, z_increment, save_folder_location, camera):
 
         # Go to z location using printer_connection module's run_gcode
         # Possible bug, could this module be used elsewhere? This code may have to run in the same location as the GUI.
-        printer.run_gcode(gcode_str)
-        # Wait x seconds for extruder to get to location.
-        time.sleep(2)
+        SQ.run_gcode(gcode_str)
+        # Wait for extruder to get to location (fixed sleep if sync fails).
+        MS.wait_for_move(gcode_str, Z_STACK_MOVE_FALLBACK_TIME)
 
 
         # Take Picture and save to folder location
         save_file_name = f"_image_{z_rounded_str}_.jpg"
         save_full_path = f"{save_folder_path}/{save_file_name}"
         
-        # Change to max resolution
-        camera.resolution = PIC_RES
-        
-        
-        camera.capture(save_full_path)
-        
-        # Change back to streaming resolution
-        camera.resolution = VID_RES
+        capture_session.capture(save_full_path)
+        TR.add_span("z_slice", slice_start_ns, time.monotonic_ns(), args={"z": z_rounded})
 
+    # Change back to streaming resolution
+    capture_session.stop()
+    
+    if TR.is_enabled():
+        TR.export_chrome_trace(os.path.join(save_folder_path, f"trace_{get_unique_id()}.json"))
     
     print(f"Done Creating Z Stack at {save_folder_path}")
 
-    pass
+    return save_folder_path
 
 
 # Define function to get current location
@@ -977,58 +1005,17 @@ def get_current_location2():
     # If negative value, then location was not found
     result = {"X": -1.00, "Y": -1.00, "Z": -1.00}
     
-    # Number of attempts to check for location (how many times to run for loop)
-    num_location_checks = 10
-    
-    # Number of location grabs until that one is accepted (in case of outdated location)
-    num_until_location_accepted = 1
-    
-    # Init location_found_counter (want loc to be found at least once since old one is stored)
-    location_found_counter = 0
-    
-    num_searches = 0
-    for i in range(num_location_checks):
-        num_searches += 1
-        # Uncomment print statement for debugging
-        # print(f"Location Search Attempt: {i}")
-        # Run M114 GCODE
-        printer.run_gcode("M114")
-        # Make GUI wait for 3D printer to receive and process command.
-        # May need to make this adjustable in the future.
-        time.sleep(1)
-        serial_string = printer.get_serial_data2()
-        if GCL.does_location_exist_m114(serial_string) == True:
-            
-            current_location_dictionary, is_location_found = GCL.parse_m114(serial_string)
-            
-            if location_found_counter == 0:
-                location_found_counter += 1
-                # Uncomment print statement for debugging
-                # print("Location Found, but might be outdated. Trying again")
-                continue
-            elif location_found_counter >= num_until_location_accepted:
-                result = current_location_dictionary
-                print("Location Found, Stopping Search.")
-                break
-        else:
-            print("Location Not Found, Trying Again...")
-            # If location not found, wait a second in case there is a buffer issue?
-            # If no data found, get_serial_data2 ran at least 20 times, so used default empty string
-            #   Should try again
-            """
-            print(f"Data Found: {serial_string}")
-            if len(serial_string) == 0:
-                print("No data found")
-            """
-            time.sleep(1)
-            continue
-        
-        # Get Serial Data
-        # If location exist in serial string, increment location_found_counter by 1, start while loop again
-        #   If loc exist and counter is 1, save location
-        # If location does not exist, don't increment, start while loop again
-    
-    print(f"Number of Location Retrieval Attempts: {num_searches}")
+    # One M114 round trip: old serial data is thrown away first, so the
+    # first location found is the current one (see module_position_query)
+    query_start = time.monotonic()
+    try:
+        # Through the serial command queue (it owns the port once SQ.start is called)
+        result = PQ.query_position()
+        print("Location Found, Stopping Search.")
+    except PQ.PositionQueryError as e:
+        print(f"Location Not Found: {e}")
+    
+    print(f"Location Query Time: {time.monotonic() - query_start:.3f} sec")
     print("**Note: If all coord are -1.00, then location was not found")
     print(f"Location: {result}")
     return result
@@ -1070,72 +1057,19 @@ def get_max_screen_resolution():
     Gets Max Screen Resolution,
     returns max_screen_width, max_screen_height in pixels
     """
-    max_screen_width = 0
-    max_screen_height = 0
-    
-    d = Display()
-    
-    info = d.screen(DEFAULT_SCREEN_INDEX)
-    
-    max_screen_width = info.width_in_pixels
-    max_screen_height = info.height_in_pixels
-    
-    # print(f"Width: {max_screen_width}, height: {max_screen_height}")
-    """
-    for screen in range(0,screen_count):
-        info = d.screen(screen)
-        print("Screen: %s. Default: %s" % (screen, screen==default_screen))
-        print("Width: %s, height: %s" % (info.width_in_pixels,info.height_in_pixels))
-    """
-    
-    d.close()
-    
-    return max_screen_width, max_screen_height
+    # Uses the shared display connection (module_window_helper)
+    return WH.get_window_helper().get_screen_resolution()
 
 
 def get_xy_loc_of_all_windows():
-    disp = Display()
-    root = disp.screen().root
-    children = root.query_tree().children
-    
-    loc_x_list = []
-    loc_y_list = []
-    
-    for win in children:
-        winName = win.get_wm_name()
-        pid = win.id
-        x, y, width, height = get_absolute_geometry(win, root)
-        
-        loc_x_list.append(x)
-        loc_y_list.append(y)
-    
-    disp.close()
-    
-    return loc_x_list, loc_y_list
+    return WH.get_window_helper().get_xy_loc_of_all_windows()
 
 
 def get_unique_xy_loc():
-    loc_x_list, loc_y_list = get_xy_loc_of_all_windows()
-    
-    # Get unique values from list only, remove negatives
-    x_exclude_list = list(set(loc_x_list))
-    y_exclude_list = list(set(loc_y_list))
-    
-    # print("After Set Stuff")
-    # print(f"x_exclude_list: {x_exclude_list}")
-    # print(f"y_exclude_list: {y_exclude_list}")
-    
-    # Random Int selection for x and y, exclude unique values above,
-    # max would be max screen resolution
-    
-    # Get max screen width and height
-    max_screen_width, max_screen_height = get_max_screen_resolution()
-    
-    # Use set subtraction to create list of integers for random choice
-    # (is faster than using a for loop to remove numbers)
-    
-    x_start = random.choice(list(set([x for x in range(0, max_screen_width)]) - set(x_exclude_list)))
-    y_start = random.choice(list(set([y for y in range(0, max_screen_height)]) - set(y_exclude_list)))
+    # Random Int selection for x and y, excluding x/y values other windows already use,
+    # max would be max screen resolution.
+    # Picks without building a list of every pixel (see module_window_helper.pick_free_coordinate)
+    x_start, y_start = WH.get_window_helper().get_unique_xy_loc()
     # print(f"x_start: {x_start}")
     # print(f"y_start: {y_start}")
     
@@ -1144,150 +1078,27 @@ def get_unique_xy_loc():
 
 def get_window_pid(x_start, y_start):
     print("***get_window_pid()***")
-    disp = Display()
-    root = disp.screen().root
-    children = root.query_tree().children
-    
-    result_pid = 0
-    
-    for win in children:
-        winName = win.get_wm_name()
-        pid = win.id
-        x, y, width, height = get_absolute_geometry(win, root)
-        
-        if x == x_start and y == y_start:
-            """
-            print("======Children=======")
-            print(f"winName: {winName}, pid: {pid}")
-            print(f"x:{x}, y:{y}, width:{width}, height:{height}")
-            """
-            # print(f"wm: {win.get_window_title()}")
-            
-            # Move Window x = 50, y = 20
-            # win.configure(x=x+50)
-            # win.configure(x=400, y=36)
-            
-            # Set Window Name to "Camera Preview Window"
-            # win.set_wm_name("Camera Preview Window")
-            
-            result_pid = pid
-            break
-    
-    disp.close()
-    
-    return result_pid
+    # Finds the window at x_start, y_start and caches it in the window helper
+    return WH.get_window_helper().find_window_at(x_start, y_start)
 
 
 def get_window_location_from_pid(search_pid):
     # print("get_window_location_from_pid")
     # print(f"search_pid: {search_pid}")
-    
-    disp = Display()
-    root = disp.screen().root
-    children = root.query_tree().children
-    
-    x_win, y_win = 0, 0
-    
-    for win in children:
-        winName = win.get_wm_name()
-        pid = win.id
-        x, y, width, height = get_absolute_geometry(win, root)
-        
-        if pid == search_pid:
-            """
-            print("======Children=======")
-            print(f"winName: {winName}, pid: {pid}")
-            print(f"x:{x}, y:{y}, width:{width}, height:{height}")
-            """
-            
-            x_win = x
-            y_win = y
-            
-            break
-    
-    # print(f"x_win:{x_win}, y_win:{y_win}")
-    return x_win, y_win
-    disp.close()
+    return WH.get_window_helper().get_window_location_from_id(search_pid)
 
 
 def move_window_pid(search_pid, x_new, y_new):
     print("***move_window_pid()***")
     # print(f"search_pid: {search_pid}")
-    disp = Display()
-    root = disp.screen().root
-    children = root.query_tree().children
-    
-    for win in children:
-        winName = win.get_wm_name()
-        pid = win.id
-        x, y, width, height = get_absolute_geometry(win, root)
-        
-        if pid == search_pid:
-            """
-            print("======Children=======")
-            print(f"winName: {winName}, pid: {pid}")
-            print(f"x:{x}, y:{y}, width:{width}, height:{height}")
-            """
-            
-            print(f"Moving Window Name: {winName}, pid: {pid}")
-            win.configure(x=x_new, y=y_new)
-            
-            break
-    
-    disp.close()
+    WH.get_window_helper().move_window(search_pid, x_new, y_new)
 
 
 def change_window_name(search_pid, new_window_name):
     print("***change_window_name()***")
     # Change Window Name of Specific PID
     # print(f"search_pid: {search_pid}")
-    disp = Display()
-    root = disp.screen().root
-    children = root.query_tree().children
-    
-    for win in children:
-        winName = win.get_wm_name()
-        pid = win.id
-        x, y, width, height = get_absolute_geometry(win, root)
-        
-        if pid == search_pid:
-            """
-            print("======Children=======")
-            print(f"winName: {winName}, pid: {pid}")
-            print(f"x:{x}, y:{y}, width:{width}, height:{height}")
-            """
-            
-            win.set_wm_name(new_window_name)
-            
-            break
-    disp.close()
-
-
-def get_absolute_geometry(win, root):
-    """
-    Returns the (x, y, height, width) of a window relative to the
-    top-left of the screen.
-    """
-    geom = win.get_geometry()
-    (x, y) = (geom.x, geom.y)
-    
-    # print("Start")
-    # print(f"x: {x}, y: {y}")
-    
-    while True:
-        parent = win.query_tree().parent
-        pgeom = parent.get_geometry()
-        x += pgeom.x
-        y += pgeom.y
-        
-        if parent.id == root.id:
-            # print("parent id matches root id. Breaking...")
-            break
-        win = parent
-    
-    # print("End")
-    # print(f"x: {x}, y: {y}")
-    return x, y, geom.width, geom.height
+    WH.get_window_helper().set_window_name(search_pid, new_window_name)
 # === End Camera Preview Window Functions ===
 
 
@@ -1472,20 +1283,10 @@ def main():
     global PIC_WIDTH, PIC_HEIGHT, PIC_SAVE_FOLDER, is_running_experiment
 
     # Setup Camera
-    # initialize the camera and grab a reference to the raw camera capture
-    camera = PiCamera()
-    camera.resolution = (VID_WIDTH, VID_HEIGHT)
-    camera.framerate = 32
-    # MHT: 270
-    # camera.rotation = 270
-
-    # Cell Sensor, at home, 90
-    # camera.rotation = 90
-    
-    # MHT: 270, Cell Sensor: 90
+    # initialize the camera (PiCamera, or simulated camera with ROBOCAM_BACKEND=sim)
+    camera = BK.create_camera()
+    # MHT: 270, Cell Sensor: 90 (EE.CAMERA_ROTATION)
     # camera.rotation = C.CAMERA_ROTATION_ANGLE
-    # Lab stuff
-    camera.rotation = 270
     
     # Set Camera Settings:
     # Set Exposure mode
@@ -1494,22 +1295,9 @@ def main():
     # Set AWB Mode
     # camera.awb_mode = 'tungsten'
     
-    # Let Camera Settings Settle:
-    pre_value = camera.digital_gain
-    cur_value = -1
-    # for i in range(20):
-    # Wait for digital gain values to settle, then break out of loop
-    while pre_value != cur_value:
-        pre_value = cur_value
-        # pre gets cur 
-        # cur get new
-        
-        cur_value = camera.digital_gain
-        #if pre_value != cur_value:
-        #    pre_value = cur_value
-        
-        print(f"digital_gain: {cur_value}")
-        time.sleep(0.5)
+    # Streaming resolution, framerate 32, rotation 270 (lab), then let camera settings settle:
+    # waits for digital gain values to settle (at most EE.GAIN_SETTLE_TIMEOUT seconds)
+    EE.setup_camera(camera, (VID_WIDTH, VID_HEIGHT))
     
     
     # rawCapture = PiRGBArray(camera, size=(VID_WIDTH, VID_HEIGHT))
@@ -1523,6 +1311,9 @@ def main():
     path_list = printer.get_path_list_csv(csv_filename)
     printer.initial_setup(path_list)
     
+    # From now on, one thread owns the serial port: GUI and experiment GCODE go through its queue
+    SQ.start(printer.printer)
+    
     
     # Move Extruder Out Of The Way
     x_start = 0
@@ -1573,13 +1364,28 @@ def main():
     # TODO: Create 3 Radio Buttons for Picture, Video, Preview (Default), and Prompt "Choose to take Pictures, Video, or only preview locations"
     # TODO: Create User Input for number of Trials (use placeholder)
     time_layout = ET.get_time_layout()
+    # Jobs for "Run Queue" (module_job_queue), saved next to the experiment folders
+    job_queue = JQ.JobQueue(JQ.get_job_queue_path(PIC_SAVE_FOLDER))
     tab_1_layout = [ [sg.Text(OPEN_CSV_PROMPT), sg.Input(), sg.FileBrowse(key=OPEN_CSV_FILEBROWSE_KEY)],
                      time_layout[0], time_layout[1], time_layout[2], time_layout[3], time_layout[4],
                      [sg.Text(EXP_RADIO_PROMPT)],
                      [sg.Radio(EXP_RADIO_PIC_TEXT, EXP_RADIO_GROUP, default=False, key=EXP_RADIO_PIC_KEY),
                         sg.Radio(EXP_RADIO_VID_TEXT, EXP_RADIO_GROUP, default=False, key=EXP_RADIO_VID_KEY),
                         sg.Radio(EXP_RADIO_PREVIEW_TEXT, EXP_RADIO_GROUP, default=True, key=EXP_RADIO_PREVIEW_KEY)],
-                     [sg.Button(START_EXPERIMENT, disabled=True), sg.Button(STOP_EXPERIMENT, disabled=True)]
+                     [sg.Checkbox(OPTIMIZE_PATH_TEXT, default=False, key=OPTIMIZE_PATH_KEY),
+                        sg.Checkbox(ALTERNATE_DIRECTION_TEXT, default=False, key=ALTERNATE_DIRECTION_KEY),
+                        sg.Checkbox(FOCUS_MAP_TEXT, default=False, key=FOCUS_MAP_KEY),
+                        sg.Checkbox(TILED_COPY_TEXT, default=SAVE_TILED_COPY, key=TILED_COPY_KEY)],
+                     [sg.Text("Video Length (sec):"), sg.InputText(VR.VIDEO_DURATION_SECONDS, size=(5, 1), key=VIDEO_DURATION_KEY),
+                        sg.Text("Video Bitrate (Mbps):"), sg.InputText(VR.VIDEO_BITRATE // 1000000, size=(5, 1), key=VIDEO_BITRATE_KEY)],
+                     [sg.Text("If a Run Is Late:"), sg.Combo(RS.OVERRUN_POLICY_LIST, default_value=RS.OVERRUN_POLICY,
+                        readonly=True, key=OVERRUN_POLICY_KEY)],
+                     [sg.Button(START_EXPERIMENT, disabled=True), sg.Button(STOP_EXPERIMENT, disabled=True)],
+                     [sg.Text("Resume Folder:"), sg.In(size=(25,1), key=RESUME_FOLDER_KEY), sg.FolderBrowse(),
+                        sg.Button(RESUME_EXPERIMENT)],
+                     [sg.Text("Priority:"), sg.InputText(JQ.DEFAULT_PRIORITY, size=(3, 1), key=JOB_PRIORITY_KEY),
+                        sg.Button(ADD_JOB), sg.Button(RUN_JOB_QUEUE), sg.Button(REMOVE_JOB)],
+                     [sg.Listbox(job_queue.get_summary_list(), size=(60, 4), key=JOB_LIST_KEY)]
                    ]
     
     # Tab 2: Movement Tab
@@ -1618,6 +1424,9 @@ def main():
                        [sg.Text("Z Start:"), sg.InputText("0", size=(7, 1), enable_events=True, key=Z_START_KEY),
                         sg.Text("Z End:"),sg.InputText("2", size=(7, 1), enable_events=True, key=Z_END_KEY),
                         sg.Text("Z Inc:"),sg.InputText("0.5", size=(7, 1), enable_events=True, key=Z_INC_KEY)],
+                       [sg.Checkbox(Z_AUTOFOCUS_TEXT, default=False, key=Z_AUTOFOCUS_KEY),
+                        sg.Text("Bracket Slices:"), sg.InputText(AF.BRACKET_SLICES, size=(4, 1), key=Z_BRACKET_KEY)],
+                       [sg.Checkbox(Z_FUSE_TEXT, default=False, key=Z_FUSE_KEY)],
                        [sg.Text("Save Folder Location:"), sg.In(size=(25,1), enable_events=True, key=SAVE_FOLDER_KEY), sg.FolderBrowse()],
                        [sg.Button(START_Z_STACK_CREATION_TEXT)]
                    ]
@@ -1693,8 +1502,11 @@ def main():
     # Initialize folder_path_sample to "" ("Start Experiment" will create unique folder name)
     # **** Note: This for loop may cause problems if the camera feed dies, it will close everything? ****
     # for frame in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+    # Listens for Preview Window move events (created once the Preview Window ID is known)
+    preview_watcher = None
     while True:
-        event, values = window.read(timeout=0)
+        # Wait for an event (or timeout) instead of busy polling
+        event, values = window.read(timeout=WINDOW_GUI_TIMEOUT)
         event_p, values_p = window_p.read(timeout=0)
         
         # Camera Preview Initial Startup
@@ -1716,12 +1528,19 @@ def main():
             # Start Camera Too PREVIEW_LOC_X, PREVIEW_LOC_Y, PREVIEW_WIDTH, PREVIEW_HEIGHT, PREVIEW_ALPHA
             camera.start_preview(alpha=PREVIEW_ALPHA, fullscreen=False, window=(PREVIEW_LOC_X, y_new + PREVIEW_WINDOW_OFFSET, PREVIEW_WIDTH, PREVIEW_HEIGHT))
             
+            # Listen for Preview Window moves (ConfigureNotify) from now on
+            preview_watcher = WH.PreviewWindowWatcher(preview_win_id)
+            
             # Change is_initial_startup to False
             is_initial_startup = False
         else:
             # print(f"is_initial_startup: {is_initial_startup}")
-            # get location of Preview Window using PID
-            x_win_preview, y_win_preview = get_window_location_from_pid(preview_win_id)
+            # get location of Preview Window from its latest move event (None if it didn't move)
+            moved_location = preview_watcher.get_moved_location()
+            if moved_location is not None:
+                x_win_preview, y_win_preview = moved_location
+            else:
+                x_win_preview, y_win_preview = PREVIOUS_CAMERA_PREVIEW_X, PREVIOUS_CAMERA_PREVIEW_Y
             # print(f"x_win_preview:{x_win_preview}, y_win_preview:{y_win_preview}")
             # camera.start_preview(alpha=255, fullscreen=False, window=(x_win_preview, y_win_preview, 640, 480))
             
@@ -1771,6 +1590,9 @@ def main():
             # print("CSV File Does Not Exist")
             # Disable "Start Experiment" button
             window[START_EXPERIMENT].update(disabled=True)
+        # "Resume Experiment" and "Run Queue" only while no experiment is running
+        window[RESUME_EXPERIMENT].update(disabled=is_running_experiment)
+        window[RUN_JOB_QUEUE].update(disabled=is_running_experiment)
         
         # ---- Main GUI Window If/elif chain ----
         if event == sg.WIN_CLOSED:
@@ -1799,6 +1621,54 @@ def main():
             # Non-Thread Version of Running Experiment
             # run_experiment_gui(values, camera)
             
+        elif event == RESUME_EXPERIMENT:
+            print("You pressed Resume Experiment")
+            resume_folder = values[RESUME_FOLDER_KEY]
+            if not os.path.isfile(EJ.get_journal_path(resume_folder)):
+                print(f"No experiment journal in: {resume_folder}")
+            else:
+                is_running_experiment = True
+                window[START_EXPERIMENT].update(disabled=True)
+                window[RESUME_EXPERIMENT].update(disabled=True)
+                window[STOP_EXPERIMENT].update(disabled=False)
+                experiment_thread = threading.Thread(target=resume_experiment, args=(resume_folder, camera), daemon=True)
+                experiment_thread.start()
+            
+        elif event == ADD_JOB:
+            print("You pressed Add to Queue")
+            try:
+                job_priority = int(values[JOB_PRIORITY_KEY] or JQ.DEFAULT_PRIORITY)
+            except ValueError:
+                job_priority = None
+            if len(values[OPEN_CSV_FILEBROWSE_KEY]) == 0:
+                print("Load a CSV file first")
+            elif job_priority is None:
+                print(f"Error: Priority must be a whole number, got: {values[JOB_PRIORITY_KEY]!r}")
+            else:
+                total_seconds, run_seconds = ET.get_hour_min(event, values)
+                job_values = {key: values[key] for key in JOURNAL_VALUE_KEYS}
+                job_queue.add_job(values[OPEN_CSV_FILEBROWSE_KEY], total_seconds, run_seconds, job_values,
+                                  job_priority)
+                window[JOB_LIST_KEY].update(job_queue.get_summary_list())
+            
+        elif event == REMOVE_JOB:
+            print("You pressed Remove Job")
+            for index in window[JOB_LIST_KEY].get_indexes():
+                job = job_queue.job_list[index]
+                if not job_queue.remove_job(job.job_id):
+                    print(f"Can't remove {job.get_name()} while it's running")
+            window[JOB_LIST_KEY].update(job_queue.get_summary_list())
+            
+        elif event == RUN_JOB_QUEUE:
+            print("You pressed Run Queue")
+            is_running_experiment = True
+            window[START_EXPERIMENT].update(disabled=True)
+            window[RUN_JOB_QUEUE].update(disabled=True)
+            window[STOP_EXPERIMENT].update(disabled=False)
+            experiment_thread = threading.Thread(target=run_job_queue, args=(job_queue, camera), daemon=True)
+            experiment_thread.start()
+            window[JOB_LIST_KEY].update(job_queue.get_summary_list())
+            
         elif event == STOP_EXPERIMENT:
             print("You pressed Stop Experiment")
             print("Ending experiment after current run")
@@ -1814,10 +1684,17 @@ def main():
             
             # Stop experiemnt_thread
             experiment_thread.join(timeout=1)
+            window[JOB_LIST_KEY].update(job_queue.get_summary_list())
             
         elif event == "Pic":
             print("You Pushed Pic Button")
-            get_picture(camera)
+            pic_save_full_path = get_picture(camera, values[TILED_COPY_KEY])
+            # Show a small copy (read from the tiled .npy when there is one)
+            try:
+                thumbnail = TI.load_thumbnail(pic_save_full_path, PIC_DISPLAY_RES)
+                window['-IMAGE-'].update(data=cv2.imencode('.png', thumbnail)[1].tobytes())
+            except ValueError as e:
+                print(e)
             # TODO: Change variables here to Global to match changes in Camera Tab
             # Take a Picture, 12MP: 4056x3040
             
@@ -1844,8 +1721,8 @@ def main():
                     # output.tofile(f)
         elif event == "Pic x 10":
             print("Pic x 10")
-            x = 10
-            delay_seconds = 5
+            x = PIC_X_COUNT
+            delay_seconds = PIC_X_DELAY_SECONDS
             get_x_pictures(x, delay_seconds, camera)
             
         elif event == "Vid":
@@ -1875,7 +1752,7 @@ def main():
             run_relative(event, values)
         elif event == "Run":
             # Run GCODE found in the GCode  InputText box
-            printer.run_gcode(values["-GCODE_INPUT-"])
+            SQ.run_gcode(values["-GCODE_INPUT-"])
         elif event == "Clear":
             # Clear GCode InputText box
             window.FindElement("-GCODE_INPUT-").Update("")
@@ -1901,17 +1778,22 @@ def main():
             #print(f"Global: {PIC_WIDTH, PIC_HEIGHT}")
         elif event == START_Z_STACK_CREATION_TEXT:
             print(f"You pressed button: {START_Z_STACK_CREATION_TEXT}")
-            z_start = float(values[Z_START_KEY])
-            z_end = float(values[Z_END_KEY])
-            z_inc = float(values[Z_INC_KEY])
-            
-            # If nothing chosen, use default folder location:
-            if len(values[SAVE_FOLDER_KEY]) == 0:
-                save_folder_location = PIC_SAVE_FOLDER
-            else:
-                save_folder_location = values[SAVE_FOLDER_KEY]
-            print(f"save_folder_location: {save_folder_location}")
-            create_z_stack(z_start, z_end, z_inc, save_folder_location, camera)
+            # Bad input only prints an error, raising here would close the GUI
+            z_stack_inputs = get_z_stack_inputs(values)
+            if z_stack_inputs is not None:
+                z_start, z_end, z_inc, bracket_slices = z_stack_inputs
+                
+                # If nothing chosen, use default folder location:
+                if len(values[SAVE_FOLDER_KEY]) == 0:
+                    save_folder_location = PIC_SAVE_FOLDER
+                else:
+                    save_folder_location = values[SAVE_FOLDER_KEY]
+                print(f"save_folder_location: {save_folder_location}")
+                is_autofocus = values[Z_AUTOFOCUS_KEY]
+                z_stack_folder = create_z_stack(z_start, z_end, z_inc, save_folder_location, camera, is_autofocus, bracket_slices)
+                # Fusion runs in a separate process (module_focus_fusion), the GUI keeps going
+                if values[Z_FUSE_KEY] == True:
+                    FF.start_fusion(z_stack_folder)
         elif event == SAVE_LOC_BUTTON:
             print(f"You pressed: {SAVE_LOC_BUTTON}")
             save_current_location()
@@ -1972,16 +1854,26 @@ def main():
         # rawCapture.truncate(0)
 
     # Out of While Loop
+    if preview_watcher is not None:
+        preview_watcher.close()
+    WH.close_window_helper()
+    
+    # Finish saving any experiment pictures still waiting in the background
+    CP.close_all_pipelines()
+    
     camera.stop_preview()
     
     # Closing Window
     window.close()
     
-    # Closing 3D Printer Serial Connection
+    # Closing 3D Printer Serial Connection (after queued commands are sent)
+    SQ.stop()
     printer.printer.close()
     
     # For loop to show camera feed
     pass
 
-main()
-# call main function
+
+# call main function (only when run as a script, so the experiment functions can be imported)
+if __name__ == "__main__":
+    main()
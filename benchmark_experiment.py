@@ -0,0 +1,311 @@
+"""
+Experiment Throughput Benchmark
+Runs well plate experiments (6, 24, 96, 384 wells by default) through the
+same code as the GUI's "Start Experiment" (module_experiment_engine), using the
+simulated 3D Printer and camera (ROBOCAM_BACKEND=sim, see module_backends).
+
+Reports for each plate:
+-Wells per minute (one run through every well)
+-Time per well spent in each stage: move, settle, capture, encode, write, metadata
+ (encode/write happen on the capture pipeline's background workers, so they overlap the others)
+-Peak memory (RSS) and CPU utilisation (CPU time / wall time, can be over 100% with threads)
+Stage times come from module_trace spans (--trace also saves them as a Chrome trace).
+
+Results are saved as JSON with the git commit, so runs from different commits can be compared:
+    python3 benchmark_experiment.py
+    python3 benchmark_experiment.py --wells 24 96 --compare benchmark_results/benchmark_abc1234_....json
+
+Each plate runs in its own Python process, so peak memory of one plate doesn't carry over to the next.
+Pictures go to a temporary folder that is removed after each plate (--keep-output keeps it, the
+path is in the JSON results).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import module_trace as TR
+
+# ==== BENCHMARK CONSTANTS ====
+DEFAULT_WELL_COUNTS = [6, 24, 96, 384]
+
+# Folder (next to this file) where JSON results are saved
+RESULTS_FOLDER = "benchmark_results"
+
+# Well plate layouts (ANSI/SLAS standard plates): rows, columns, well pitch (mm), A1 offset (mm)
+PLATE_LAYOUTS = {
+    6: (2, 3, 39.12, 24.76, 23.16),
+    24: (4, 6, 19.30, 17.05, 13.67),
+    96: (8, 12, 9.00, 14.38, 11.24),
+    384: (16, 24, 4.50, 12.13, 8.99),
+}
+
+# Where the plate's corner is on the 3D Printer bed, and the camera focus height (mm)
+PLATE_ORIGIN_X = 20.0
+PLATE_ORIGIN_Y = 20.0
+PLATE_Z = 5.0
+
+# Stages reported per well, in order
+STAGE_LIST = ["move", "settle", "capture", "encode", "write", "metadata"]
+
+# module_trace span names that make up each stage ("move" is worked out from the "well" spans)
+STAGE_SPANS = {
+    "settle": ["settle", "fallback_sleep"],
+    "capture": ["capture"],
+    "encode": ["encode"],
+    "write": ["write"],
+    "metadata": ["metadata_snapshot", "metadata_csv_write", "metadata_npz_write"],
+}
+
+
+def get_plate_gcode_list(num_wells):
+    """
+    Description: GCODE locations for every well of a standard plate, row by row (like a well plate CSV)
+    Return/Output: list of GCODE strings, example: "G0X44.76Y43.16Z5.00"
+    """
+    if num_wells not in PLATE_LAYOUTS:
+        raise ValueError(f"No plate layout for {num_wells} wells, choose from {sorted(PLATE_LAYOUTS)}")
+    rows, columns, pitch, offset_x, offset_y = PLATE_LAYOUTS[num_wells]
+    gcode_list = []
+    for row in range(rows):
+        for column in range(columns):
+            x = PLATE_ORIGIN_X + offset_x + column * pitch
+            y = PLATE_ORIGIN_Y + offset_y + row * pitch
+            gcode_list.append(f"G0X{x:.2f}Y{y:.2f}Z{PLATE_Z:.2f}")
+    return gcode_list
+
+
+def get_git_commit():
+    """
+    Return/Output: (commit hash, True if there are uncommitted changes), ("unknown", False) if not a git repo
+    """
+    repo_folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_folder, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_folder,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, len(status) != 0
+
+
+def get_stage_totals(span_list):
+    """
+    Description: Total seconds per stage from module_trace spans.
+                 move = from the start of each well until the printer says it arrived
+                 (sending the GCODE + travel + sync), the other stages add up their spans.
+    Return/Output: Dictionary of stage name to seconds
+    """
+    span_totals = TR.get_stage_totals(span_list)
+    stage_totals = {}
+    for stage, span_names in STAGE_SPANS.items():
+        stage_totals[stage] = sum(span_totals.get(name, {"total": 0.0})["total"] for name in span_names)
+
+    arrival_spans = [item for item in span_list if item[0] == "wait_for_arrival"]
+    move_total = 0.0
+    for name, category, start_ns, end_ns, thread_id, args in span_list:
+        if name != "well":
+            continue
+        for arrival in arrival_spans:
+            if arrival[4] == thread_id and start_ns <= arrival[2] and arrival[3] <= end_ns:
+                move_total += (arrival[3] - start_ns) / 1e9
+                break
+    stage_totals["move"] = move_total
+    return stage_totals
+
+
+def run_plate(num_wells, pic_resolution=None, is_verbose=False, trace_full_path=None, is_keep_output=False):
+    """
+    Description: Runs one experiment run over a plate with the simulated printer/camera.
+                 The pictures' temporary folder is removed afterwards unless is_keep_output.
+    Return/Output: Dictionary of results for this plate
+    """
+    os.environ["ROBOCAM_BACKEND"] = "sim"
+    # Imported once the backend is set
+    import module_backends as BK
+    import module_experiment_engine as EE
+    MS, SQ = EE.MS, EE.SQ
+
+    if pic_resolution is None:
+        pic_resolution = EE.PIC_RES
+
+    well_list = list(enumerate(get_plate_gcode_list(num_wells), start=1))
+    values = EE.get_values(EE.MODE_PICTURES)
+
+    camera = BK.create_camera()
+    camera.resolution = EE.VID_RES
+    printer = BK.get_printer_module()
+    printer.initial_setup([])
+    SQ.start(printer.printer)
+
+    # Start over the first well, like after "Go to first well"
+    SQ.run_gcode(well_list[0][1])
+    MS.wait_for_move(well_list[0][1], EE.WELL_MOVE_FALLBACK_TIME)
+
+    folder_path = tempfile.mkdtemp(prefix=f"benchmark_{num_wells}_wells_")
+    TR.clear()
+    TR.enable()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.monotonic()
+    try:
+        output = sys.stdout if is_verbose else open(os.devnull, "w")
+        with contextlib.redirect_stdout(output):
+            # total_seconds/run_seconds of 0: exactly one run through every well
+            EE.run_experiment_loop(values, camera, well_list, folder_path, 0, 0, pic_res=tuple(pic_resolution))
+    finally:
+        wall_seconds = time.monotonic() - wall_start
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+        if output is not sys.stdout:
+            output.close()
+        SQ.stop()
+        TR.disable()
+        camera.close()
+        # A 96 well plate of 12MP pictures is about 150 MB
+        if not is_keep_output:
+            shutil.rmtree(folder_path, ignore_errors=True)
+
+    span_list = TR.get_spans()
+    totals = get_stage_totals(span_list)
+    if trace_full_path is not None:
+        TR.export_chrome_trace(trace_full_path, span_list)
+    cpu_seconds = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+
+    return {
+        "wells": num_wells,
+        "wall_seconds": wall_seconds,
+        "wells_per_minute": num_wells / wall_seconds * 60,
+        "seconds_per_well": {stage: totals.get(stage, 0.0) / num_wells for stage in STAGE_LIST},
+        "stage_totals": {stage: totals.get(stage, 0.0) for stage in STAGE_LIST},
+        "span_totals": TR.get_stage_totals(span_list),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": usage_end.ru_maxrss / 1024,
+        "cpu_seconds": cpu_seconds,
+        "cpu_utilisation": cpu_seconds / wall_seconds,
+        "folder_path": folder_path if is_keep_output else None,
+    }
+
+
+def run_plate_process(num_wells, args):
+    # Runs run_plate in a new Python process (own peak RSS), returns its result dictionary
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    command = [sys.executable, os.path.abspath(__file__), "--worker", "--wells", str(num_wells),
+               "--result-file", result_file]
+    if args.pic_resolution is not None:
+        command += ["--pic-resolution"] + [str(value) for value in args.pic_resolution]
+    if args.verbose:
+        command.append("--verbose")
+    if args.keep_output:
+        command.append("--keep-output")
+    if args.trace:
+        unique_id = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        command += ["--trace-file", os.path.join(get_results_folder(), f"trace_{num_wells}_wells_{unique_id}.json")]
+    try:
+        subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(result_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def print_results(results):
+    print("=========================")
+    print("Experiment Throughput Benchmark (simulated printer/camera)")
+    header = f"{'wells':>6} {'wells/min':>10} " + " ".join(f"{stage:>9}" for stage in STAGE_LIST)
+    print(header + f" {'RSS MB':>8} {'CPU %':>6}")
+    for result in results:
+        stages = " ".join(f"{result['seconds_per_well'][stage]:>9.3f}" for stage in STAGE_LIST)
+        print(f"{result['wells']:>6} {result['wells_per_minute']:>10.1f} {stages} "
+              f"{result['peak_rss_mb']:>8.1f} {result['cpu_utilisation'] * 100:>6.1f}")
+    print("(stage columns are seconds per well)")
+    print("=========================")
+
+
+def compare_results(results, previous_report):
+    """
+    Description: Prints wells/min change against an earlier benchmark JSON file
+    """
+    previous_by_wells = {result["wells"]: result for result in previous_report["results"]}
+    print(f"Compared to commit {previous_report['git_commit'][:10]} ({previous_report['timestamp']}):")
+    for result in results:
+        previous = previous_by_wells.get(result["wells"])
+        if previous is None:
+            continue
+        change = (result["wells_per_minute"] / previous["wells_per_minute"] - 1) * 100
+        print(f"{result['wells']:>6} wells: {previous['wells_per_minute']:.1f} -> "
+              f"{result['wells_per_minute']:.1f} wells/min ({change:+.1f}%)")
+
+
+def get_results_folder():
+    results_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), RESULTS_FOLDER)
+    os.makedirs(results_folder, exist_ok=True)
+    return results_folder
+
+
+def save_report(results, args):
+    git_commit, is_dirty = get_git_commit()
+    report = {
+        "git_commit": git_commit,
+        "git_dirty": is_dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "pic_resolution": args.pic_resolution,
+        "results": results,
+    }
+    results_folder = get_results_folder()
+    unique_id = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    report_full_path = os.path.join(results_folder, f"benchmark_{git_commit[:7]}_{unique_id}.json")
+    with open(report_full_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark results: {report_full_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Experiment throughput benchmark (simulated printer/camera)")
+    parser.add_argument("--wells", type=int, nargs="+", default=DEFAULT_WELL_COUNTS,
+                        help=f"plate sizes to run, from {sorted(PLATE_LAYOUTS)}")
+    parser.add_argument("--pic-resolution", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="still picture resolution (default: module_experiment_engine.PIC_RES)")
+    parser.add_argument("--compare", help="earlier benchmark JSON file to compare wells/min against")
+    parser.add_argument("--verbose", action="store_true", help="show the experiment's print output")
+    parser.add_argument("--trace", action="store_true",
+                        help="also save a Chrome trace (module_trace spans) of every plate")
+    parser.add_argument("--keep-output", action="store_true",
+                        help="keep each plate's pictures (temporary folder, path saved in the results)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    parser.add_argument("--trace-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_plate(args.wells[0], args.pic_resolution, args.verbose, args.trace_file, args.keep_output)
+        with open(args.result_file, "w") as f:
+            json.dump(result, f)
+        return
+
+    results = []
+    for num_wells in args.wells:
+        print(f"Running {num_wells} well plate...")
+        results.append(run_plate_process(num_wells, args))
+
+    print_results(results)
+    save_report(results, args)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Autofocus Module
+Finds the sharpest Z with a focus metric search, instead of capturing every
+Z stack slice at full resolution and leaving the user to pick the sharp one.
+
+-Sharpness is scored on small video port frames (FOCUS_RESOLUTION), which are
+ fast to grab and never get encoded or saved
+-Focus metrics:
+  -"LAPLACIAN": variance of the Laplacian (edges/fine detail)
+  -"TENENGRAD": mean squared Sobel gradient (less sensitive to noise)
+-Searches (Z values stay on the z_start + n * z_increment grid of the Z stack):
+  -"COARSE_TO_FINE": sweep the range every few slices, then sweep finer around the best Z
+  -"GOLDEN": golden-section search, assumes the range has one sharpness peak
+-Only the best Z (or a small bracket of slices around it) is captured at full resolution
+
+Example: 2 mm range at 0.05 mm (41 slices) takes about 15 small frames with
+"COARSE_TO_FINE" and 3 full resolution pictures (BRACKET_SLICES = 1).
+
+Usage:
+    focus_search = AF.FocusSearch(camera, z_start, z_end, z_increment)
+    best_z = focus_search.find_best_z()
+    z_list = focus_search.get_bracket(best_z)
+    focus_search.save_scores_csv("focus_scores.csv")
+"""
+
+import csv
+import math
+import time
+
+import module_capture_pipeline as CP
+import module_motion_sync as MS
+import module_serial_queue as SQ
+import module_trace as TR
+
+# ==== AUTOFOCUS CONSTANTS ====
+METRIC_LAPLACIAN = "LAPLACIAN"
+METRIC_TENENGRAD = "TENENGRAD"
+METRIC_LIST = [METRIC_LAPLACIAN, METRIC_TENENGRAD]
+
+SEARCH_COARSE_TO_FINE = "COARSE_TO_FINE"
+SEARCH_GOLDEN = "GOLDEN"
+SEARCH_LIST = [SEARCH_COARSE_TO_FINE, SEARCH_GOLDEN]
+
+# Defaults
+FOCUS_METRIC = METRIC_LAPLACIAN
+FOCUS_SEARCH = SEARCH_COARSE_TO_FINE
+
+# Resolution of the frames that get scored (camera scales the video port frame down)
+FOCUS_RESOLUTION = (640, 480)
+
+# COARSE_TO_FINE: number of points in the first sweep, and how much finer each next sweep is
+COARSE_STEPS = 8
+REFINE_FACTOR = 4
+
+# Full resolution slices captured on each side of the best Z
+BRACKET_SLICES = 1
+
+# Fixed sleep (in seconds) if motion sync fails, Z moves are short
+FOCUS_MOVE_FALLBACK_TIME = 1
+
+# Z values are rounded like the Z stack file names (example: 01.25)
+Z_DECIMALS = 2
+
+# 1 / golden ratio
+INV_PHI = (math.sqrt(5) - 1) / 2
+
+
+def get_focus_score(frame, metric=FOCUS_METRIC):
+    """
+    Description: Sharpness of a BGR frame, higher is sharper
+    Inputs: frame, numpy array (height, width, 3), metric, "LAPLACIAN" or "TENENGRAD"
+    Return/Output: float
+    """
+    # Only loaded when autofocus is used
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if metric == METRIC_LAPLACIAN:
+        return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    if metric == METRIC_TENENGRAD:
+        gradient_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+        gradient_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+        return float((gradient_x * gradient_x + gradient_y * gradient_y).mean())
+    raise ValueError(f"Unknown focus metric: {metric}, choose from {METRIC_LIST}")
+
+
+class FocusSearch:
+    """
+    Description: Moves the extruder through a Z range and scores the camera's sharpness
+                 Needs the printer in absolute mode (G90). Each Z is only scored once.
+    Inputs:
+      - camera, PiCamera (or SimulatedCamera)
+      - z_start, z_end, z_increment, Z stack range (in mm), searched Z values are on this grid
+      - metric, "LAPLACIAN" or "TENENGRAD"
+      - resolution, size of the scored frames
+    """
+
+    def __init__(self, camera, z_start, z_end, z_increment, metric=FOCUS_METRIC, resolution=FOCUS_RESOLUTION):
+        if metric not in METRIC_LIST:
+            raise ValueError(f"Unknown focus metric: {metric}, choose from {METRIC_LIST}")
+        if z_increment <= 0 or z_end < z_start:
+            raise ValueError(f"Bad Z range: {z_start} to {z_end} by {z_increment}")
+        self.camera = camera
+        self.z_start = z_start
+        self.z_end = z_end
+        self.z_increment = z_increment
+        self.metric = metric
+        self.resolution = tuple(resolution)
+        # Index of the last slice, slice i is at z_start + i * z_increment
+        self.last_index = int(round((z_end - z_start) / z_increment))
+        # Slice index -> focus score
+        self.scores = {}
+        self.frame_pool = CP.FramePool(self.resolution, num_buffers=1)
+        self.search_seconds = 0
+        self.best_score = None
+
+    def get_z(self, index):
+        return round(self.z_start + index * self.z_increment, Z_DECIMALS)
+
+    def score_index(self, index):
+        """
+        Description: Moves to slice index, grabs a small frame and scores it
+        Return/Output: focus score (float)
+        """
+        index = min(max(index, 0), self.last_index)
+        if index in self.scores:
+            return self.scores[index]
+
+        z = self.get_z(index)
+        gcode_str = f"G0Z{z}"
+        with TR.span("focus_score", z=z):
+            SQ.run_gcode(gcode_str)
+            MS.wait_for_move(gcode_str, FOCUS_MOVE_FALLBACK_TIME)
+            frame = CP.grab_frame(self.camera, self.resolution, use_video_port=True,
+                                  frame_pool=self.frame_pool, resize=True)
+            try:
+                score = get_focus_score(frame, self.metric)
+            finally:
+                self.frame_pool.release(frame)
+        self.scores[index] = score
+        print(f"Focus z: {z}, score: {score:.1f}")
+        return score
+
+    def get_best_index(self, index_list):
+        return max(index_list, key=self.score_index)
+
+    def search_coarse_to_fine(self, coarse_steps=COARSE_STEPS, refine_factor=REFINE_FACTOR):
+        """
+        Description: Sweeps every step slices, then sweeps around the best slice with a
+                     step refine_factor times smaller, until the step is one slice
+        Return/Output: index of the sharpest slice
+        """
+        step = max(1, math.ceil(self.last_index / coarse_steps))
+        index_list = list(range(0, self.last_index + 1, step))
+        if index_list[-1] != self.last_index:
+            index_list.append(self.last_index)
+        best_index = self.get_best_index(index_list)
+
+        while step > 1:
+            fine_step = max(1, math.ceil(step / refine_factor))
+            low = max(0, best_index - step + 1)
+            high = min(self.last_index, best_index + step - 1)
+            # Keep best_index in the sweep so the sweep lines up with it
+            index_list = list(range(best_index, low - 1, -fine_step)) + list(range(best_index + fine_step, high + 1, fine_step))
+            best_index = self.get_best_index(index_list)
+            step = fine_step
+        return best_index
+
+    def search_golden(self):
+        """
+        Description: Golden-section search for the sharpness peak, then checks
+                     the last few slices left in the bracket
+        Return/Output: index of the sharpest slice
+        """
+        low, high = 0, self.last_index
+        inner_low = int(round(high - INV_PHI * (high - low)))
+        inner_high = int(round(low + INV_PHI * (high - low)))
+        while high - low > 3:
+            # Rounding can make the two inner points land on the same slice (example: 5 slices, both at 2),
+            # split them before comparing or one side of the bracket is never searched
+            if inner_low >= inner_high:
+                inner_high = inner_low + 1
+            if self.score_index(inner_low) >= self.score_index(inner_high):
+                high = inner_high
+                inner_high = inner_low
+                inner_low = int(round(high - INV_PHI * (high - low)))
+            else:
+                low = inner_low
+                inner_low = inner_high
+                inner_high = int(round(low + INV_PHI * (high - low)))
+        return self.get_best_index(range(low, high + 1))
+
+    def find_best_z(self, search=FOCUS_SEARCH):
+        """
+        Description: Runs the focus search
+        Return/Output: Z of the sharpest slice (in mm)
+        """
+        start_time = time.monotonic()
+        with TR.span("autofocus", search=search, metric=self.metric):
+            if search == SEARCH_COARSE_TO_FINE:
+                best_index = self.search_coarse_to_fine()
+            elif search == SEARCH_GOLDEN:
+                best_index = self.search_golden()
+            else:
+                raise ValueError(f"Unknown focus search: {search}, choose from {SEARCH_LIST}")
+        self.search_seconds = time.monotonic() - start_time
+        best_z = self.get_z(best_index)
+        self.best_score = self.scores[best_index]
+        print(f"Autofocus: best z: {best_z}, {len(self.scores)} of {self.last_index + 1} slices scored "
+              f"in {self.search_seconds:.2f} sec")
+        return best_z
+
+    def get_bracket(self, best_z, num_slices=BRACKET_SLICES):
+        """
+        Return/Output: List of Z values, best_z and num_slices slices on each side (inside the Z range)
+        """
+        best_index = int(round((best_z - self.z_start) / self.z_increment))
+        low = max(0, best_index - num_slices)
+        high = min(self.last_index, best_index + num_slices)
+        return [self.get_z(index) for index in range(low, high + 1)]
+
+    def save_scores_csv(self, file_full_path):
+        with open(file_full_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["z", f"score_{self.metric.lower()}"])
+            for index in sorted(self.scores):
+                writer.writerow([self.get_z(index), self.scores[index]])
+        print(f"Saved focus scores: {file_full_path}")
@@ -0,0 +1,81 @@
+"""
+Backends Module
+Picks the 3D Printer and camera the GUI/experiment code talks to.
+
+Backends (set with the ROBOCAM_BACKEND environment variable):
+-"hardware": printer_connection (USB serial 3D Printer) and picamera.PiCamera (default)
+-"sim":      module_simulated_printer (Marlin-like emulator with motion timing and M114)
+             and module_simulated_camera (synthetic frames with camera-like latency)
+
+With "sim", run_experiment2, create_z_stack and get_x_pictures run on any
+Linux computer, so experiment throughput can be measured without a Raspberry Pi.
+
+Usage:
+    ROBOCAM_BACKEND=sim python3 3dprinter_sampler_gui_fly3.py
+
+    import module_backends as BK
+    printer = BK.get_printer_module()
+    camera = BK.create_camera()
+    stream = BK.create_circular_io(camera, seconds, bitrate)
+"""
+
+import os
+
+# ==== BACKEND CONSTANTS ====
+BACKEND_ENV_VAR = "ROBOCAM_BACKEND"
+BACKEND_HARDWARE = "hardware"
+BACKEND_SIM = "sim"
+BACKEND_LIST = [BACKEND_HARDWARE, BACKEND_SIM]
+
+
+def get_backend_name():
+    """
+    Return/Output: Backend name from ROBOCAM_BACKEND, default "hardware"
+    """
+    backend_name = os.environ.get(BACKEND_ENV_VAR, BACKEND_HARDWARE).strip().lower()
+    if backend_name not in BACKEND_LIST:
+        raise ValueError(f"Unknown {BACKEND_ENV_VAR}: {backend_name}, choose from {BACKEND_LIST}")
+    return backend_name
+
+
+def is_simulated():
+    return get_backend_name() == BACKEND_SIM
+
+
+def get_printer_module():
+    """
+    Description: Gets the printer module (same functions as printer_connection: run_gcode,
+                 get_serial_data, get_serial_data2, initial_setup, get_path_list_csv, printer)
+    """
+    if is_simulated():
+        import module_simulated_printer as printer
+    else:
+        # Opens the USB serial port when imported
+        import printer_connection as printer
+    return printer
+
+
+def create_camera():
+    """
+    Description: Creates the camera object (PiCamera, or SimulatedCamera with "sim")
+    """
+    if is_simulated():
+        import module_simulated_camera as SCAM
+        printer = get_printer_module()
+        # Pictures get blurry as the simulated extruder's Z moves away from focus
+        return SCAM.SimulatedCamera(get_z=lambda: printer.get_current_location()["Z"])
+
+    from picamera import PiCamera
+    return PiCamera()
+
+
+def create_circular_io(camera, seconds, bitrate):
+    """
+    Description: In-memory ring buffer for H.264 recordings (PiCameraCircularIO, or SimulatedCircularIO with "sim")
+    """
+    if is_simulated():
+        import module_simulated_camera as SCAM
+        return SCAM.SimulatedCircularIO(camera, seconds, bitrate)
+
+    from picamera import PiCameraCircularIO
+    return PiCameraCircularIO(camera, seconds=seconds, bitrate=bitrate)
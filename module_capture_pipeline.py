@@ -0,0 +1,301 @@
+"""
+Capture Pipeline Module
+Moves image encoding and saving off the experiment thread, so the extruder
+can go to the next well while the last picture is still being written to
+the SD card.
+
+Producer/Consumer:
+-Experiment thread (producer) grabs a frame into memory and puts it in a bounded queue
+-Worker threads (consumers) encode (JPEG/PNG/TIFF, chosen by file extension) and write to disk
+-If the queue is full, the experiment thread waits (backpressure) instead of using up all the memory
+-flush() waits until everything in the queue is saved, close() flushes and stops the workers
+
+Frames can be:
+-bytes: already encoded (JPEG from the camera's GPU encoder), just written to disk
+-numpy array: raw BGR frame, encoded with OpenCV by the worker
+
+FramePool:
+Raw frames are captured straight into preallocated NumPy buffers (the camera
+writes into any writable buffer, like PiRGBArray but without its per-shot copy).
+Buffers are reused: acquire() one, capture into it, and release() it when done
+(the pipeline releases it after saving). If every buffer is in use, acquire()
+waits, which also caps how much memory raw frames can take.
+    frame_pool = CP.FramePool(PIC_RES)
+    frame = CP.grab_frame(camera, PIC_RES, frame_pool=frame_pool)
+    score = focus_score(frame)               # use the array directly
+    pipeline.submit(frame, file_full_path, frame_pool)   # or frame_pool.release(frame)
+"""
+
+import io
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import module_tiled_image as TI
+import module_trace as TR
+
+# ==== CAPTURE PIPELINE CONSTANTS ====
+# Number of worker threads encoding/saving images
+NUM_WORKERS = 2
+
+# Max frames waiting to be saved. A raw 12MP frame is about 37MB, so keep this small on a Pi.
+MAX_QUEUE_SIZE = 4
+
+# Reusable raw frame buffers per FramePool (a 12MP BGR buffer is about 37MB)
+FRAME_POOL_SIZE = 3
+
+# OpenCV encode settings
+JPEG_QUALITY = 95
+PNG_COMPRESSION = 1
+
+# Pipelines that haven't been closed yet (so they can all be drained when the GUI closes)
+_open_pipelines = []
+_open_pipelines_lock = threading.Lock()
+
+
+def get_padded_resolution(resolution):
+    # Camera pads raw frames: width up to a multiple of 32, height up to a multiple of 16
+    width, height = resolution
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+
+class FramePool:
+    """
+    Description: Preallocated, reusable raw frame buffers (padded like the camera's raw output)
+    Inputs:
+      - resolution, frame resolution, example: (4056, 3040)
+      - num_buffers, number of buffers (frames that can be in use at the same time)
+    """
+
+    def __init__(self, resolution, num_buffers=FRAME_POOL_SIZE):
+        self.resolution = tuple(resolution)
+        padded_width, padded_height = get_padded_resolution(self.resolution)
+        self.buffer_ids = set()
+        self.free_queue = queue.Queue()
+        for i in range(num_buffers):
+            buffer = np.empty((padded_height, padded_width, 3), dtype=np.uint8)
+            self.buffer_ids.add(id(buffer))
+            self.free_queue.put(buffer)
+        self.num_waits = 0
+
+    def acquire(self, timeout=None):
+        """
+        Description: Gets a free padded buffer, waits if all of them are in use
+        Return/Output: numpy array, shape (padded_height, padded_width, 3)
+        """
+        try:
+            return self.free_queue.get_nowait()
+        except queue.Empty:
+            self.num_waits += 1
+            with TR.span("frame_pool_wait"):
+                return self.free_queue.get(timeout=timeout)
+
+    def release(self, frame):
+        """
+        Description: Gives a buffer back, frame can be the buffer or a view of it (from get_view)
+        """
+        buffer = frame if frame.base is None else frame.base
+        if id(buffer) not in self.buffer_ids:
+            raise ValueError("Frame does not belong to this FramePool")
+        self.free_queue.put(buffer)
+
+    def get_view(self, buffer):
+        # Frame without the padding (no copy)
+        width, height = self.resolution
+        return buffer[:height, :width]
+
+
+def grab_frame(camera, resolution, use_video_port=False, frame_pool=None, resize=False):
+    """
+    Description: Captures a raw BGR frame into memory (no encoding, no file)
+    Inputs: frame_pool, FramePool to capture into (release the frame when done), None allocates a new array
+            resize, True to have the camera scale its frame down to resolution (example: small autofocus frames)
+    Return/Output: numpy array, shape (height, width, 3)
+    """
+    resize_res = resolution if resize else None
+    if frame_pool is None:
+        width, height = resolution
+        padded_width, padded_height = get_padded_resolution(resolution)
+        frame = np.empty((padded_height, padded_width, 3), dtype=np.uint8)
+        camera.capture(frame, format="bgr", use_video_port=use_video_port, resize=resize_res)
+        return frame[:height, :width]
+
+    buffer = frame_pool.acquire()
+    try:
+        camera.capture(buffer, format="bgr", use_video_port=use_video_port, resize=resize_res)
+    except Exception:
+        frame_pool.release(buffer)
+        raise
+    return frame_pool.get_view(buffer)
+
+
+def grab_jpeg(camera, use_video_port=False):
+    """
+    Description: Captures a JPEG into memory using the camera's hardware encoder
+    Return/Output: bytes
+    """
+    stream = io.BytesIO()
+    camera.capture(stream, format="jpeg", use_video_port=use_video_port)
+    return stream.getvalue()
+
+
+def encode_frame(frame, file_full_path):
+    """
+    Description: Encodes a raw frame using the file extension (.jpg, .png, .tif)
+    Return/Output: bytes
+    """
+    # OpenCV is only loaded once a raw frame has to be encoded (JPEG from the camera doesn't need it)
+    import cv2
+
+    extension = os.path.splitext(file_full_path)[1].lower()
+    params = []
+    if extension in (".jpg", ".jpeg"):
+        params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    elif extension == ".png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    is_encoded, buffer = cv2.imencode(extension, frame, params)
+    if not is_encoded:
+        raise ValueError(f"Could not encode image as {extension}")
+    return buffer.tobytes()
+
+
+def write_file(file_full_path, data):
+    # Encoded image bytes to disk
+    with open(file_full_path, "wb") as f:
+        f.write(data)
+
+
+class CapturePipeline:
+    """
+    Description: Bounded queue + worker threads that encode and save frames
+    Inputs:
+      - num_workers, number of worker threads
+      - max_queue_size, max frames waiting (submit blocks when full)
+      - save_tiled, also save raw frames as a memory mapped .npy next to the file
+        (module_tiled_image, well_12.jpg -> well_12.npy), from the frame already in memory
+    """
+
+    def __init__(self, num_workers=NUM_WORKERS, max_queue_size=MAX_QUEUE_SIZE, name="Capture Pipeline",
+                 save_tiled=False):
+        self.name = name
+        self.save_tiled = save_tiled
+        self.frame_queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = threading.Lock()
+        self.num_saved = 0
+        self.num_failed = 0
+        self.num_blocked = 0
+        self.blocked_time = 0.0
+        self.save_times = []
+        self.is_closed = False
+
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self.run_worker, name=f"{name} Worker {i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        with _open_pipelines_lock:
+            _open_pipelines.append(self)
+
+    def submit(self, frame, file_full_path, frame_pool=None, on_saved=None):
+        """
+        Description: Queues a frame to be saved. Blocks if the queue is full (backpressure).
+        Inputs: frame (bytes or numpy array), file_full_path,
+                frame_pool (FramePool the frame came from, it is released after saving),
+                on_saved (function called with file_full_path from the worker once the file is written)
+        """
+        if self.is_closed:
+            raise RuntimeError(f"{self.name} is closed")
+        item = (frame, file_full_path, frame_pool, on_saved)
+        try:
+            self.frame_queue.put_nowait(item)
+        except queue.Full:
+            # Workers are behind, wait for a free spot
+            wait_start = time.monotonic()
+            with TR.span("pipeline_backpressure"):
+                self.frame_queue.put(item)
+            with self.lock:
+                self.num_blocked += 1
+                self.blocked_time += time.monotonic() - wait_start
+
+    def run_worker(self):
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                self.frame_queue.task_done()
+                break
+
+            frame, file_full_path, frame_pool, on_saved = item
+            save_start = time.monotonic()
+            try:
+                if isinstance(frame, (bytes, bytearray)):
+                    data = frame
+                else:
+                    with TR.span("encode"):
+                        data = encode_frame(frame, file_full_path)
+                with TR.span("write", bytes=len(data)):
+                    write_file(file_full_path, data)
+                if self.save_tiled and not isinstance(frame, (bytes, bytearray)):
+                    with TR.span("write_tiled"):
+                        TI.save_tiled(frame, TI.get_tiled_path(file_full_path)).close()
+                with self.lock:
+                    self.num_saved += 1
+                    self.save_times.append(time.monotonic() - save_start)
+                print(f"Saved Image: {file_full_path}")
+                if on_saved is not None:
+                    on_saved(file_full_path)
+            except Exception as e:
+                with self.lock:
+                    self.num_failed += 1
+                print(f"{self.name}: could not save {file_full_path}: {e}")
+            finally:
+                if frame_pool is not None:
+                    frame_pool.release(frame)
+                self.frame_queue.task_done()
+
+    def flush(self):
+        """
+        Description: Waits until every queued frame is saved
+        """
+        self.frame_queue.join()
+
+    def close(self):
+        """
+        Description: Saves everything left in the queue, then stops the workers
+        """
+        if self.is_closed:
+            return
+        pending = self.frame_queue.qsize()
+        if pending != 0:
+            print(f"{self.name}: saving {pending} remaining image(s)...")
+        self.flush()
+        self.is_closed = True
+        for worker in self.workers:
+            self.frame_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        with _open_pipelines_lock:
+            if self in _open_pipelines:
+                _open_pipelines.remove(self)
+        self.print_report()
+
+    def print_report(self):
+        mean_save_time = 0.0
+        if len(self.save_times) != 0:
+            mean_save_time = sum(self.save_times) / len(self.save_times)
+        print(f"{self.name}: saved {self.num_saved}, failed {self.num_failed}, "
+              f"mean encode+write {mean_save_time:.3f} sec, "
+              f"queue full {self.num_blocked} time(s) ({self.blocked_time:.1f} sec waiting)")
+
+
+def close_all_pipelines():
+    """
+    Description: Drains and closes every pipeline still open (call before the program exits)
+    """
+    with _open_pipelines_lock:
+        pipelines = list(_open_pipelines)
+    for pipeline in pipelines:
+        pipeline.close()
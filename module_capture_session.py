@@ -0,0 +1,269 @@
+"""
+Capture Session Module
+Keeps the camera at the still picture resolution for a whole experiment
+(or Z stack) instead of switching resolution around every capture.
+
+Every camera.resolution change makes the camera change sensor mode and let
+the automatic gain control settle again, which is slow and was most likely
+the cause of the "Buffer issue?" crashes (see 06 Jun 2021 in the changelog).
+
+Usage:
+    with CS.CaptureSession(camera, PIC_RES, VID_RES) as session:
+        for file_full_path in file_list:
+            session.capture(file_full_path)
+    # Camera is back to VID_RES here, timing report gets printed
+
+To save in the background, use capture_to_pipeline with a module_capture_pipeline.CapturePipeline.
+
+Bursts (many pictures in a row) use capture_burst: the camera port stays set up
+between pictures, so they come as fast as the sensor allows (or one every interval_seconds):
+    with CS.CaptureSession(camera, PIC_RES, VID_RES) as session:
+        session.capture_burst(file_list, interval_seconds=0, use_video_port=True)
+"""
+
+import io
+import os
+import time
+
+import module_capture_pipeline as CP
+import module_trace as TR
+
+# ==== CAPTURE SESSION CONSTANTS ====
+# Number of times to retry a capture if the camera fails
+MAX_CAM_RETRY = 20
+
+# Wait (in seconds) to give camera a rest before retrying
+CAM_RETRY_DELAY = 1
+
+# Wait (in seconds) after switching to still resolution, lets gain settle once per session
+STILL_MODE_SETTLE_TIME = 0.5
+
+# If True, raw frames are captured into reused buffers (module_capture_pipeline.FramePool)
+USE_FRAME_POOL = True
+
+# Capture format by file extension for bursts (capture_sequence/capture_continuous need one format)
+BURST_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".bmp": "bmp"}
+
+
+class CaptureSession:
+    """
+    Description: Switches the camera to still resolution once, captures any
+                 number of pictures, then switches back to the preview/video resolution.
+    Inputs:
+      - camera, PiCamera object
+      - pic_res, still picture resolution, example: (4056, 3040)
+      - vid_res, resolution to go back to when the session ends, example: (960, 720)
+      - settle_time, wait (in seconds) after switching to still resolution
+    """
+
+    def __init__(self, camera, pic_res, vid_res, settle_time=STILL_MODE_SETTLE_TIME, name="CaptureSession"):
+        self.camera = camera
+        self.pic_res = tuple(pic_res)
+        self.vid_res = tuple(vid_res)
+        self.settle_time = settle_time
+        self.name = name
+        self.is_active = False
+        self.capture_times = []
+        self.num_failed = 0
+        self.num_resolution_changes = 0
+        # Raw frame buffers at pic_res, made on the first raw capture
+        self.frame_pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def set_resolution(self, resolution):
+        if tuple(self.camera.resolution) != resolution:
+            self.camera.resolution = resolution
+            self.num_resolution_changes += 1
+
+    def start(self):
+        """
+        Description: Switches camera to still resolution (only once for the whole session)
+        """
+        if self.is_active:
+            return
+        self.set_resolution(self.pic_res)
+        if self.settle_time > 0:
+            time.sleep(self.settle_time)
+        self.is_active = True
+
+    def run_with_retry(self, capture_function, description):
+        """
+        Description: Runs capture_function, retries if the camera fails
+        Return/Output: (True, result of capture_function) if it worked, else (False, None)
+        """
+        if not self.is_active:
+            self.start()
+
+        cam_error_count = 0
+        while cam_error_count < MAX_CAM_RETRY:
+            try:
+                capture_start = time.monotonic()
+                with TR.span("capture", file=description):
+                    result = capture_function()
+                self.capture_times.append(time.monotonic() - capture_start)
+                return True, result
+            except Exception as e:
+                cam_error_count += 1
+                print(f"Cam error in '{self.name}': {e}, attempt: {cam_error_count} out of: {MAX_CAM_RETRY}")
+                time.sleep(CAM_RETRY_DELAY)
+
+        self.num_failed += 1
+        print(f"Could not capture image: {description}")
+        return False, None
+
+    def capture(self, file_full_path, **capture_kwargs):
+        """
+        Description: Captures a picture at still resolution, retries if the camera fails
+        Input: file_full_path, where to save the picture (or any output camera.capture takes)
+        Return/Output: True if the picture was saved, else False
+        """
+        is_captured, result = self.run_with_retry(lambda: self.camera.capture(file_full_path, **capture_kwargs), file_full_path)
+        if is_captured:
+            print(f"Saved Image: {file_full_path}")
+        return is_captured
+
+    def capture_to_pipeline(self, pipeline, file_full_path, on_saved=None):
+        """
+        Description: Captures a frame into memory and hands it to a CapturePipeline
+                     (module_capture_pipeline) to be encoded/saved in the background.
+                     JPEGs use the camera's hardware encoder, other formats (and JPEGs when the
+                     pipeline also saves a tiled .npy copy) are captured raw.
+                     on_saved is called with file_full_path once the file is written.
+        Return/Output: True if the frame was captured and queued, else False
+        """
+        extension = os.path.splitext(file_full_path)[1].lower()
+        if extension in (".jpg", ".jpeg") and not pipeline.save_tiled:
+            is_captured, frame = self.run_with_retry(lambda: CP.grab_jpeg(self.camera), file_full_path)
+            if is_captured:
+                pipeline.submit(frame, file_full_path, on_saved=on_saved)
+            return is_captured
+
+        # Raw frame in a reused buffer, the pipeline gives the buffer back after saving it
+        frame = self.capture_array()
+        if frame is None:
+            return False
+        pipeline.submit(frame, file_full_path, self.frame_pool, on_saved)
+        return True
+
+    def get_frame_pool(self):
+        if self.frame_pool is None and USE_FRAME_POOL:
+            self.frame_pool = CP.FramePool(self.pic_res)
+        return self.frame_pool
+
+    def capture_array(self, use_video_port=False):
+        """
+        Description: Captures a raw BGR frame into memory (no file), for focus scoring, thumbnails, analysis...
+                     The frame is a reused buffer: give it back with session.release_array(frame)
+                     when done, or pass session.frame_pool to pipeline.submit to save it first.
+        Return/Output: numpy array, shape (height, width, 3), or None if the capture failed
+        """
+        frame_pool = self.get_frame_pool()
+        is_captured, frame = self.run_with_retry(
+            lambda: CP.grab_frame(self.camera, self.pic_res, use_video_port, frame_pool), "raw frame")
+        return frame
+
+    def release_array(self, frame):
+        # Gives a capture_array frame back to the pool (nothing to do without a pool)
+        if self.frame_pool is not None:
+            self.frame_pool.release(frame)
+
+    def capture_burst(self, file_list, interval_seconds=0, use_video_port=False, pipeline=None):
+        """
+        Description: Captures one picture per file in file_list without setting up the
+                     camera port again between pictures.
+                     -interval_seconds 0: back to back, as fast as the camera can (capture_sequence)
+                     -interval_seconds > 0: time-lapse, one picture every interval_seconds (capture_continuous)
+                     Still port bursts use burst mode (no gain/white balance settling between shots).
+                     With a pipeline (module_capture_pipeline), pictures stay in memory and its workers save them.
+        Return/Output: Number of pictures captured
+        """
+        if len(file_list) == 0:
+            return 0
+        extension = os.path.splitext(file_list[0])[1].lower()
+        capture_format = BURST_FORMATS.get(extension, "jpeg")
+        is_burst_mode = not use_video_port
+        # Pictures already captured, a retry carries on from here
+        captured_list = []
+
+        def run_burst():
+            remaining_list = file_list[len(captured_list):]
+            if interval_seconds <= 0 and pipeline is None:
+                self.camera.capture_sequence(remaining_list, format=capture_format,
+                                             use_video_port=use_video_port, burst=is_burst_mode)
+                captured_list.extend(remaining_list)
+                return
+
+            stream = io.BytesIO()
+            burst_start = time.monotonic()
+            frames = self.camera.capture_continuous(stream, format=capture_format,
+                                                    use_video_port=use_video_port, burst=is_burst_mode)
+            try:
+                for i, (file_full_path, frame) in enumerate(zip(remaining_list, frames)):
+                    data = stream.getvalue()
+                    stream.seek(0)
+                    stream.truncate()
+                    if pipeline is not None:
+                        pipeline.submit(data, file_full_path)
+                    else:
+                        CP.write_file(file_full_path, data)
+                    captured_list.append(file_full_path)
+                    if interval_seconds > 0 and i + 1 < len(remaining_list):
+                        # Wait for the next picture's slot, counted from the start so waits don't add up
+                        next_time = burst_start + (i + 1) * interval_seconds
+                        time.sleep(max(0.0, next_time - time.monotonic()))
+            finally:
+                frames.close()
+
+        burst_start = time.monotonic()
+        self.run_with_retry(run_burst, f"burst of {len(file_list)} pictures")
+        burst_time = time.monotonic() - burst_start
+        if burst_time > 0:
+            print(f"{self.name}: {len(captured_list)} pictures in {burst_time:.2f} sec "
+                  f"({len(captured_list) / burst_time:.1f} per sec)")
+        return len(captured_list)
+
+    def stop(self, is_report=True):
+        """
+        Description: Returns the camera to the video/preview resolution and prints the timing report
+                     (is_report False: no report, example: pausing between runs, start() picks up again)
+        """
+        if not self.is_active:
+            return
+        self.set_resolution(self.vid_res)
+        self.is_active = False
+        if is_report and len(self.capture_times) > 1:
+            self.print_timing_report()
+
+    def get_timing_report(self):
+        """
+        Description: Summary of capture times for this session
+        Return/Output: Dictionary with count, failed, total, mean, min, max (seconds) and resolution_changes
+        """
+        count = len(self.capture_times)
+        report = {"count": count, "failed": self.num_failed, "total": 0.0,
+                  "mean": 0.0, "min": 0.0, "max": 0.0,
+                  "resolution_changes": self.num_resolution_changes}
+        if count != 0:
+            total = sum(self.capture_times)
+            report["total"] = total
+            report["mean"] = total / count
+            report["min"] = min(self.capture_times)
+            report["max"] = max(self.capture_times)
+        return report
+
+    def print_timing_report(self):
+        report = self.get_timing_report()
+        print("=========================")
+        print(f"{self.name} Timing Report")
+        print(f"Captures: {report['count']} (failed: {report['failed']})")
+        print(f"Capture time (sec): mean {report['mean']:.3f}, min {report['min']:.3f}, "
+              f"max {report['max']:.3f}, total {report['total']:.1f}")
+        print(f"Resolution changes: {report['resolution_changes']}")
+        print("=========================")
@@ -0,0 +1,545 @@
+"""
+Experiment Engine Module
+Runs experiments (CSV of wells -> pictures, videos or preview, one run every
+run time until the experiment time is used up) with no GUI, so the same code
+runs from the PySimpleGUI program (3dprinter_sampler_gui_fly3.py), the headless
+runner (run_experiment_headless.py) and benchmark_experiment.py.
+
+Nothing here imports PySimpleGUI, Xlib (module_window_helper) or OpenCV: cv2 is only
+loaded by the modules that need it once they're used (raw frame encoding, autofocus),
+so a rig with no monitor starts fast and spends no CPU on a GUI.
+
+-values: experiment settings, a dictionary with the GUI's element keys (capture mode
+ radio keys, well order, video, overrun policy), get_values() makes one without the GUI
+-Experiment: one experiment's state across its runs (capture session/pipeline, metadata,
+ journal, run schedule), run_single_experiment does its runs, module_job_queue takes
+ turns between several (run_job_queue)
+-setup_camera: streaming resolution/framerate/rotation, then waits for the digital gain
+ to settle (at most GAIN_SETTLE_TIMEOUT seconds)
+
+Usage:
+    camera = BK.create_camera()
+    EE.setup_camera(camera)
+    values = EE.get_values(EE.MODE_PICTURES)
+    experiment = EE.create_experiment(values, camera, csv_filename, total_seconds, run_seconds, save_folder)
+    EE.run_single_experiment(experiment, is_running)
+
+    EE.run_single_experiment(EE.open_resumed_experiment(folder_path, camera), is_running)
+"""
+
+import functools
+import os
+import time
+from datetime import datetime
+
+import settings as C
+import prepare_experiment as P
+import module_capture_pipeline as CP
+import module_capture_session as CS
+import module_experiment_journal as EJ
+import module_focus_map as FM
+import module_job_queue as JQ
+import module_metadata_recorder as MR
+import module_motion_sync as MS
+import module_path_optimizer as PO
+import module_run_scheduler as RS
+import module_serial_queue as SQ
+import module_trace as TR
+import module_travel_planner as TP
+import module_video_recorder as VR
+
+# ==== EXPERIMENT ENGINE CONSTANTS ====
+# Experiment settings keys, the same as the GUI's element keys so its values can be used as they are
+EXP_RADIO_PIC_KEY = "-RADIO_PIC-"
+EXP_RADIO_VID_KEY = "-RADIO_VID-"
+EXP_RADIO_PREVIEW_KEY = "-RADIO_PREVIEW-"
+OPTIMIZE_PATH_KEY = "-OPTIMIZE_PATH-"
+ALTERNATE_DIRECTION_KEY = "-ALTERNATE_DIRECTION-"
+FOCUS_MAP_KEY = "-FOCUS_MAP-"
+VIDEO_DURATION_KEY = "-VIDEO_DURATION-"
+VIDEO_BITRATE_KEY = "-VIDEO_BITRATE-"
+OVERRUN_POLICY_KEY = "-OVERRUN_POLICY-"
+TILED_COPY_KEY = "-TILED_COPY-"
+
+# Settings saved in the experiment journal (and job queue), so a resumed experiment runs the same way
+JOURNAL_VALUE_KEYS = [EXP_RADIO_PIC_KEY, EXP_RADIO_VID_KEY, EXP_RADIO_PREVIEW_KEY, OPTIMIZE_PATH_KEY,
+                      ALTERNATE_DIRECTION_KEY, FOCUS_MAP_KEY, VIDEO_DURATION_KEY, VIDEO_BITRATE_KEY,
+                      OVERRUN_POLICY_KEY, TILED_COPY_KEY]
+
+# Capture modes (get_values)
+MODE_PICTURES = "pictures"
+MODE_VIDEO = "video"
+MODE_PREVIEW = "preview"
+MODE_KEYS = {MODE_PICTURES: EXP_RADIO_PIC_KEY, MODE_VIDEO: EXP_RADIO_VID_KEY, MODE_PREVIEW: EXP_RADIO_PREVIEW_KEY}
+MODE_LIST = list(MODE_KEYS)
+
+# Defaults: where experiment folders are made, streaming (video port) and still picture resolution
+PIC_SAVE_FOLDER = r"/home/pi/Projects/3dprinter_sampling"
+VID_RES = (960, 720)
+PIC_RES = (4056, 3040)
+
+# Camera setup (setup_camera). Rotation, MHT: 270, Cell Sensor: 90
+CAMERA_FRAMERATE = 32
+CAMERA_ROTATION = 270
+# Longest wait (in seconds) for the digital gain to stop changing, and how often it's read
+GAIN_SETTLE_TIMEOUT = 10
+GAIN_POLL_SECONDS = 0.5
+
+# If True, experiment pictures are saved in the background (module_capture_pipeline)
+USE_CAPTURE_PIPELINE = True
+
+# Default for TILED_COPY_KEY: also save each picture as a memory mapped .npy for tiled processing
+# (module_tiled_image, about 36 MB per 12 MP picture, written by the capture pipeline workers)
+SAVE_TILED_COPY = False
+
+# Fixed sleep (in seconds) if motion sync is off or fails (see module_motion_sync)
+WELL_MOVE_FALLBACK_TIME = 4
+
+
+def get_unique_id():
+    # Date and time text for file names
+    return datetime.now().strftime("%Y-%m-%d_%H%M%S")
+
+
+def get_values(mode=MODE_PICTURES, is_optimize_path=False, is_alternating=False, is_focus_map=False,
+               video_seconds=VR.VIDEO_DURATION_SECONDS, video_bitrate_mbps=VR.VIDEO_BITRATE / 1000000,
+               overrun_policy=RS.OVERRUN_POLICY, is_tiled_copy=SAVE_TILED_COPY):
+    """
+    Description: Experiment settings without the GUI (same keys as the GUI's values)
+    Inputs: mode, "pictures", "video" or "preview", video_bitrate_mbps, in Mbps like the GUI's input
+    Return/Output: Dictionary of JOURNAL_VALUE_KEYS to settings
+    """
+    if mode not in MODE_LIST:
+        raise ValueError(f"Unknown experiment mode: {mode}, choose from {MODE_LIST}")
+    if overrun_policy not in RS.OVERRUN_POLICY_LIST:
+        raise ValueError(f"Unknown overrun policy: {overrun_policy}, choose from {RS.OVERRUN_POLICY_LIST}")
+    values = {key: key == MODE_KEYS[mode] for key in MODE_KEYS.values()}
+    values.update({OPTIMIZE_PATH_KEY: is_optimize_path, ALTERNATE_DIRECTION_KEY: is_alternating,
+                   FOCUS_MAP_KEY: is_focus_map, VIDEO_DURATION_KEY: video_seconds,
+                   VIDEO_BITRATE_KEY: video_bitrate_mbps, OVERRUN_POLICY_KEY: overrun_policy,
+                   TILED_COPY_KEY: is_tiled_copy})
+    return values
+
+
+def setup_camera(camera, resolution=VID_RES, framerate=CAMERA_FRAMERATE, rotation=CAMERA_ROTATION,
+                 gain_settle_timeout=GAIN_SETTLE_TIMEOUT):
+    """
+    Description: Sets the streaming resolution, framerate and rotation, then lets the camera settings settle:
+                 waits until two digital gain readings match, or gain_settle_timeout seconds (0: no wait)
+    Return/Output: True if the digital gain settled
+    """
+    camera.resolution = resolution
+    camera.framerate = framerate
+    camera.rotation = rotation
+
+    settle_end = time.monotonic() + gain_settle_timeout
+    pre_value = None
+    cur_value = camera.digital_gain
+    while pre_value != cur_value:
+        if time.monotonic() + GAIN_POLL_SECONDS > settle_end:
+            print(f"digital_gain: {cur_value} (not settled after {gain_settle_timeout} sec, starting anyway)")
+            return False
+        time.sleep(GAIN_POLL_SECONDS)
+        pre_value = cur_value
+        cur_value = camera.digital_gain
+        print(f"digital_gain: {cur_value}")
+    return True
+
+
+def create_experiment(values, camera, csv_filename, total_seconds, run_seconds, save_folder=PIC_SAVE_FOLDER,
+                      pic_res=PIC_RES, vid_res=VID_RES, name="Experiment"):
+    """
+    Description: Sets up a new experiment from a CSV: well order, folder in save_folder and journal
+                 (not in Preview mode), focus map
+    Return/Output: Experiment
+    """
+    # Get Path List from CSV
+    path_list = P.get_path_list_csv(csv_filename)
+
+    # Get GCODE Location List from path_list
+    gcode_string_list = P.convert_list_to_gcode_strings(path_list)
+
+    # Pair each location with its well number (CSV order), then reorder if asked to.
+    # Well numbers don't change, so filenames still match the CSV.
+    is_alternating = values[ALTERNATE_DIRECTION_KEY]
+    if values[OPTIMIZE_PATH_KEY] == True:
+        well_list = PO.optimize_well_order(gcode_string_list, is_alternating)
+    else:
+        well_list = list(enumerate(gcode_string_list, start=1))
+
+    # Go into Absolute Positioning Mode
+    SQ.run_gcode(C.ABSOLUTE_POS)
+
+    # Create New Folder If not in "Preview" Mode
+    folder_path = None
+    journal = None
+    if values[EXP_RADIO_PREVIEW_KEY] == False:
+        folder_path = P.create_and_get_folder_path2(save_folder)
+        print("Not in Preview Mode, creating folder:", folder_path)
+
+        # Checkpoint journal, so the experiment can be resumed in this folder after a crash
+        journal = EJ.ExperimentJournal(folder_path)
+        settings = {"csv_filename": csv_filename, "total_seconds": total_seconds, "run_seconds": run_seconds,
+                    "pic_resolution": list(pic_res),
+                    "values": {key: values[key] for key in JOURNAL_VALUE_KEYS if key in values}}
+        journal.start(settings, well_list)
+
+    # Per-well best Z, saved next to the experiment folder and reused by the next experiment with this CSV
+    focus_map = None
+    if values[FOCUS_MAP_KEY] == True and values[EXP_RADIO_PREVIEW_KEY] == False:
+        focus_map = FM.FocusMap(FM.get_focus_map_path(folder_path, csv_filename))
+
+    return Experiment(values, camera, well_list, folder_path, total_seconds, run_seconds, is_alternating, focus_map,
+                      journal, pic_res=pic_res, vid_res=vid_res, name=name)
+
+
+def open_resumed_experiment(folder_path, camera, vid_res=VID_RES, name="Experiment"):
+    """
+    Description: Sets up an experiment to continue from its journal (module_experiment_journal) in the same folder,
+                 from the next well that wasn't saved, keeping the original start time, total time and resolution
+    Return/Output: Experiment
+    """
+    print(f"Resuming experiment: {folder_path}")
+
+    resume_state = EJ.get_resume_state(folder_path)
+    settings = resume_state.settings
+    values = settings["values"]
+    if resume_state.end_reason == EJ.END_FINISHED:
+        print("Experiment already finished, runs left in its time (if any) will still be done")
+    print(f"Continuing with run {resume_state.next_run}, {len(resume_state.done_wells)} well(s) of it already saved, "
+          f"{len(resume_state.output_list)} file(s) saved so far")
+
+    # Go into Absolute Positioning Mode
+    SQ.run_gcode(C.ABSOLUTE_POS)
+
+    focus_map = None
+    if values[FOCUS_MAP_KEY] == True:
+        focus_map = FM.FocusMap(FM.get_focus_map_path(folder_path, settings["csv_filename"]))
+
+    journal = EJ.ExperimentJournal(folder_path)
+    journal.resume(resume_state.next_run)
+    return Experiment(values, camera, resume_state.well_list, folder_path, settings["total_seconds"],
+                      settings["run_seconds"], values[ALTERNATE_DIRECTION_KEY], focus_map, journal, resume_state,
+                      pic_res=tuple(settings.get("pic_resolution", PIC_RES)), vid_res=vid_res, name=name)
+
+
+def run_job_queue(job_queue, camera, is_running, save_folder=PIC_SAVE_FOLDER, pic_res=PIC_RES, vid_res=VID_RES):
+    """
+    Description: Runs every job in the job queue (module_job_queue) that isn't done, taking turns
+                 between them, until they're done or is_running() is False.
+                 Jobs that were running (stopped or crashed) continue from their experiment journal.
+    """
+    experiment_dict = {}
+    for job in job_queue.get_pending_jobs():
+        if job.status == JQ.STATUS_RUNNING and job.folder_path is not None and \
+                os.path.isfile(EJ.get_journal_path(job.folder_path)):
+            experiment = open_resumed_experiment(job.folder_path, camera, vid_res, job.get_name())
+        else:
+            experiment = create_experiment(job.values, camera, job.csv_filename, job.total_seconds, job.run_seconds,
+                                           save_folder, pic_res, vid_res, job.get_name())
+            job_queue.set_status(job, JQ.STATUS_RUNNING, experiment.folder_path)
+        experiment.start()
+        experiment_dict[job.job_id] = experiment
+
+    if not experiment_dict:
+        print("Job queue is empty, add jobs first")
+    JQ.run_interleaved(job_queue, experiment_dict, is_running)
+
+    print("=========================")
+    print("Job Queue Stopped")
+    print("=========================")
+
+
+def run_experiment_loop(values, camera, well_list, folder_path, total_seconds, run_seconds, is_alternating=False,
+                        focus_map=None, journal=None, resume_state=None, pic_res=PIC_RES, vid_res=VID_RES,
+                        is_running=None):
+    """
+    Description: Goes to every well and takes a picture, video, or preview (do nothing),
+                 one run every run_seconds until total_seconds is used up or is_running() is False.
+                 Used by benchmark_experiment.py (simulated printer/camera), inputs are the same as Experiment's.
+    """
+    run_single_experiment(Experiment(values, camera, well_list, folder_path, total_seconds, run_seconds,
+                                     is_alternating, focus_map, journal, resume_state, pic_res=pic_res,
+                                     vid_res=vid_res), is_running)
+
+
+def run_single_experiment(experiment, is_running=None):
+    """
+    Description: Does the experiment's runs on its schedule until it's done or is_running() is False
+    Inputs: is_running, function checked between runs and while waiting ("Stop Experiment"), None: run until done
+    """
+    if is_running is None:
+        is_running = lambda: True
+
+    experiment.start()
+
+    while is_running():
+        scheduled_time = experiment.plan_next_run()
+        if scheduled_time is None:
+            print("Doing another run will go over set time limit, stopping experiment.")
+            break
+        print(f"Will wait {max(0.0, scheduled_time - time.monotonic()):.1f} sec before doing next run.")
+        # Sleeps until the run's deadline (returns early when stopped)
+        if not experiment.scheduler.wait_until(scheduled_time, is_running):
+            break
+
+        experiment.do_run()
+
+    experiment.close()
+
+
+class Experiment:
+    """
+    Description: One experiment's state across its runs (capture session/pipeline, metadata, journal,
+                 run schedule). run_single_experiment does its runs alone, module_job_queue takes turns
+                 between several.
+
+    Inputs:
+      - values, experiment settings (capture mode radio keys, video, overrun policy), see get_values
+      - well_list, list of (well_number, GCODE location) in the order to visit them
+      - folder_path, experiment folder to save pictures/metadata into
+      - focus_map, module_focus_map.FocusMap to take each well's Z from (None uses the CSV Z)
+      - journal, module_experiment_journal.ExperimentJournal to checkpoint runs/wells into (None: no journal)
+      - resume_state, module_experiment_journal.ResumeState to continue from (None: new experiment)
+      - pic_res, vid_res, still picture and streaming resolution (width, height)
+    """
+
+    def __init__(self, values, camera, well_list, folder_path, total_seconds, run_seconds, is_alternating=False,
+                 focus_map=None, journal=None, resume_state=None, pic_res=PIC_RES, vid_res=VID_RES,
+                 name="Experiment"):
+        self.values = values
+        self.camera = camera
+        self.well_list = well_list
+        self.folder_path = folder_path
+        self.total_seconds = total_seconds
+        self.run_seconds = run_seconds
+        self.is_alternating = is_alternating
+        self.focus_map = focus_map
+        self.journal = journal
+        self.resume_state = resume_state
+        self.name = name
+
+        # Runs start every run_seconds from the experiment start (absolute deadlines, no drift)
+        self.overrun_policy = values.get(OVERRUN_POLICY_KEY, RS.OVERRUN_POLICY)
+        self.scheduler = None
+
+        self.count_run = 0
+        # Wells of the first run that are already saved (resumed experiment)
+        self.skip_wells = set()
+        # A resumed run that was cut off part way is finished right away, without waiting for the schedule
+        self.is_partial_run = False
+        if resume_state is not None:
+            self.count_run = resume_state.next_run
+            self.skip_wells = resume_state.done_wells
+            self.is_partial_run = resume_state.is_partial_run()
+        # Journal "end" reason, "finished" once the experiment time is used up
+        self.end_reason = EJ.END_STOPPED
+
+        # Predict travel time between wells and how many runs fit in the experiment
+        self.cycle_report = TP.CycleTimeReport([location for well_number, location in well_list])
+        self.cycle_report.print_budget(total_seconds, run_seconds, self.overrun_policy)
+
+        # Camera Settings (metadata) for every picture, written in batches (no folder in Preview mode)
+        self.metadata_recorder = None
+        if folder_path is not None:
+            self.metadata_recorder = MR.MetadataRecorder(folder_path)
+
+        # Keep camera at still resolution for the whole experiment (only changes resolution once)
+        self.capture_session = CS.CaptureSession(camera, tuple(pic_res), tuple(vid_res),
+                                                 name=f"{name} Capture Session")
+
+        # Background encode/save workers (they also write the tiled .npy copies, from the raw frame)
+        self.capture_pipeline = None
+        if values[EXP_RADIO_PIC_KEY] == True and USE_CAPTURE_PIPELINE:
+            self.capture_pipeline = CP.CapturePipeline(name=f"{name} Capture Pipeline",
+                                                       save_tiled=values.get(TILED_COPY_KEY, SAVE_TILED_COPY))
+
+        # Video: GPU encoded H.264 per well, muxed to MP4 in a background process
+        self.video_muxer = None
+        if values[EXP_RADIO_VID_KEY] == True:
+            self.video_seconds = float(values[VIDEO_DURATION_KEY])
+            self.video_bitrate = int(float(values[VIDEO_BITRATE_KEY]) * 1000000)
+            self.video_muxer = VR.VideoMuxer(name=f"{name} Video Muxer")
+
+    def start(self):
+        """
+        Description: Experiment time starts once the camera is set up (a resumed experiment keeps its original start)
+        """
+        if self.values[EXP_RADIO_PIC_KEY] == True:
+            self.capture_session.start()
+
+        start_time = None
+        if self.resume_state is not None:
+            # Keep the original time grid: start time comes from the journal (wall clock)
+            start_time = EJ.wall_to_monotonic(self.resume_state.start_time)
+        self.scheduler = RS.RunScheduler(self.total_seconds, self.run_seconds, self.overrun_policy, start_time)
+        if self.resume_state is not None:
+            grid_time = self.resume_state.grid_time
+            if grid_time is not None:
+                grid_time = EJ.wall_to_monotonic(grid_time)
+            self.scheduler.resume(self.resume_state.next_slot, grid_time, self.resume_state.grid_slot)
+            if self.scheduler.get_seconds_left() <= 0:
+                print("Experiment time is already used up, nothing left to resume")
+                self.is_partial_run = False
+
+    def plan_next_run(self):
+        """
+        Return/Output: Scheduled start (time.monotonic()) of the next run, None if the experiment is done
+        """
+        if self.is_partial_run:
+            return time.monotonic()
+        scheduled_time = self.scheduler.plan_next_run()
+        if scheduled_time is None:
+            self.end_reason = EJ.END_FINISHED
+        return scheduled_time
+
+    def get_run_well_list(self, start_location=None):
+        """
+        Description: Wells of the next run. Runs that alternate direction go whichever way starts
+                     closer to start_location (where another job left the extruder).
+        """
+        run_well_list = PO.get_run_well_list(self.well_list, self.count_run, self.is_alternating)
+        if self.is_alternating and start_location is not None and len(run_well_list) > 1:
+            if JQ.get_travel_distance(start_location, run_well_list[-1][1]) < \
+                    JQ.get_travel_distance(start_location, run_well_list[0][1]):
+                run_well_list.reverse()
+        return run_well_list
+
+    def do_run(self, run_well_list=None):
+        """
+        Description: Goes to every well once (run_well_list, default: get_run_well_list()) and waits until
+                     every file of the run is saved
+        """
+        camera = self.camera
+        values = self.values
+        folder_path = self.folder_path
+        count_run = self.count_run
+        self.is_partial_run = False
+        if run_well_list is None:
+            run_well_list = self.get_run_well_list()
+        # Autofocus a few wells every FM.FOCUS_MAP_REFRESH_RUNS runs, the rest are predicted (not part of the run's cycle time)
+        is_focus_refresh = self.focus_map is not None and self.focus_map.needs_refresh(count_run)
+        if values[EXP_RADIO_PIC_KEY] == True:
+            if is_focus_refresh:
+                # Autofocus scores small video port frames, the camera stays at video resolution until it's done
+                self.capture_session.stop(is_report=False)
+            else:
+                # Only changes resolution if a job queue paused the session after the last run
+                self.capture_session.start()
+
+        print("=========================")
+        print("Run #", count_run)
+        run_record = self.scheduler.start_run(count_run)
+        if is_focus_refresh:
+            self.focus_map.refresh(camera, run_well_list, count_run)
+            if values[EXP_RADIO_PIC_KEY] == True:
+                self.capture_session.start()
+        self.cycle_report.start_run([location for well_number, location in run_well_list])
+        # Camera settings that don't change during a run are only read once
+        if self.metadata_recorder is not None:
+            self.metadata_recorder.refresh_static(camera)
+        if self.journal is not None:
+            # The time grid too, a SHIFT experiment resumes on the moved grid
+            self.journal.run_start(count_run, run_record.slot, EJ.monotonic_to_wall(self.scheduler.grid_time),
+                                   self.scheduler.grid_slot)
+        run_start_ns = time.monotonic_ns()
+
+        for well_index, (well_number, location) in enumerate(run_well_list):
+            # Already saved before the experiment was resumed
+            if well_number in self.skip_wells:
+                continue
+            # Timed as one "well" span (module_trace), stages inside have their own spans
+            well_start_ns = time.monotonic_ns()
+            # Checkpoint once the well's file is saved (capture pipeline workers call it after writing)
+            on_saved = None
+            if self.journal is not None:
+                on_saved = functools.partial(self.journal.well_done, count_run, well_number)
+            if self.focus_map is not None:
+                location = self.focus_map.get_focused_location(well_number, location)
+            SQ.run_gcode(location)
+            print("Going to Well Number:", well_number)
+            hop_time = self.cycle_report.hop_times[well_index]
+            MS.wait_for_move(location, WELL_MOVE_FALLBACK_TIME, expected_seconds=hop_time)
+            if values[EXP_RADIO_PREVIEW_KEY] == True:
+                print("Preview Mode is On, only showing preview camera \n")
+            elif values[EXP_RADIO_VID_KEY] == True:
+                print("Recording Video Footage")
+                file_full_path = P.get_file_full_path(folder_path, well_number)
+                h264_full_path = VR.record_video(camera, VR.get_video_path(file_full_path), self.video_seconds,
+                                                 self.video_bitrate)
+                # Mux runs in the background, go to the next well right away
+                # (the well is journaled with the .mp4 once it is muxed, the .h264 is deleted)
+                self.video_muxer.submit(h264_full_path, camera.framerate, on_saved)
+            elif values[EXP_RADIO_PIC_KEY] == True:
+                print("Taking Pictures Only")
+                file_full_path = P.get_file_full_path(folder_path, well_number)
+
+                # Camera is already at still resolution (capture_session), no resolution change here
+                if self.capture_pipeline is not None:
+                    self.capture_session.capture_to_pipeline(self.capture_pipeline, file_full_path, on_saved)
+                elif self.capture_session.capture(file_full_path) and on_saved is not None:
+                    on_saved(file_full_path)
+
+                self.metadata_recorder.record(camera, file_full_path)
+            # Outside if/elif chain
+            TR.add_span("well", well_start_ns, time.monotonic_ns(), args={"well": well_number, "run": count_run})
+        # Outside of location for loop
+        # Make sure every picture from this run is saved before waiting for the next run
+        with TR.span("run_flush"):
+            if self.capture_pipeline is not None:
+                self.capture_pipeline.flush()
+            if self.metadata_recorder is not None:
+                self.metadata_recorder.flush()
+            # Videos are journaled once muxed, so the last clips of the run are muxed first
+            if self.video_muxer is not None:
+                self.video_muxer.flush()
+        # Every file of this run is saved (pipeline/muxer flushed), resume starts with the next run
+        if self.journal is not None:
+            self.journal.run_end(count_run)
+        self.skip_wells = set()
+        TR.add_span("run", run_start_ns, time.monotonic_ns(), args={"run": count_run, "wells": len(run_well_list)})
+        self.cycle_report.end_run()
+        self.count_run += 1
+        # Display time left until end of experiment
+        print(f"Time left until end of experiment: {self.scheduler.get_seconds_left():.1f} sec")
+
+    def pause(self):
+        # Back to the preview/video resolution between runs (job queue: the next job may record video)
+        self.capture_session.stop(is_report=False)
+
+    def close(self):
+        # Save any pictures still in the queue (also happens after "Stop Experiment")
+        if self.capture_pipeline is not None:
+            self.capture_pipeline.close()
+
+        # Mux any videos still in the queue
+        if self.video_muxer is not None:
+            self.video_muxer.close()
+
+        # Return to streaming resolution and print capture timing report (also if paused between runs)
+        self.capture_session.stop(is_report=False)
+        if len(self.capture_session.capture_times) > 1:
+            self.capture_session.print_timing_report()
+
+        # Write any buffered camera settings rows (and the .npz copy)
+        if self.metadata_recorder is not None:
+            self.metadata_recorder.close()
+
+        if self.journal is not None:
+            self.journal.end(self.end_reason)
+            self.journal.close()
+
+        # Scheduled vs actual start of every run (interval accuracy for growth-rate analysis)
+        if self.scheduler is not None:
+            self.scheduler.print_report()
+            if self.folder_path is not None and self.scheduler.record_list:
+                self.scheduler.save_csv(os.path.join(self.folder_path, f"run_schedule_{get_unique_id()}.csv"))
+
+        # Where each well's seconds went (only if tracing is on, ROBOCAM_TRACE=1)
+        if TR.is_enabled() and self.folder_path is not None:
+            TR.print_stage_report()
+            TR.export_chrome_trace(os.path.join(self.folder_path, f"trace_{get_unique_id()}.json"))
+
+        print("=========================")
+        print(f"{self.name} Stopped")
+        print("=========================")
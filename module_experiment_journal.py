@@ -0,0 +1,233 @@
+"""
+Experiment Journal Module
+Checkpoints time-lapse experiments, so a crash or power blip in a 48 hour run
+doesn't lose the schedule, and the experiment can be resumed in the same folder
+instead of starting over in a new one.
+
+Journal: experiment_journal.jsonl in the experiment folder, one JSON record per line
+-"start":     settings (GUI values, CSV, timer), well order, wall clock start time
+-"run_start": run number, schedule slot and time grid (module_run_scheduler, SHIFT moves the grid),
+              wall clock time
+-"well":      run, well number and output path, written once the file is saved
+-"run_end":   run number, wall clock time (every file of the run is saved)
+-"resume":    experiment was resumed
+-"end":       experiment finished or was stopped
+
+Each record is a single append to the file followed by os.fsync, so a record is
+either all there or (power lost in the middle of a write) a torn last line,
+which is skipped when reading. Appending keeps each checkpoint small and fast
+no matter how long the experiment has been running.
+
+Resume (get_resume_state) replays the journal: it continues from the next well
+that wasn't saved in the last run, and keeps the original start time, so the
+experiment still ends when it would have and runs stay on the same time grid
+(the original one, or where the SHIFT overrun policy last moved it).
+Times are wall clock (time.time()) because monotonic time doesn't survive a reboot.
+
+Usage:
+    journal = EJ.ExperimentJournal(folder_path)
+    journal.start(settings, well_list)
+    journal.run_start(count_run, slot, grid_time, grid_slot)
+    journal.well_done(count_run, well_number, file_full_path)
+    journal.run_end(count_run)
+    journal.end("finished")
+
+    resume_state = EJ.get_resume_state(folder_path)
+"""
+
+import json
+import os
+import threading
+import time
+
+# ==== EXPERIMENT JOURNAL CONSTANTS ====
+JOURNAL_FILE_NAME = "experiment_journal.jsonl"
+
+RECORD_START = "start"
+RECORD_RUN_START = "run_start"
+RECORD_WELL = "well"
+RECORD_RUN_END = "run_end"
+RECORD_RESUME = "resume"
+RECORD_END = "end"
+
+END_FINISHED = "finished"
+END_STOPPED = "stopped"
+
+
+def get_journal_path(folder_path):
+    return os.path.join(folder_path, JOURNAL_FILE_NAME)
+
+
+def wall_to_monotonic(wall_time):
+    """
+    Description: Converts a journal (wall clock) time into the time.monotonic() clock
+    """
+    return time.monotonic() - (time.time() - wall_time)
+
+
+def monotonic_to_wall(monotonic_time):
+    """
+    Description: Converts a time.monotonic() time into wall clock time for the journal
+    """
+    return time.time() - (time.monotonic() - monotonic_time)
+
+
+class ExperimentJournal:
+    """
+    Description: Appends checkpoint records to the experiment folder's journal (thread safe,
+                 capture pipeline workers write "well" records)
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.journal_full_path = get_journal_path(folder_path)
+        self.lock = threading.Lock()
+        self.fd = os.open(self.journal_full_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.end_torn_line()
+
+    def end_torn_line(self):
+        # A torn last line (power lost while writing) would swallow the next record, end it first
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            return
+        with open(self.journal_full_path, "rb") as f:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                os.write(self.fd, b"\n")
+                os.fsync(self.fd)
+
+    def write_record(self, record_type, **fields):
+        record = {"type": record_type, "time": time.time()}
+        record.update(fields)
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self.lock:
+            if self.fd is None:
+                return
+            os.write(self.fd, line)
+            os.fsync(self.fd)
+
+    def start(self, settings, well_list):
+        """
+        Inputs: settings, JSON friendly dictionary needed to resume (example: GUI values, CSV, timer),
+                well_list, list of (well_number, GCODE location) in visiting order
+        """
+        self.write_record(RECORD_START, settings=settings, well_list=[list(well) for well in well_list])
+
+    def run_start(self, count_run, slot=None, grid_time=None, grid_slot=None):
+        # grid_time (wall clock) and grid_slot: where the run scheduler's time grid starts
+        grid = {} if grid_time is None else {"grid_time": grid_time, "grid_slot": grid_slot}
+        self.write_record(RECORD_RUN_START, run=count_run, slot=count_run if slot is None else slot, **grid)
+
+    def well_done(self, count_run, well_number, file_full_path):
+        self.write_record(RECORD_WELL, run=count_run, well=well_number, path=file_full_path)
+
+    def run_end(self, count_run):
+        self.write_record(RECORD_RUN_END, run=count_run)
+
+    def resume(self, count_run):
+        self.write_record(RECORD_RESUME, run=count_run)
+
+    def end(self, reason):
+        self.write_record(RECORD_END, reason=reason)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+def read_journal(folder_path):
+    """
+    Return/Output: List of records (dictionaries), torn or corrupt lines are skipped
+    """
+    record_list = []
+    with open(get_journal_path(folder_path), "rb") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                record_list.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping unreadable journal line {line_number} (torn write?)")
+    return record_list
+
+
+class ResumeState:
+    """
+    Description: Where an experiment left off (from get_resume_state)
+      - settings, well_list, start_time: from the "start" record (start_time is wall clock)
+      - next_run: run to continue with
+      - next_slot: run scheduler (module_run_scheduler) grid slot of next_run
+      - grid_time, grid_slot: start of the run scheduler's time grid (grid_time is wall clock),
+        None if the journal doesn't have them (the grid starts at start_time)
+      - done_wells: well numbers of next_run that are already saved (empty if next_run hasn't started)
+      - last_run_end_time: wall clock end of the last finished run, None if no run finished
+      - output_list: (run, well_number, path) of every saved file
+      - end_reason: "finished"/"stopped" if the experiment ended, None if it was cut off
+    """
+
+    def __init__(self, settings, well_list, start_time):
+        self.settings = settings
+        self.well_list = well_list
+        self.start_time = start_time
+        self.next_run = 0
+        self.next_slot = 0
+        self.grid_time = None
+        self.grid_slot = None
+        self.done_wells = set()
+        self.last_run_end_time = None
+        self.output_list = []
+        self.end_reason = None
+
+    def is_partial_run(self):
+        return len(self.done_wells) != 0
+
+
+def get_resume_state(folder_path):
+    """
+    Description: Replays the experiment folder's journal
+    Return/Output: ResumeState
+    """
+    record_list = read_journal(folder_path)
+    start_record = next((record for record in record_list if record["type"] == RECORD_START), None)
+    if start_record is None:
+        raise ValueError(f"No experiment start in journal: {get_journal_path(folder_path)}")
+
+    resume_state = ResumeState(start_record["settings"], [tuple(well) for well in start_record["well_list"]],
+                               start_record["time"])
+    started_runs = set()
+    run_slots = {}
+    run_grids = {}
+    run_end_times = {}
+    run_wells = {}
+    for record in record_list:
+        record_type = record["type"]
+        if record_type == RECORD_RUN_START:
+            started_runs.add(record["run"])
+            run_slots[record["run"]] = record.get("slot", record["run"])
+            if "grid_time" in record:
+                run_grids[record["run"]] = (record["grid_time"], record["grid_slot"])
+        elif record_type == RECORD_WELL:
+            run_wells.setdefault(record["run"], set()).add(record["well"])
+            resume_state.output_list.append((record["run"], record["well"], record["path"]))
+        elif record_type == RECORD_RUN_END:
+            run_end_times[record["run"]] = record["time"]
+        elif record_type == RECORD_END:
+            resume_state.end_reason = record["reason"]
+        elif record_type == RECORD_RESUME:
+            # Resumed again later, the experiment didn't end after all
+            resume_state.end_reason = None
+
+    if run_end_times:
+        last_finished_run = max(run_end_times)
+        resume_state.last_run_end_time = run_end_times[last_finished_run]
+        resume_state.next_run = last_finished_run + 1
+        resume_state.next_slot = run_slots.get(last_finished_run, last_finished_run) + 1
+        resume_state.grid_time, resume_state.grid_slot = run_grids.get(last_finished_run, (None, None))
+    # A run that started but didn't finish is picked up where it stopped
+    unfinished_runs = [count_run for count_run in started_runs if count_run not in run_end_times]
+    if unfinished_runs and max(unfinished_runs) >= resume_state.next_run:
+        resume_state.next_run = max(unfinished_runs)
+        resume_state.next_slot = run_slots[resume_state.next_run]
+        resume_state.grid_time, resume_state.grid_slot = run_grids.get(resume_state.next_run, (None, None))
+        resume_state.done_wells = run_wells.get(resume_state.next_run, set())
+    return resume_state
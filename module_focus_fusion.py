@@ -0,0 +1,275 @@
+"""
+Focus Fusion Module
+Extended depth of field for Z stacks: builds one all-in-focus picture and a
+depth map (which Z each pixel is sharpest at) from a create_z_stack folder,
+instead of leaving the user to look through every _image_XX.XX_.jpg.
+
+-All-in-focus: Laplacian pyramid fusion, each pyramid level keeps the detail of
+ the slice with the most local detail energy there, the coarsest level is the average
+-Depth map: per pixel focus measure (smoothed squared Laplacian), Z of the sharpest slice
+-Memory: slices are decoded one at a time into one .npy stack on disk, then fused in
+ tiles (TILE_SIZE plus a TILE_MARGIN border so pyramid edges don't show), read with
+ module_tiled_image. A tile only
+ keeps 2 pyramids in memory no matter how many slices, so 12 MP x 40 slice stacks
+ fit in a Raspberry Pi's memory.
+-start_fusion runs fusion as a separate Python process (python3 -m module_focus_fusion FOLDER),
+ so the GUI stays responsive, and its tiles go to a process pool (FUSION_WORKERS) in there.
+ The pool is never forked from the GUI process: its serial queue, capture and Xlib threads
+ could be holding locks that a forked child would inherit.
+
+Output (in the Z stack folder):
+-_fused_.jpg: all-in-focus picture
+-_depth_.npy: depth map, Z (in mm) per pixel, float32
+-_depth_.png: depth map preview, near Z start = black, near Z end = white
+
+Usage:
+    FF.start_fusion(z_stack_folder)    # Returns right away
+    FF.fuse_z_stack(z_stack_folder)    # Blocks until done
+    python3 -m module_focus_fusion z_stack_folder [--workers 2] [--tile-size 512]
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import module_tiled_image as TI
+import module_trace as TR
+
+# ==== FOCUS FUSION CONSTANTS ====
+# Z stack slice file names from create_z_stack, example: _image_01.25_.jpg
+Z_STACK_FILE_PATTERN = re.compile(r"^_image_(-?\d+(?:\.\d*)?)_\.(?:jpg|jpeg|png|bmp)$", re.IGNORECASE)
+
+FUSED_FILE_NAME = "_fused_.jpg"
+DEPTH_FILE_NAME = "_depth_.npy"
+DEPTH_PREVIEW_FILE_NAME = "_depth_.png"
+# Decoded slices, deleted when fusion is done
+STACK_FILE_NAME = "_stack_.npy"
+
+# Tile size (in pixels) and border around each tile (must be big for more pyramid levels)
+TILE_SIZE = 512
+TILE_MARGIN = 64
+
+# Laplacian pyramid levels (each level is half the size of the one before)
+PYRAMID_LEVELS = 4
+
+# Smoothing (Gaussian sigma, in pixels) of the per pixel focus measure and the pyramid detail energy
+FOCUS_MEASURE_SIGMA = 4.0
+DETAIL_ENERGY_SIGMA = 1.0
+
+# Worker processes, leave a core for the GUI and the camera on a 4 core Raspberry Pi
+FUSION_WORKERS = 2
+
+JPEG_QUALITY = 95
+
+
+def get_z_stack_files(folder_path):
+    """
+    Return/Output: List of (z, file_full_path) sorted by z, example: [(1.2, ".../_image_001.2_.jpg"), ...]
+    """
+    z_file_list = []
+    for file_name in os.listdir(folder_path):
+        match = Z_STACK_FILE_PATTERN.match(file_name)
+        if match:
+            z_file_list.append((float(match.group(1)), os.path.join(folder_path, file_name)))
+    return sorted(z_file_list)
+
+
+def build_laplacian_pyramid(image, levels=PYRAMID_LEVELS):
+    """
+    Return/Output: List of levels + 1 float32 arrays, detail levels then the coarsest Gaussian level
+    """
+    pyramid = []
+    gaussian = image
+    for level in range(levels):
+        down = cv2.pyrDown(gaussian)
+        up = cv2.pyrUp(down, dstsize=(gaussian.shape[1], gaussian.shape[0]))
+        pyramid.append(gaussian - up)
+        gaussian = down
+    pyramid.append(gaussian)
+    return pyramid
+
+
+def collapse_laplacian_pyramid(pyramid):
+    image = pyramid[-1]
+    for detail in reversed(pyramid[:-1]):
+        image = cv2.pyrUp(image, dstsize=(detail.shape[1], detail.shape[0])) + detail
+    return image
+
+
+def get_focus_measure(gray):
+    """
+    Description: Per pixel sharpness, smoothed squared Laplacian (float32, same size as gray)
+    """
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    return cv2.GaussianBlur(laplacian * laplacian, (0, 0), FOCUS_MEASURE_SIGMA)
+
+
+def get_detail_energy(detail):
+    return cv2.GaussianBlur(np.abs(detail).sum(axis=2), (0, 0), DETAIL_ENERGY_SIGMA)
+
+
+def fuse_tile(stack_full_path, tile, margin=TILE_MARGIN, levels=PYRAMID_LEVELS):
+    """
+    Description: Fuses one tile of every slice in the .npy stack (runs in a worker process)
+    Inputs: stack_full_path, .npy file, shape (slices, height, width, 3), tile, (x, y, width, height)
+    Return/Output: (tile, fused BGR uint8 tile, index of the sharpest slice per pixel as uint16)
+    """
+    stack = TI.TiledImage(stack_full_path, is_stack=True)
+    fused_pyramid = None
+    for index in range(stack.num_slices):
+        data, core = stack.read_tile(tile, margin, index)
+        image = data.astype(np.float32)
+        focus = get_focus_measure(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        pyramid = build_laplacian_pyramid(image, levels)
+        energy_list = [get_detail_energy(detail) for detail in pyramid[:-1]]
+        if fused_pyramid is None:
+            fused_pyramid = pyramid
+            best_energy_list = energy_list
+            best_focus = focus
+            depth_index = np.zeros(focus.shape, dtype=np.uint16)
+            continue
+
+        # Keep the detail with the most energy at every level (running, so only 2 pyramids in memory)
+        for level, energy in enumerate(energy_list):
+            is_better = energy > best_energy_list[level]
+            fused_pyramid[level][is_better] = pyramid[level][is_better]
+            np.maximum(best_energy_list[level], energy, out=best_energy_list[level])
+        # Coarsest level is the sum for now (average below)
+        fused_pyramid[-1] += pyramid[-1]
+
+        is_sharper = focus > best_focus
+        depth_index[is_sharper] = index
+        np.maximum(best_focus, focus, out=best_focus)
+
+    fused_pyramid[-1] /= stack.num_slices
+    fused = collapse_laplacian_pyramid(fused_pyramid)
+
+    # Crop the margin back off
+    fused_tile = np.clip(fused[core], 0, 255).astype(np.uint8)
+    return tile, fused_tile, depth_index[core]
+
+
+def write_stack_npy(z_file_list, stack_full_path):
+    """
+    Description: Decodes each slice (one at a time) and appends it to a .npy stack on disk
+    Return/Output: (width, height)
+    """
+    first_image = cv2.imread(z_file_list[0][1])
+    if first_image is None:
+        raise ValueError(f"Can't read Z stack slice: {z_file_list[0][1]}")
+    height, width = first_image.shape[:2]
+    with TI.TiledImageWriter(stack_full_path, (len(z_file_list), height, width, 3)) as writer:
+        writer.write(first_image)
+        del first_image
+        for z, file_full_path in z_file_list[1:]:
+            image = cv2.imread(file_full_path)
+            if image is None or image.shape[:2] != (height, width):
+                raise ValueError(f"Can't read Z stack slice (or it's a different size): {file_full_path}")
+            writer.write(image)
+    return width, height
+
+
+def init_worker():
+    # One OpenCV thread per worker process, the pool already uses FUSION_WORKERS cores
+    cv2.setNumThreads(1)
+
+
+def fuse_z_stack(folder_path, tile_size=TILE_SIZE, num_workers=FUSION_WORKERS):
+    """
+    Description: Builds the all-in-focus picture and depth map of a Z stack folder (blocks until done)
+    Return/Output: (fused_full_path, depth_full_path)
+    """
+    start_time = time.monotonic()
+    z_file_list = get_z_stack_files(folder_path)
+    if len(z_file_list) < 2:
+        raise ValueError(f"Need at least 2 Z stack slices to fuse, found {len(z_file_list)} in {folder_path}")
+    z_array = np.array([z for z, file_full_path in z_file_list], dtype=np.float32)
+    print(f"Fusing Z stack: {folder_path} ({len(z_file_list)} slices)")
+
+    stack_full_path = os.path.join(folder_path, STACK_FILE_NAME)
+    depth_full_path = os.path.join(folder_path, DEPTH_FILE_NAME)
+    fused_full_path = os.path.join(folder_path, FUSED_FILE_NAME)
+    try:
+        with TR.span("fusion_decode", slices=len(z_file_list)):
+            width, height = write_stack_npy(z_file_list, stack_full_path)
+
+        fused = np.empty((height, width, 3), dtype=np.uint8)
+        depth_map = TI.TiledImage.create(depth_full_path, (height, width), dtype=np.float32)
+        tile_list = TI.get_tile_list(width, height, tile_size)
+        # spawn: workers start clean and only import this module (no inherited locks from other threads)
+        mp_context = multiprocessing.get_context("spawn")
+        with TR.span("fusion_tiles", tiles=len(tile_list)):
+            with concurrent.futures.ProcessPoolExecutor(num_workers, mp_context=mp_context,
+                                                        initializer=init_worker) as executor:
+                future_list = [executor.submit(fuse_tile, stack_full_path, tile) for tile in tile_list]
+                for future in concurrent.futures.as_completed(future_list):
+                    tile, fused_tile, depth_index = future.result()
+                    x, y, tile_width, tile_height = tile
+                    fused[y:y + tile_height, x:x + tile_width] = fused_tile
+                    depth_map.write_tile(tile, z_array[depth_index])
+
+        with TR.span("fusion_write"):
+            cv2.imwrite(fused_full_path, fused, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            z_range = max(float(z_array[-1] - z_array[0]), 1e-6)
+            depth_preview = np.empty((height, width), dtype=np.uint8)
+            for (x, y, tile_width, tile_height), data, core in depth_map.iter_tiles(tile_size):
+                depth_preview[y:y + tile_height, x:x + tile_width] = (data - z_array[0]) * (255 / z_range)
+            cv2.imwrite(os.path.join(folder_path, DEPTH_PREVIEW_FILE_NAME), depth_preview)
+            depth_map.close()
+    finally:
+        if os.path.exists(stack_full_path):
+            os.remove(stack_full_path)
+
+    print(f"Saved all-in-focus picture: {fused_full_path}, depth map: {depth_full_path} "
+          f"({time.monotonic() - start_time:.1f} sec)")
+    return fused_full_path, depth_full_path
+
+
+def start_fusion(folder_path, tile_size=TILE_SIZE, num_workers=FUSION_WORKERS):
+    """
+    Description: Runs fuse_z_stack in a separate Python process (python3 -m module_focus_fusion),
+                 a background thread waits for it and reports how it went
+    Return/Output: the thread
+    """
+    command = [sys.executable, "-m", "module_focus_fusion", os.path.abspath(folder_path),
+               "--tile-size", str(tile_size), "--workers", str(num_workers)]
+
+    def run_fusion():
+        try:
+            result = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+        except OSError as e:
+            print(f"Z stack fusion failed for {folder_path}: {e}")
+            return
+        if result.returncode != 0:
+            print(f"Z stack fusion failed for {folder_path} (exit code {result.returncode})")
+
+    fusion_thread = threading.Thread(target=run_fusion, name="Focus Fusion", daemon=True)
+    fusion_thread.start()
+    return fusion_thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="All-in-focus picture and depth map of a Z stack folder")
+    parser.add_argument("folder", help="Z stack folder (from create_z_stack)")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="tile size in pixels (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=FUSION_WORKERS,
+                        help="worker processes (default: %(default)s)")
+    args = parser.parse_args()
+    try:
+        fuse_z_stack(args.folder, args.tile_size, args.workers)
+    except Exception as e:
+        print(f"Z stack fusion failed for {args.folder}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Focus Map Module
+Remembers the sharpest Z of each well (found with module_autofocus) and fits a
+surface across the plate, so wells that weren't autofocused still get a
+predicted Z, and plates that drift or tilt during long experiments stay in focus.
+
+-Cache is keyed by well number: CSV location, best Z, and the run it was found in
+-Surface: focus offset (best Z - CSV Z) fitted over X, Y as a plane (3+ wells)
+ or a quadratic (6+ wells, SURFACE_QUADRATIC), fewer wells use the mean offset
+-Refresh: every FOCUS_MAP_REFRESH_RUNS runs, FOCUS_MAP_WELLS_PER_REFRESH wells are
+ autofocused again (never focused wells first, then the stalest). How much the
+ refreshed wells moved is applied to the other cached wells, so drift is followed
+ without searching every well.
+-Saved as JSON next to the experiment folder (temp file + rename, so a crash
+ can't leave half a file), and the next experiment with the same CSV starts from it
+
+Usage:
+    focus_map = FM.FocusMap(FM.get_focus_map_path(folder_path, csv_filename))
+    if focus_map.needs_refresh(count_run):
+        focus_map.refresh(camera, run_well_list, count_run)
+    location = focus_map.get_focused_location(well_number, location)
+"""
+
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+import module_autofocus as AF
+import module_motion_sync as MS
+import module_serial_queue as SQ
+import module_trace as TR
+
+# ==== FOCUS MAP CONSTANTS ====
+FOCUS_MAP_PREFIX = "focus_map"
+
+SURFACE_PLANE = "PLANE"
+SURFACE_QUADRATIC = "QUADRATIC"
+SURFACE_LIST = [SURFACE_PLANE, SURFACE_QUADRATIC]
+SURFACE_MODEL = SURFACE_PLANE
+
+# Autofocus some wells again every this many runs (run 0 always builds/refreshes the map)
+FOCUS_MAP_REFRESH_RUNS = 5
+
+# Wells autofocused per refresh (6 is enough for a quadratic surface)
+FOCUS_MAP_WELLS_PER_REFRESH = 6
+
+# Autofocus searches predicted Z +/- FOCUS_SEARCH_RANGE (in mm) every FOCUS_SEARCH_INCREMENT
+FOCUS_SEARCH_RANGE = 0.5
+FOCUS_SEARCH_INCREMENT = 0.05
+
+# Fixed sleep (in seconds) if motion sync fails when going to a well to autofocus
+FOCUS_MAP_MOVE_FALLBACK_TIME = 5
+
+# Minimum number of wells for each surface (fewer wells fall back to a simpler one)
+MIN_WELLS_PLANE = 3
+MIN_WELLS_QUADRATIC = 6
+
+# Finds the Z value in a GCODE move string, example: G0X10Y20Z5.00
+GCODE_Z_PATTERN = re.compile(r"Z\s*(-?\d+(?:\.\d*)?|-?\.\d+)", re.IGNORECASE)
+
+
+def get_focus_map_path(folder_path, csv_filename=None):
+    """
+    Description: Focus map JSON file next to the experiment folder, one per well location CSV
+    Return/Output: path, example: "/home/pi/Pictures/focus_map_plate_96.json"
+    """
+    parent_folder = os.path.dirname(os.path.abspath(folder_path))
+    if csv_filename:
+        csv_name = os.path.splitext(os.path.basename(csv_filename))[0]
+        return os.path.join(parent_folder, f"{FOCUS_MAP_PREFIX}_{csv_name}.json")
+    return os.path.join(parent_folder, f"{FOCUS_MAP_PREFIX}.json")
+
+
+def set_gcode_z(gcode_str, z):
+    """
+    Description: Replaces (or adds) the Z target of a GCODE move string
+    Return/Output: GCODE string, example: set_gcode_z("G0X10Y20Z5.00", 5.12) = "G0X10Y20Z5.12"
+    """
+    z_str = f"Z{z:.2f}"
+    if GCODE_Z_PATTERN.search(gcode_str):
+        return GCODE_Z_PATTERN.sub(z_str, gcode_str, count=1)
+    return gcode_str + z_str
+
+
+def get_surface_terms(x, y, surface_model):
+    # Columns of the least squares fit, offset = terms . coefficients
+    if surface_model == SURFACE_QUADRATIC:
+        return [1.0, x, y, x * x, x * y, y * y]
+    return [1.0, x, y]
+
+
+class FocusMap:
+    """
+    Description: Per well best Z cache with a fitted focus surface
+    Inputs:
+      - file_full_path, JSON file to load from (if it exists) and save to
+      - surface_model, "PLANE" or "QUADRATIC"
+      - refresh_runs, wells_per_refresh, see FOCUS_MAP_REFRESH_RUNS, FOCUS_MAP_WELLS_PER_REFRESH
+    """
+
+    def __init__(self, file_full_path, surface_model=SURFACE_MODEL, refresh_runs=FOCUS_MAP_REFRESH_RUNS,
+                 wells_per_refresh=FOCUS_MAP_WELLS_PER_REFRESH):
+        if surface_model not in SURFACE_LIST:
+            raise ValueError(f"Unknown surface model: {surface_model}, choose from {SURFACE_LIST}")
+        self.file_full_path = file_full_path
+        self.surface_model = surface_model
+        self.refresh_runs = refresh_runs
+        self.wells_per_refresh = wells_per_refresh
+        # Well number -> {"x", "y", "csv_z", "best_z", "score", "run", "time"}
+        self.wells = {}
+        # Surface actually fitted (may be simpler than surface_model) and its coefficients
+        self.fitted_model = None
+        self.coefficients = []
+        # Runs count from 0 in every experiment, so a loaded map gets refreshed on run 0
+        self.last_refresh_run = None
+        self.num_refreshes = 0
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.file_full_path):
+            return
+        try:
+            with open(self.file_full_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Can't read focus map {self.file_full_path}: {e}, starting a new one")
+            return
+        self.wells = {int(well_number): well for well_number, well in data.get("wells", {}).items()}
+        # Runs are numbered per experiment, so loaded wells all count as from before run 0
+        for well in self.wells.values():
+            well["run"] = -1
+        self.fit_surface()
+        print(f"Loaded focus map: {self.file_full_path} ({len(self.wells)} wells)")
+
+    def save(self):
+        data = {"surface_model": self.fitted_model, "coefficients": self.coefficients,
+                "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "wells": {str(well_number): well for well_number, well in sorted(self.wells.items())}}
+        temp_full_path = self.file_full_path + ".tmp"
+        with open(temp_full_path, "w") as f:
+            json.dump(data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_full_path, self.file_full_path)
+
+    def set_best_z(self, well_number, location, best_z, score=None, run=-1):
+        target = MS.get_target_location(location)
+        self.wells[well_number] = {"x": target.get("X", 0.0), "y": target.get("Y", 0.0),
+                                   "csv_z": target.get("Z", best_z), "best_z": best_z,
+                                   "score": score, "run": run, "time": time.time()}
+
+    def fit_surface(self):
+        """
+        Description: Least squares fit of the focus offset (best Z - CSV Z) over X, Y
+        """
+        well_list = list(self.wells.values())
+        if len(well_list) >= MIN_WELLS_QUADRATIC and self.surface_model == SURFACE_QUADRATIC:
+            model = SURFACE_QUADRATIC
+        elif len(well_list) >= MIN_WELLS_PLANE:
+            model = SURFACE_PLANE
+        else:
+            # Too few wells for a surface, use the mean offset (0 if empty)
+            offsets = [well["best_z"] - well["csv_z"] for well in well_list]
+            self.fitted_model = None
+            self.coefficients = [float(np.mean(offsets))] if offsets else [0.0]
+            return
+
+        terms = np.array([get_surface_terms(well["x"], well["y"], model) for well in well_list])
+        offsets = np.array([well["best_z"] - well["csv_z"] for well in well_list])
+        coefficients, residuals, rank, singular_values = np.linalg.lstsq(terms, offsets, rcond=None)
+        self.fitted_model = model
+        self.coefficients = [float(value) for value in coefficients]
+
+    def get_predicted_z(self, location):
+        """
+        Return/Output: Z predicted by the surface for a GCODE location
+        """
+        target = MS.get_target_location(location)
+        csv_z = target.get("Z", 0.0)
+        if self.fitted_model is None:
+            return csv_z + self.coefficients[0] if self.coefficients else csv_z
+        terms = get_surface_terms(target.get("X", 0.0), target.get("Y", 0.0), self.fitted_model)
+        return csv_z + float(np.dot(terms, self.coefficients))
+
+    def get_z(self, well_number, location):
+        """
+        Return/Output: Cached best Z of the well, or the surface prediction if it was never autofocused
+        """
+        if well_number in self.wells:
+            return self.wells[well_number]["best_z"]
+        return self.get_predicted_z(location)
+
+    def get_focused_location(self, well_number, location):
+        """
+        Return/Output: GCODE location with its Z replaced by the focus map Z
+        """
+        return set_gcode_z(location, self.get_z(well_number, location))
+
+    def needs_refresh(self, count_run):
+        return self.last_refresh_run is None or count_run - self.last_refresh_run >= self.refresh_runs
+
+    def choose_refresh_wells(self, well_list):
+        """
+        Description: Wells to autofocus this refresh: never focused wells first (spread out across
+                     the plate, each one farthest from the wells already picked), then the stalest
+        Return/Output: List of (well_number, location), in well_list order (keeps the travel order)
+        """
+        location_dict = dict(well_list)
+        new_wells = [well_number for well_number, location in well_list if well_number not in self.wells]
+        picked_points = [(well["x"], well["y"]) for well in self.wells.values()]
+        picked = []
+        while new_wells and len(picked) < self.wells_per_refresh:
+            def get_spread(well_number):
+                target = MS.get_target_location(location_dict[well_number])
+                x, y = target.get("X", 0.0), target.get("Y", 0.0)
+                if not picked_points:
+                    return 0
+                return min((x - px) ** 2 + (y - py) ** 2 for px, py in picked_points)
+            # First pick is the first well in the list (max of all zeros)
+            well_number = max(new_wells, key=get_spread)
+            new_wells.remove(well_number)
+            picked.append(well_number)
+            target = MS.get_target_location(location_dict[well_number])
+            picked_points.append((target.get("X", 0.0), target.get("Y", 0.0)))
+
+        stale_wells = sorted((well_number for well_number, location in well_list if well_number in self.wells),
+                             key=lambda well_number: (self.wells[well_number]["run"], self.wells[well_number]["time"]))
+        picked.extend(stale_wells[:self.wells_per_refresh - len(picked)])
+        picked_set = set(picked)
+        return [(well_number, location) for well_number, location in well_list if well_number in picked_set]
+
+    def autofocus_well(self, camera, well_number, location):
+        """
+        Description: Goes to the well at its predicted Z and searches +/- FOCUS_SEARCH_RANGE around it
+                     Needs the printer in absolute mode (G90).
+        Return/Output: (best_z, score)
+        """
+        predicted_z = round(self.get_z(well_number, location), 2)
+        gcode_str = set_gcode_z(location, predicted_z)
+        SQ.run_gcode(gcode_str)
+        MS.wait_for_move(gcode_str, FOCUS_MAP_MOVE_FALLBACK_TIME)
+        print(f"Autofocusing Well Number: {well_number} around z: {predicted_z}")
+        # Z can't go below 0 (printer's Z min endstop)
+        focus_search = AF.FocusSearch(camera, max(0.0, predicted_z - FOCUS_SEARCH_RANGE),
+                                      predicted_z + FOCUS_SEARCH_RANGE, FOCUS_SEARCH_INCREMENT)
+        best_z = focus_search.find_best_z()
+        return best_z, focus_search.best_score
+
+    def refresh(self, camera, well_list, count_run):
+        """
+        Description: Autofocuses a few wells, moves the other cached wells by how much the
+                     refreshed ones drifted, refits the surface and saves the map
+        Inputs: well_list, list of (well_number, GCODE location) for this run
+        """
+        refresh_list = self.choose_refresh_wells(well_list)
+        drift_list = []
+        with TR.span("focus_map_refresh", run=count_run, wells=len(refresh_list)):
+            for well_number, location in refresh_list:
+                best_z, score = self.autofocus_well(camera, well_number, location)
+                if well_number in self.wells:
+                    drift_list.append(best_z - self.wells[well_number]["best_z"])
+                self.set_best_z(well_number, location, best_z, score, count_run)
+
+            # Wells that weren't searched this time follow the average drift of the ones that were
+            if drift_list:
+                drift = float(np.mean(drift_list))
+                refreshed_set = set(well_number for well_number, location in refresh_list)
+                for well_number, well in self.wells.items():
+                    if well_number not in refreshed_set:
+                        well["best_z"] = round(well["best_z"] + drift, 3)
+                print(f"Focus map drift: {drift:+.3f} mm")
+
+            self.fit_surface()
+            self.save()
+        self.last_refresh_run = count_run
+        self.num_refreshes += 1
+        print(f"Focus map refreshed on run {count_run}: {len(refresh_list)} wells autofocused, "
+              f"{len(self.wells)} wells cached, surface: {self.fitted_model}")
@@ -0,0 +1,244 @@
+"""
+Job Queue Module
+Runs several experiments (protocols) on one machine at the same time, by
+taking turns with the extruder/camera between them, instead of one CSV at a
+time. Example: plate A every 10 min and plate B every 30 min.
+
+-Job: one protocol, CSV well list + capture mode (GUI values) + experiment/run time + priority
+-Queue is saved as JSON (job_queue.json, next to the experiment folders) after every change,
+ so the rig can run unattended: jobs that were running are resumed from their experiment
+ journal (module_experiment_journal) the next time the queue is run
+-run_interleaved: each job keeps its own run schedule (module_run_scheduler). When runs of
+ several jobs are due, the highest priority goes first, then the one whose first well is
+ closest to where the extruder is (less travel between jobs), then the most overdue.
+ Between runs it sleeps until the next run of any job is due.
+
+Priorities: higher number goes first, DEFAULT_PRIORITY is 0. A lower priority job's run
+waits (and its overrun policy applies) while higher priority runs are going.
+
+Usage:
+    job_queue = JQ.JobQueue(JQ.get_job_queue_path(PIC_SAVE_FOLDER))
+    job = job_queue.add_job(csv_filename, total_seconds, run_seconds, values, priority=1)
+    JQ.run_interleaved(job_queue, {job.job_id: experiment}, is_running)
+"""
+
+import json
+import os
+import threading
+import time
+
+import module_path_optimizer as PO
+import module_travel_planner as TP
+
+# ==== JOB QUEUE CONSTANTS ====
+JOB_QUEUE_FILE_NAME = "job_queue.json"
+
+STATUS_WAITING = "waiting"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_LIST = [STATUS_WAITING, STATUS_RUNNING, STATUS_DONE]
+
+DEFAULT_PRIORITY = 0
+
+
+def get_job_queue_path(folder_path):
+    return os.path.join(folder_path, JOB_QUEUE_FILE_NAME)
+
+
+class Job:
+    """
+    Description: One protocol in the queue
+      - csv_filename, well locations
+      - total_seconds, run_seconds, experiment time and time between run starts
+      - values, GUI values the experiment runs with (capture mode, path options, overrun policy...)
+      - priority, higher goes first when runs of several jobs are due
+      - folder_path, experiment folder once the job has started (None before)
+    """
+
+    def __init__(self, job_id, csv_filename, total_seconds, run_seconds, values, priority=DEFAULT_PRIORITY,
+                 status=STATUS_WAITING, folder_path=None, added=None):
+        self.job_id = job_id
+        self.csv_filename = csv_filename
+        self.total_seconds = total_seconds
+        self.run_seconds = run_seconds
+        self.values = values
+        self.priority = priority
+        self.status = status
+        self.folder_path = folder_path
+        self.added = time.strftime("%Y-%m-%d %H:%M:%S") if added is None else added
+
+    def get_name(self):
+        return f"Job {self.job_id} ({os.path.splitext(os.path.basename(self.csv_filename))[0]})"
+
+    def to_dict(self):
+        return {"job_id": self.job_id, "csv_filename": self.csv_filename, "total_seconds": self.total_seconds,
+                "run_seconds": self.run_seconds, "values": self.values, "priority": self.priority,
+                "status": self.status, "folder_path": self.folder_path, "added": self.added}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["job_id"], data["csv_filename"], data["total_seconds"], data["run_seconds"],
+                   data["values"], data.get("priority", DEFAULT_PRIORITY), data.get("status", STATUS_WAITING),
+                   data.get("folder_path"), data.get("added"))
+
+
+class JobQueue:
+    """
+    Description: Jobs saved in a JSON file, every change is saved right away (thread safe,
+                 the GUI edits the queue while it runs)
+    """
+
+    def __init__(self, file_full_path):
+        self.file_full_path = file_full_path
+        self.lock = threading.Lock()
+        self.job_list = []
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.file_full_path):
+            return
+        try:
+            with open(self.file_full_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Can't read job queue {self.file_full_path}: {e}, starting a new one")
+            return
+        self.job_list = [Job.from_dict(job) for job in data.get("jobs", [])]
+
+    def save(self):
+        data = {"saved": time.strftime("%Y-%m-%d %H:%M:%S"), "jobs": [job.to_dict() for job in self.job_list]}
+        os.makedirs(os.path.dirname(self.file_full_path) or ".", exist_ok=True)
+        temp_full_path = self.file_full_path + ".tmp"
+        with open(temp_full_path, "w") as f:
+            json.dump(data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_full_path, self.file_full_path)
+
+    def add_job(self, csv_filename, total_seconds, run_seconds, values, priority=DEFAULT_PRIORITY):
+        with self.lock:
+            job_id = max((job.job_id for job in self.job_list), default=0) + 1
+            job = Job(job_id, csv_filename, total_seconds, run_seconds, values, priority)
+            self.job_list.append(job)
+            self.save()
+        print(f"Added {job.get_name()}: every {run_seconds} sec for {total_seconds} sec, priority {priority}")
+        return job
+
+    def get_job(self, job_id):
+        for job in self.job_list:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def remove_job(self, job_id):
+        """
+        Description: Removes a job that isn't running (its experiment folder is kept)
+        Return/Output: True if removed
+        """
+        with self.lock:
+            job = self.get_job(job_id)
+            if job is None or job.status == STATUS_RUNNING:
+                return False
+            self.job_list.remove(job)
+            self.save()
+        return True
+
+    def set_priority(self, job_id, priority):
+        with self.lock:
+            job = self.get_job(job_id)
+            if job is not None:
+                job.priority = priority
+                self.save()
+
+    def set_status(self, job, status, folder_path=None):
+        if status not in STATUS_LIST:
+            raise ValueError(f"Unknown job status: {status}, choose from {STATUS_LIST}")
+        with self.lock:
+            job.status = status
+            if folder_path is not None:
+                job.folder_path = folder_path
+            self.save()
+
+    def get_pending_jobs(self):
+        """
+        Return/Output: Jobs that aren't done (running ones first, then by priority)
+        """
+        with self.lock:
+            job_list = [job for job in self.job_list if job.status != STATUS_DONE]
+        return sorted(job_list, key=lambda job: (job.status != STATUS_RUNNING, -job.priority, job.job_id))
+
+    def get_summary_list(self):
+        # One line per job, for the GUI list
+        with self.lock:
+            return [f"{job.get_name()}: every {job.run_seconds:g}s for {job.total_seconds:g}s, "
+                    f"priority {job.priority}, {job.status}" for job in self.job_list]
+
+
+def get_travel_distance(location, gcode_str):
+    """
+    Return/Output: Distance (in mm) from location (dictionary with X, Y, Z) to a GCODE move, 0 if location is unknown
+    """
+    if location is None:
+        return 0.0
+    return PO.get_location_distance(location, TP.get_location_list([gcode_str])[0])
+
+
+def choose_next_job(ready_list, location):
+    """
+    Description: Picks the run to do next from the jobs that are due
+    Inputs: ready_list, list of (job, experiment, scheduled_time), location, where the extruder is
+    Return/Output: One (job, experiment, scheduled_time) from ready_list
+    """
+    def get_order(ready):
+        job, experiment, scheduled_time = ready
+        run_well_list = experiment.get_run_well_list(location)
+        return -job.priority, get_travel_distance(location, run_well_list[0][1]), scheduled_time
+    return min(ready_list, key=get_order)
+
+
+def run_interleaved(job_queue, experiment_dict, is_running):
+    """
+    Description: Takes turns doing runs of every job's experiment until they're all done or is_running() is False.
+                 Stopped jobs stay "running" in the queue, so they're resumed the next time.
+    Inputs:
+      - experiment_dict, job_id -> experiment (plan_next_run, get_run_well_list, do_run, pause, close)
+      - is_running, function, False stops after the current run
+    """
+    active_dict = dict(experiment_dict)
+    location = None
+    while active_dict and is_running():
+        # Re-planned every time, so overrun policies see how late each job is now
+        ready_list = []
+        next_time = None
+        for job_id, experiment in list(active_dict.items()):
+            job = job_queue.get_job(job_id)
+            scheduled_time = experiment.plan_next_run()
+            if scheduled_time is None or job is None:
+                print(f"{experiment.name}: done")
+                experiment.close()
+                if job is not None:
+                    job_queue.set_status(job, STATUS_DONE)
+                del active_dict[job_id]
+                continue
+            if scheduled_time <= time.monotonic():
+                ready_list.append((job, experiment, scheduled_time))
+            elif next_time is None or scheduled_time < next_time[0]:
+                next_time = (scheduled_time, experiment)
+
+        if not ready_list:
+            if next_time is not None:
+                scheduled_time, experiment = next_time
+                print(f"Next run: {experiment.name} in {scheduled_time - time.monotonic():.1f} sec")
+                experiment.scheduler.wait_until(scheduled_time, is_running)
+            continue
+
+        job, experiment, scheduled_time = choose_next_job(ready_list, location)
+        run_well_list = experiment.get_run_well_list(location)
+        print(f"=== {experiment.name}, priority {job.priority} ===")
+        experiment.do_run(run_well_list)
+        # Camera back to preview resolution, the next job may record video
+        experiment.pause()
+        location = TP.get_location_list([run_well_list[-1][1]])[0]
+
+    for experiment in active_dict.values():
+        experiment.close()
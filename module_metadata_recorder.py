@@ -0,0 +1,223 @@
+"""
+Metadata Recorder Module
+Saves camera settings for every picture in an experiment, like
+module_get_cam_settings, but:
+-Settings that don't change during a run (resolution, iso, modes...) are only read once per run
+-Settings that change every frame (exposure, gains) are read together in one snapshot
+-Rows are kept in memory and written in batches (every FLUSH_EVERY_N_ROWS rows, or at the end
+ of each run), with os.fsync so rows from earlier batches are on disk if the power goes out
+ (a batch being written at that moment can still be cut off)
+-Every row has the same columns as the header (tuple settings are padded/cut to a fixed width),
+ even when a setting is None at first and a tuple later
+-Optional columnar NumPy .npz copy of all rows for analysis of long time-lapse experiments,
+ made from the CSV when closing (rows aren't kept in memory for it)
+
+Usage:
+    recorder = MR.MetadataRecorder(folder_path)
+    recorder.refresh_static(camera)      # Start of each run
+    recorder.record(camera, file_full_path)
+    recorder.flush()                     # End of each run
+    recorder.close()                     # End of experiment
+"""
+
+import csv
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+import module_trace as TR
+
+# ==== METADATA RECORDER CONSTANTS ====
+METADATA_CSV_PREFIX = "camera_metadata"
+
+# Write rows to disk after this many (also written at the end of every run)
+FLUSH_EVERY_N_ROWS = 24
+
+# If True, also save all rows as columns in a NumPy .npz file when closing
+SAVE_NPZ = True
+
+# Number of columns for settings that are tuples (they can be None before the camera is ready)
+ATTRIBUTE_WIDTHS = {"resolution": 2, "awb_gains": 2}
+
+# Camera settings read once per run (these only change if the user changes them)
+STATIC_ATTRIBUTES = ["resolution", "framerate", "rotation", "iso", "exposure_mode",
+                     "awb_mode", "meter_mode", "exposure_compensation", "contrast",
+                     "brightness", "saturation", "sharpness", "hflip", "vflip"]
+
+# Camera settings read for every picture
+DYNAMIC_ATTRIBUTES = ["exposure_speed", "shutter_speed", "analog_gain", "digital_gain", "awb_gains"]
+
+
+def convert_value(value):
+    """
+    Description: Converts camera values (Fractions, tuples) into CSV/NumPy friendly values
+    Return/Output: list of values (tuples are split into one value per item)
+    """
+    if isinstance(value, (tuple, list)):
+        result = []
+        for item in value:
+            result.extend(convert_value(item))
+        return result
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return [value]
+    try:
+        return [float(value)]
+    except (TypeError, ValueError):
+        return [str(value)]
+
+
+def get_column_width(attribute, value):
+    # Columns for a setting: its known tuple width, or what the first value splits into
+    return max(ATTRIBUTE_WIDTHS.get(attribute, 1), len(convert_value(value)))
+
+
+def get_column_names(attribute, width):
+    # Splits tuples into columns, example: awb_gains -> awb_gains_0, awb_gains_1
+    if width == 1:
+        return [attribute]
+    return [f"{attribute}_{i}" for i in range(width)]
+
+
+def convert_to_width(value, width):
+    """
+    Description: convert_value, padded with None or cut to width values, so the row matches the header
+    """
+    values = convert_value(value)[:width]
+    return values + [None] * (width - len(values))
+
+
+def parse_csv_value(text):
+    # CSV text back into a float/bool/None for the .npz columns
+    if text == "":
+        return None
+    if text in ("True", "False"):
+        return text == "True"
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+class MetadataRecorder:
+    """
+    Description: Buffers camera metadata rows and writes them to CSV in batches
+    Inputs:
+      - folder_path, experiment folder to save the metadata file into
+      - flush_every_n_rows, batch size
+      - save_npz, if True, also write a columnar .npz file when closing
+    """
+
+    def __init__(self, folder_path, flush_every_n_rows=FLUSH_EVERY_N_ROWS, save_npz=SAVE_NPZ):
+        unique_id = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        self.csv_full_path = os.path.join(folder_path, f"{METADATA_CSV_PREFIX}_{unique_id}.csv")
+        self.npz_full_path = os.path.join(folder_path, f"{METADATA_CSV_PREFIX}_{unique_id}.npz")
+        self.flush_every_n_rows = flush_every_n_rows
+        self.save_npz = save_npz
+
+        self.static_values = None
+        self.headers = None
+        # Attribute name to number of columns, fixed by the first row
+        self.column_widths = None
+        self.pending_rows = []
+        self.is_header_written = False
+
+    def refresh_static(self, camera):
+        """
+        Description: Reads the camera settings that don't change during a run
+        """
+        self.static_values = {}
+        for attribute in STATIC_ATTRIBUTES:
+            self.static_values[attribute] = getattr(camera, attribute, None)
+
+    def snapshot(self, camera):
+        """
+        Description: Reads every camera setting needed for a row in one go
+        Return/Output: Dictionary of attribute name to value
+        """
+        if self.static_values is None:
+            self.refresh_static(camera)
+        values = dict(self.static_values)
+        for attribute in DYNAMIC_ATTRIBUTES:
+            values[attribute] = getattr(camera, attribute, None)
+        return values
+
+    def record(self, camera, file_full_path):
+        """
+        Description: Adds a row for a picture, writes to disk if the batch is full
+        """
+        with TR.span("metadata_snapshot"):
+            values = self.snapshot(camera)
+
+        if self.headers is None:
+            self.headers = ["timestamp", "file_full_path"]
+            self.column_widths = {}
+            for attribute, value in values.items():
+                self.column_widths[attribute] = get_column_width(attribute, value)
+                self.headers.extend(get_column_names(attribute, self.column_widths[attribute]))
+
+        row = [datetime.now().isoformat(timespec="milliseconds"), file_full_path]
+        for attribute, width in self.column_widths.items():
+            row.extend(convert_to_width(values.get(attribute), width))
+
+        self.pending_rows.append(row)
+
+        if len(self.pending_rows) >= self.flush_every_n_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Description: Writes all buffered rows to the CSV file and makes sure they are on disk
+        """
+        if len(self.pending_rows) == 0:
+            return
+
+        # Make newline be blank, prevents extra empty lines from happening
+        with TR.span("metadata_csv_write", rows=len(self.pending_rows)):
+            with open(self.csv_full_path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if not self.is_header_written:
+                    writer.writerow(self.headers)
+                    self.is_header_written = True
+                writer.writerows(self.pending_rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.pending_rows = []
+
+    def save_columns(self):
+        """
+        Description: Saves all rows as one NumPy array per column (.npz), read back from the CSV file
+                     (so memory use during the experiment doesn't grow with the number of rows)
+        """
+        if not self.is_header_written:
+            return
+
+        with open(self.csv_full_path, newline="") as f:
+            reader = csv.reader(f)
+            headers = next(reader)
+            column_list = [[] for header in headers]
+            num_rows = 0
+            for row in reader:
+                for column, text in zip(column_list, row):
+                    column.append(parse_csv_value(text))
+                num_rows += 1
+
+        columns = {}
+        for header, column in zip(headers, column_list):
+            try:
+                columns[header] = np.array(column, dtype=np.float64)
+            except (TypeError, ValueError):
+                columns[header] = np.array([str(value) for value in column])
+
+        with TR.span("metadata_npz_write", rows=num_rows):
+            np.savez_compressed(self.npz_full_path, **columns)
+        print(f"Saved metadata columns: {self.npz_full_path}")
+
+    def close(self):
+        save_start = time.monotonic()
+        self.flush()
+        if self.save_npz:
+            self.save_columns()
+        print(f"Saved metadata: {self.csv_full_path} ({time.monotonic() - save_start:.2f} sec)")
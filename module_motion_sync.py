@@ -0,0 +1,210 @@
+"""
+Motion Synchronization Module
+Waits for the 3D Printer to finish a move before a sample is taken,
+instead of sleeping a fixed amount of time after every run_gcode.
+
+Sync Modes:
+-"M400":  Send M400 (finish moves) followed by M114. The printer only answers
+          the M114 once the planner is empty, so the first location reply
+          means the extruder has arrived.
+-"M114":  Poll the current location with M114 until it is within
+          MOTION_TOLERANCE (mm) of the target location.
+-"SLEEP": Original behavior, wait a fixed number of seconds.
+
+If the target can't be parsed or the printer never answers, the fixed sleep
+is used as a fallback so an experiment never runs ahead of the extruder.
+
+If the serial command queue (module_serial_queue) is running, M400/M114 are
+sent through it (module_position_query), so they can't mix with GUI commands.
+
+Testing:
+Run with the simulated printer (module_backends), example:
+    ROBOCAM_BACKEND=sim python3 3dprinter_sampler_gui_fly3.py
+Or point the printer module at it directly:
+    import module_simulated_printer as SIM
+    import module_motion_sync as MS
+    MS.printer = SIM
+"""
+
+import re
+import time
+
+import get_current_location_m114 as GCL
+import module_backends as BK
+import module_position_query as PQ
+import module_serial_queue as SQ
+import module_trace as TR
+
+# printer_connection, or the simulated printer with ROBOCAM_BACKEND=sim
+printer = BK.get_printer_module()
+
+# ==== MOTION SYNC CONSTANTS ====
+SYNC_MODE_M400 = "M400"
+SYNC_MODE_M114 = "M114"
+SYNC_MODE_SLEEP = "SLEEP"
+SYNC_MODE_LIST = [SYNC_MODE_M400, SYNC_MODE_M114, SYNC_MODE_SLEEP]
+
+# Default Sync Mode
+MOTION_SYNC_MODE = SYNC_MODE_M400
+
+# How close (in mm) the extruder must be to the target on every axis
+MOTION_TOLERANCE = 0.05
+
+# Max time (in seconds) to wait for a move before giving up
+MOTION_TIMEOUT = 30
+
+# Time between M114 location requests (in seconds)
+MOTION_POLL_INTERVAL = 0.1
+
+# Extra time (in seconds) to let vibrations die down after arriving
+MOTION_SETTLE_TIME = 0.2
+
+# M114 mode: when the arrival time is predicted (module_travel_planner), the first location
+# request goes out this many seconds before it, instead of polling during the whole move.
+# (M400 mode doesn't wait for the prediction, M400 itself returns on arrival)
+ARRIVAL_LEAD_TIME = 0.1
+
+# Finds axis/value pairs in a GCODE string, example: G0X10.5Y20Z-1
+GCODE_AXIS_PATTERN = re.compile(r"([XYZ])\s*(-?\d+(?:\.\d*)?|-?\.\d+)", re.IGNORECASE)
+
+
+def get_target_location(gcode_str):
+    """
+    Description: Extracts the X, Y, Z target from a GCODE move string
+    Input: gcode_str, example: "G0X10.00Y20.00Z5.00"
+    Return/Output: Dictionary of axis to float, example: {"X": 10.0, "Y": 20.0, "Z": 5.0}
+                   Only contains axes found in the string (empty if none).
+    """
+    target = {}
+    for axis, value in GCODE_AXIS_PATTERN.findall(gcode_str):
+        target[axis.upper()] = float(value)
+    return target
+
+
+def is_location_within_tolerance(location_dict, target_dict, tolerance=MOTION_TOLERANCE):
+    """
+    Description: Checks if every axis in target_dict is within tolerance of location_dict
+    Return/Output: True if extruder is at the target, else False
+    """
+    for axis, target_value in target_dict.items():
+        if axis not in location_dict:
+            return False
+        if abs(float(location_dict[axis]) - target_value) > tolerance:
+            return False
+    return True
+
+
+def read_location(timeout):
+    """
+    Description: Reads serial data until a M114 location reply is found
+    Input: timeout, max time (in seconds) to keep reading
+    Return/Output: location dictionary, or None if nothing was found in time
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        serial_string = printer.get_serial_data2()
+        if GCL.does_location_exist_m114(serial_string) == True:
+            location_dict, is_location_found = GCL.parse_m114(serial_string)
+            if is_location_found:
+                return location_dict
+        time.sleep(MOTION_POLL_INTERVAL)
+    return None
+
+
+def read_location_queue(timeout):
+    # Same as read_location, but the M114 goes through the serial command queue
+    try:
+        return PQ.query_position(timeout=timeout)
+    except PQ.PositionQueryError as e:
+        print(f"Motion sync: {e}")
+        return None
+
+
+def wait_m400(target_dict, timeout):
+    # M400 blocks the printer's command queue until all moves are done,
+    # so the M114 reply only comes back after the extruder has arrived.
+    if SQ.is_running():
+        SQ.send("M400")
+        location_dict = read_location_queue(timeout)
+    else:
+        printer.run_gcode("M400")
+        printer.run_gcode("M114")
+        location_dict = read_location(timeout)
+    if location_dict is None:
+        return False
+    if not is_location_within_tolerance(location_dict, target_dict):
+        print(f"M400 finished, but location {location_dict} does not match target {target_dict}")
+    return True
+
+
+def wait_m114(target_dict, tolerance, timeout, expected_seconds=0):
+    deadline = time.monotonic() + timeout
+    # Don't poll the printer while it is still far from arriving
+    if expected_seconds > ARRIVAL_LEAD_TIME:
+        time.sleep(min(expected_seconds - ARRIVAL_LEAD_TIME, timeout))
+    while time.monotonic() < deadline:
+        if SQ.is_running():
+            location_dict = read_location_queue(deadline - time.monotonic())
+        else:
+            printer.run_gcode("M114")
+            location_dict = read_location(deadline - time.monotonic())
+        if location_dict is None:
+            return False
+        if is_location_within_tolerance(location_dict, target_dict, tolerance):
+            return True
+        time.sleep(MOTION_POLL_INTERVAL)
+    return False
+
+
+def wait_for_arrival(gcode_str, mode, tolerance, timeout, expected_seconds=0):
+    """
+    Description: Blocks until the printer says the move in gcode_str is finished (no settle time)
+    Return/Output: True if synced with the printer, False if the fallback sleep is needed
+    """
+    target_dict = get_target_location(gcode_str)
+    if mode == SYNC_MODE_SLEEP or len(target_dict) == 0:
+        return False
+
+    is_synced = False
+    if mode == SYNC_MODE_M400:
+        # Sent right away, the printer answers as soon as the move is done (a too high prediction adds nothing)
+        is_synced = wait_m400(target_dict, timeout)
+    elif mode == SYNC_MODE_M114:
+        is_synced = wait_m114(target_dict, tolerance, timeout, expected_seconds)
+    else:
+        print(f"Unknown motion sync mode: {mode}, using fixed sleep")
+
+    if not is_synced and mode in (SYNC_MODE_M400, SYNC_MODE_M114):
+        print(f"Motion sync ({mode}) failed for {gcode_str}, using fixed sleep")
+    return is_synced
+
+
+def wait_for_move(gcode_str, fallback_seconds, mode=None, tolerance=None, timeout=None, expected_seconds=0):
+    """
+    Description: Blocks until the move in gcode_str is finished.
+    Inputs:
+      - gcode_str, the move GCODE that was just sent, example: "G0X10Y20Z5"
+      - fallback_seconds, fixed time to sleep if mode is "SLEEP" or syncing fails
+      - mode, tolerance, timeout: override MOTION_SYNC_MODE, MOTION_TOLERANCE, MOTION_TIMEOUT
+      - expected_seconds, predicted travel time, M114 polling starts ARRIVAL_LEAD_TIME before it
+    Return/Output: Time waited (in seconds)
+    """
+    if mode is None:
+        mode = MOTION_SYNC_MODE
+    if tolerance is None:
+        tolerance = MOTION_TOLERANCE
+    if timeout is None:
+        timeout = MOTION_TIMEOUT
+
+    wait_start = time.monotonic()
+    with TR.span("wait_for_arrival", gcode=gcode_str, mode=mode):
+        is_synced = wait_for_arrival(gcode_str, mode, tolerance, timeout, expected_seconds)
+
+    if is_synced:
+        with TR.span("settle"):
+            time.sleep(MOTION_SETTLE_TIME)
+    else:
+        with TR.span("fallback_sleep"):
+            time.sleep(fallback_seconds)
+
+    return time.monotonic() - wait_start
@@ -0,0 +1,146 @@
+"""
+Path Optimizer Module
+Reorders the wells from the CSV file so the extruder travels the shortest
+distance, using a nearest neighbour path improved with 2-opt.
+
+Well numbers stay the same as in the CSV (well 1 is always the first row),
+so filenames from prepare_experiment.get_file_full_path still match the
+original well IDs. Only the visiting order changes.
+
+Boustrophedon (alternate direction):
+Runs go forward, then backward, then forward... so the extruder does not
+travel from the last well back to the first well between runs.
+"""
+
+import math
+
+import module_travel_planner as TP
+
+# Max number of 2-opt passes over the path (stops early once nothing improves)
+MAX_TWO_OPT_PASSES = 50
+
+
+def get_location_distance(location_a, location_b):
+    # Straight line XYZ distance in mm
+    return math.sqrt((location_a["X"] - location_b["X"]) ** 2 +
+                     (location_a["Y"] - location_b["Y"]) ** 2 +
+                     (location_a["Z"] - location_b["Z"]) ** 2)
+
+
+def get_path_distance(location_list, order, is_closed=False):
+    """
+    Description: Total travel distance (in mm) going through location_list in order
+    Inputs:
+      - order, list of indices into location_list
+      - is_closed, if True, include the trip from the last location back to the first
+    """
+    if len(order) < 2:
+        return 0.0
+    distance = 0.0
+    for i in range(len(order) - 1):
+        distance += get_location_distance(location_list[order[i]], location_list[order[i + 1]])
+    if is_closed:
+        distance += get_location_distance(location_list[order[-1]], location_list[order[0]])
+    return distance
+
+
+def get_nearest_neighbour_order(location_list, start_index=0):
+    """
+    Description: Greedy path, always go to the closest well not visited yet
+    Return/Output: List of indices into location_list
+    """
+    if len(location_list) == 0:
+        return []
+
+    unvisited = set(range(len(location_list)))
+    unvisited.remove(start_index)
+    order = [start_index]
+    while len(unvisited) != 0:
+        current = location_list[order[-1]]
+        # Ties go to the lowest index so the result is always the same
+        next_index = min(unvisited, key=lambda index: (get_location_distance(current, location_list[index]), index))
+        unvisited.remove(next_index)
+        order.append(next_index)
+    return order
+
+
+def improve_two_opt(location_list, order, is_closed=False):
+    """
+    Description: 2-opt improvement, reverses parts of the path while that makes it shorter
+    Return/Output: New (or same) list of indices into location_list
+    """
+    order = list(order)
+    count = len(order)
+    if count < 4:
+        return order
+
+    def distance(i, j):
+        return get_location_distance(location_list[order[i]], location_list[order[j]])
+
+    for i_pass in range(MAX_TWO_OPT_PASSES):
+        is_improved = False
+        # The first well stays first (it is where the run starts)
+        for i in range(1, count - 1):
+            for j in range(i + 1, count):
+                # Edges (i-1, i) and (j, j+1) get replaced by (i-1, j) and (i, j+1)
+                before = distance(i - 1, i)
+                after = distance(i - 1, j)
+                if j + 1 < count:
+                    before += distance(j, j + 1)
+                    after += distance(i, j + 1)
+                elif is_closed:
+                    before += distance(j, 0)
+                    after += distance(i, 0)
+
+                if after < before - 1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    is_improved = True
+        if not is_improved:
+            break
+    return order
+
+
+def optimize_well_order(gcode_string_list, is_alternating=False):
+    """
+    Description: Finds a shorter order to visit the wells and prints the distance saved
+    Inputs:
+      - gcode_string_list, GCODE move list from prepare_experiment.convert_list_to_gcode_strings
+      - is_alternating, True if runs will alternate direction (path doesn't loop back to the start)
+    Return/Output: List of (well_number, gcode_str) tuples in the new order.
+                   well_number is the original 1-based position in gcode_string_list.
+    """
+    location_list = TP.get_location_list(gcode_string_list)
+    original_order = list(range(len(location_list)))
+
+    # Runs that repeat in the same direction go back to the first well, so include that trip
+    is_closed = not is_alternating
+
+    new_order = get_nearest_neighbour_order(location_list)
+    new_order = improve_two_opt(location_list, new_order, is_closed)
+
+    original_distance = get_path_distance(location_list, original_order, is_closed)
+    new_distance = get_path_distance(location_list, new_order, is_closed)
+
+    # Never make things worse than the CSV order
+    if new_distance >= original_distance:
+        new_order = original_order
+        new_distance = original_distance
+
+    saved_distance = original_distance - new_distance
+    saved_percent = 0.0
+    if original_distance > 0:
+        saved_percent = 100 * saved_distance / original_distance
+    print(f"Travel distance per run: original {original_distance:.1f} mm, "
+          f"optimized {new_distance:.1f} mm, saved {saved_distance:.1f} mm ({saved_percent:.1f}%)")
+
+    return [(index + 1, gcode_string_list[index]) for index in new_order]
+
+
+def get_run_well_list(well_list, count_run, is_alternating=False):
+    """
+    Description: Gets the (well_number, gcode_str) list for a run,
+                 reversed on every other run if alternating direction
+    """
+    if is_alternating and count_run % 2 == 1:
+        return list(reversed(well_list))
+    return list(well_list)
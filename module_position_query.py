@@ -0,0 +1,155 @@
+"""
+Position Query Module
+Gets the current extruder location with one M114 round trip.
+
+get_current_location2 used to send M114, sleep 1 second, and throw away the
+first answer in case it was old, so it took 2-20 seconds. Here:
+-Old data waiting in the serial input buffer is thrown away before asking
+-Each request gets a number (request_id), used in the error messages/logs
+-Lines are read as they arrive until the location line and its "ok"
+-Errors are raised as exceptions (timeout, no location in reply) instead of -1.00 values
+
+If the serial command queue (module_serial_queue) is running, M114 goes
+through it instead, and its reply lines are matched to this request by the queue.
+
+Testing without a 3D Printer:
+    import serial
+    import module_simulated_printer as SIM
+    port_name = SIM.start_pty_printer()
+    serial_port = serial.Serial(port_name, 115200, timeout=1)
+    location = PQ.query_position(serial_port)
+"""
+
+import concurrent.futures
+import itertools
+import time
+
+import get_current_location_m114 as GCL
+import module_backends as BK
+import module_serial_queue as SQ
+
+# printer_connection, or the simulated printer with ROBOCAM_BACKEND=sim
+printer = BK.get_printer_module()
+
+# ==== POSITION QUERY CONSTANTS ====
+# Max time (in seconds) to wait for the location reply
+POSITION_QUERY_TIMEOUT = 2.0
+
+# Serial read timeout (in seconds) while waiting for each chunk of data
+SERIAL_READ_TIMEOUT = 0.05
+
+_request_counter = itertools.count(1)
+
+
+class PositionQueryError(Exception):
+    """
+    Description: Base error for position queries
+    """
+    def __init__(self, message, request_id=None, lines=None):
+        super().__init__(message)
+        self.request_id = request_id
+        # Serial lines received before the error (for debugging)
+        self.lines = lines if lines is not None else []
+
+
+class PositionTimeoutError(PositionQueryError):
+    """
+    Description: Printer didn't answer with a location (and ok) in time
+    """
+
+
+class PositionParseError(PositionQueryError):
+    """
+    Description: Printer answered, but the location couldn't be read
+    """
+
+
+def read_lines(serial_port, deadline):
+    """
+    Description: Yields decoded lines from serial_port as they arrive, until deadline (time.monotonic())
+    """
+    buffer = b""
+    while time.monotonic() < deadline:
+        chunk = serial_port.read(max(1, serial_port.in_waiting))
+        if len(chunk) == 0:
+            continue
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            yield line.decode("utf-8", errors="replace").strip()
+
+
+def query_position_queue(timeout=POSITION_QUERY_TIMEOUT):
+    """
+    Description: Sends M114 through the serial command queue and reads the location from its reply lines
+    Return/Output: location dictionary
+    Raises: PositionTimeoutError, PositionParseError
+    """
+    request_id = next(_request_counter)
+    future = SQ.send("M114")
+    try:
+        lines = future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise PositionTimeoutError(f"M114 request #{request_id}: no reply after {timeout} sec", request_id)
+    except Exception as e:
+        raise PositionQueryError(f"M114 request #{request_id}: {e}", request_id)
+
+    for line in lines:
+        if GCL.does_location_exist_m114(line) == True:
+            location_dict, is_location_found = GCL.parse_m114(line)
+            if is_location_found:
+                return location_dict
+    raise PositionParseError(f"M114 request #{request_id}: no location in reply: {lines}", request_id, lines)
+
+
+def query_position(serial_port=None, timeout=POSITION_QUERY_TIMEOUT):
+    """
+    Description: Sends M114 and waits for its location line and "ok"
+    Inputs:
+      - serial_port, pyserial Serial object (default: the serial command queue if it is
+        running, else printer_connection's printer.printer)
+      - timeout, max time (in seconds) to wait
+    Return/Output: location dictionary from GCL.parse_m114, example: {"X": 10.0, "Y": 20.0, "Z": 5.0}
+    Raises: PositionTimeoutError, PositionParseError
+    """
+    if serial_port is None:
+        if SQ.is_running():
+            return query_position_queue(timeout)
+        serial_port = printer.printer
+
+    request_id = next(_request_counter)
+    received_lines = []
+    location_dict = None
+
+    old_timeout = serial_port.timeout
+    serial_port.timeout = SERIAL_READ_TIMEOUT
+    try:
+        # Anything already waiting is from an earlier command, so it can't be this location
+        serial_port.reset_input_buffer()
+        serial_port.write(b"M114\n")
+        serial_port.flush()
+
+        deadline = time.monotonic() + timeout
+        for line in read_lines(serial_port, deadline):
+            if len(line) == 0:
+                continue
+            received_lines.append(line)
+
+            if location_dict is None and GCL.does_location_exist_m114(line) == True:
+                location_dict, is_location_found = GCL.parse_m114(line)
+                if not is_location_found:
+                    raise PositionParseError(f"M114 request #{request_id}: could not read location from: {line}",
+                                             request_id, received_lines)
+            elif line.startswith("ok") and location_dict is not None:
+                # "ok" after the location line means M114 is done
+                return location_dict
+            # An "ok" before the location line belongs to an earlier command, keep reading
+    finally:
+        serial_port.timeout = old_timeout
+
+    if location_dict is not None:
+        # Got the location but the "ok" didn't arrive in time, location is still good
+        return location_dict
+    raise PositionTimeoutError(f"M114 request #{request_id}: no location after {timeout} sec",
+                               request_id, received_lines)
@@ -0,0 +1,209 @@
+"""
+Run Scheduler Module
+Starts experiment runs on a fixed time grid (experiment start + n * run_seconds),
+so run intervals stay exact for growth-rate analysis, instead of waiting
+run_seconds after each run finishes (which drifts by the cycle time every run).
+
+-Sleeps until each run's absolute deadline (time.monotonic() clock), in short
+ steps so "Stop Experiment" is still noticed right away, no busy waiting
+-A run is only started if its whole interval fits in the experiment time
+ (module_experiment_timer total/run time); the first run always starts
+-Overrun policies, for when a run is ready more than OVERRUN_GRACE_SECONDS after its deadline
+ (the plate pass took longer than run_seconds, or the experiment was resumed):
+  -"SKIP": drop the runs whose whole interval was missed, the run of the current
+   interval starts right away (late), so runs stay on the grid
+  -"CATCH_UP": start missed runs right away, back to back, until back on the grid
+  -"SHIFT": start now and move the rest of the grid by the delay
+-Records the scheduled and actual start of each run (save_csv / print_report)
+
+Usage:
+    scheduler = RS.RunScheduler(total_seconds, run_seconds, RS.OVERRUN_SKIP)
+    while True:
+        scheduled_time = scheduler.plan_next_run()
+        if scheduled_time is None or not scheduler.wait_until(scheduled_time, is_running):
+            break
+        scheduler.start_run(count_run)
+        ... go through wells ...
+    scheduler.print_report()
+"""
+
+import csv
+import math
+import time
+
+import module_trace as TR
+
+# ==== RUN SCHEDULER CONSTANTS ====
+OVERRUN_SKIP = "SKIP"
+OVERRUN_CATCH_UP = "CATCH_UP"
+OVERRUN_SHIFT = "SHIFT"
+OVERRUN_POLICY_LIST = [OVERRUN_SKIP, OVERRUN_CATCH_UP, OVERRUN_SHIFT]
+
+# Default
+OVERRUN_POLICY = OVERRUN_SKIP
+
+# A run up to this late (in seconds) is started as scheduled, without the overrun policy
+OVERRUN_GRACE_SECONDS = 2.0
+
+# Longest single sleep (in seconds) while waiting for a run, how fast "Stop Experiment" is noticed
+STOP_POLL_SECONDS = 0.25
+
+
+class RunRecord:
+    """
+    Description: Scheduled vs actual start of one run (times are time.monotonic())
+    """
+
+    def __init__(self, run, slot, scheduled_time, actual_time, wall_time):
+        self.run = run
+        self.slot = slot
+        self.scheduled_time = scheduled_time
+        self.actual_time = actual_time
+        self.wall_time = wall_time
+
+    def get_lateness(self):
+        return self.actual_time - self.scheduled_time
+
+
+class RunScheduler:
+    """
+    Description: Plans run start times on the grid start_time + slot * run_seconds
+    Inputs:
+      - total_seconds, run_seconds, experiment time and time between run starts (module_experiment_timer)
+      - overrun_policy, "SKIP", "CATCH_UP" or "SHIFT"
+      - start_time, time.monotonic() of the experiment start (default: now)
+      - clock, function returning the current time (time.monotonic, get_runs_that_fit passes its own)
+      - is_verbose, print overruns and run starts
+    """
+
+    def __init__(self, total_seconds, run_seconds, overrun_policy=OVERRUN_POLICY, start_time=None,
+                 clock=time.monotonic, is_verbose=True):
+        if overrun_policy not in OVERRUN_POLICY_LIST:
+            raise ValueError(f"Unknown overrun policy: {overrun_policy}, choose from {OVERRUN_POLICY_LIST}")
+        self.total_seconds = total_seconds
+        self.run_seconds = run_seconds
+        self.overrun_policy = overrun_policy
+        self.clock = clock
+        self.is_verbose = is_verbose
+        self.start_time = clock() if start_time is None else start_time
+        # Grid slot of the next run, and where the grid starts (SHIFT moves it)
+        self.slot = 0
+        self.grid_time = self.start_time
+        self.grid_slot = 0
+        # Scheduled time of the planned run (plan_next_run)
+        self.scheduled_time = None
+        self.num_skipped = 0
+        self.record_list = []
+
+    def log(self, message):
+        if self.is_verbose:
+            print(message)
+
+    def get_slot_time(self, slot):
+        return self.grid_time + (slot - self.grid_slot) * self.run_seconds
+
+    def resume(self, slot, grid_time=None, grid_slot=None):
+        """
+        Description: Continues a resumed experiment's grid at slot (same start_time as the original)
+        Inputs: grid_time (time.monotonic()), grid_slot: where SHIFT last moved the grid (None: not moved)
+        """
+        self.slot = slot
+        if grid_time is not None:
+            self.grid_time = grid_time
+            self.grid_slot = grid_slot
+
+    def plan_next_run(self):
+        """
+        Description: Applies the overrun policy if the next run is late
+        Return/Output: Scheduled start (time.monotonic()) of the next run, None if it doesn't fit in the experiment
+        """
+        now = self.clock()
+        if self.run_seconds <= 0:
+            # Runs back to back, nothing to drift from
+            scheduled_time = now if self.slot != 0 else self.start_time
+        else:
+            scheduled_time = self.get_slot_time(self.slot)
+            lateness = now - scheduled_time
+            if lateness > OVERRUN_GRACE_SECONDS:
+                if self.overrun_policy == OVERRUN_SKIP:
+                    # Slot of the interval that is going on now
+                    missed = math.floor(lateness / self.run_seconds)
+                    self.slot += missed
+                    self.num_skipped += missed
+                    scheduled_time = self.get_slot_time(self.slot)
+                    if missed != 0:
+                        self.log(f"Run is {lateness:.1f} sec late, skipping {missed} run(s)")
+                    else:
+                        self.log(f"Run is {lateness:.1f} sec late, starting it now")
+                elif self.overrun_policy == OVERRUN_SHIFT:
+                    self.grid_time = now
+                    self.grid_slot = self.slot
+                    scheduled_time = now
+                    self.log(f"Run is {lateness:.1f} sec late, shifting the rest of the runs by that")
+                else:
+                    self.log(f"Run is {lateness:.1f} sec late, catching up")
+
+        # The first run always happens, later runs only if the whole run interval fits
+        run_start_time = max(now, scheduled_time)
+        if self.slot != 0 and run_start_time - self.start_time + self.run_seconds > self.total_seconds:
+            self.scheduled_time = None
+            return None
+        self.scheduled_time = scheduled_time
+        return scheduled_time
+
+    def wait_until(self, scheduled_time, is_running=None):
+        """
+        Description: Sleeps until scheduled_time (returns right away if it has passed)
+        Inputs: is_running, function checked every STOP_POLL_SECONDS, stops waiting if it returns False
+        Return/Output: True if scheduled_time was reached, False if stopped
+        """
+        with TR.span("wait_for_run", slot=self.slot):
+            while True:
+                if is_running is not None and not is_running():
+                    return False
+                remaining = scheduled_time - self.clock()
+                if remaining <= 0:
+                    return True
+                time.sleep(min(remaining, STOP_POLL_SECONDS))
+
+    def start_run(self, run, actual_time=None):
+        """
+        Description: Records the planned run's start (call right before going to the first well)
+        Return/Output: RunRecord
+        """
+        if actual_time is None:
+            actual_time = self.clock()
+        scheduled_time = self.scheduled_time if self.scheduled_time is not None else self.get_slot_time(self.slot)
+        wall_time = time.time() - (time.monotonic() - actual_time)
+        record = RunRecord(run, self.slot, scheduled_time, actual_time, wall_time)
+        self.record_list.append(record)
+        self.slot += 1
+        self.scheduled_time = None
+        self.log(f"Run started {record.get_lateness():+.3f} sec from schedule "
+                 f"({actual_time - self.start_time:.1f} sec into the experiment)")
+        return record
+
+    def get_seconds_left(self):
+        return self.total_seconds - (self.clock() - self.start_time)
+
+    def print_report(self):
+        if not self.record_list:
+            return
+        lateness_list = [record.get_lateness() for record in self.record_list]
+        print("=========================")
+        print("Run Schedule Report")
+        print(f"Runs: {len(self.record_list)}, skipped: {self.num_skipped}, overrun policy: {self.overrun_policy}")
+        print(f"Start lateness (sec): mean {sum(lateness_list) / len(lateness_list):.3f}, "
+              f"max {max(lateness_list):.3f}")
+        print("=========================")
+
+    def save_csv(self, file_full_path):
+        with open(file_full_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["run", "slot", "scheduled_seconds", "actual_seconds", "lateness_seconds", "actual_wall_time"])
+            for record in self.record_list:
+                writer.writerow([record.run, record.slot,
+                                 f"{record.scheduled_time - self.start_time:.4f}",
+                                 f"{record.actual_time - self.start_time:.4f}",
+                                 f"{record.get_lateness():.4f}", f"{record.wall_time:.4f}"])
+        print(f"Saved run schedule: {file_full_path}")
@@ -0,0 +1,284 @@
+"""
+Serial Command Queue Module
+One thread owns the 3D Printer serial port. Everyone else (GUI buttons,
+experiment thread, Z stack, location queries) puts GCODE into its queue and
+gets a Future back, so commands from different threads can never mix their
+bytes or steal each other's replies.
+
+Flow control (streaming):
+Marlin answers every command with "ok" once it has room for it in its
+planner buffer. Up to WINDOW_SIZE commands are sent ahead without waiting,
+then one more is sent every time an "ok" comes back. A list of well
+locations can be sent in one go without waiting a round trip per command.
+
+Each Future's result is the list of lines the printer sent for that command,
+ending with its "ok" line (example for M114: ["X:10.00 Y:20.00 Z:5.00 ...", "ok"]).
+
+Errors (the queue never waits forever):
+-A command answered with "Error:"/"Resend:" lines (Marlin didn't run it) fails with SerialCommandError
+-If nothing comes back for COMMAND_TIMEOUT seconds (lost "ok", printer halted), every command
+ in flight fails with SerialTimeoutError, the input buffer is cleared and the queue keeps going
+
+Usage:
+    SQ.start(printer.printer)
+    future = SQ.send("G0X10Y20Z5")
+    lines = SQ.send("M114").result(timeout=2)
+    SQ.stop()
+"""
+
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+
+import module_backends as BK
+import module_trace as TR
+
+# printer_connection, or the simulated printer with ROBOCAM_BACKEND=sim
+printer = BK.get_printer_module()
+
+# ==== SERIAL COMMAND QUEUE CONSTANTS ====
+# Commands sent ahead of their "ok" (keep below Marlin's BUFSIZE, default 4)
+WINDOW_SIZE = 4
+
+# Serial read timeout (in seconds) while waiting for replies
+SERIAL_READ_TIMEOUT = 0.01
+
+# Time (in seconds) the queue thread sleeps when there is nothing to do
+IDLE_WAIT_TIME = 0.1
+
+# Max time (in seconds) without any reply line while commands are in flight (M400/G28 can take a while,
+# Marlin's "busy: processing" lines count as replies)
+COMMAND_TIMEOUT = 60
+
+# Reply lines that mean Marlin didn't run the command
+ERROR_PREFIXES = ("Error:", "Resend:", "!!")
+
+# Shared queue (see start/send/stop)
+_command_queue = None
+
+
+class SerialCommandError(Exception):
+    """
+    Description: Printer answered a command with an error (reply lines are in lines)
+    """
+    def __init__(self, message, lines=None):
+        super().__init__(message)
+        self.lines = lines if lines is not None else []
+
+
+class SerialTimeoutError(SerialCommandError):
+    """
+    Description: No reply for COMMAND_TIMEOUT seconds, the command may or may not have run
+    """
+
+
+class SerialCommandQueue:
+    """
+    Description: Thread that owns a serial port and streams GCODE with ok-based flow control
+    Inputs:
+      - serial_port, pyserial Serial object (example: printer_connection's printer.printer)
+      - window_size, max commands sent without an "ok" yet
+      - command_timeout, max seconds without a reply before the commands in flight fail
+    """
+
+    def __init__(self, serial_port, window_size=WINDOW_SIZE, name="Serial Command Queue",
+                 command_timeout=COMMAND_TIMEOUT):
+        self.serial_port = serial_port
+        self.window_size = window_size
+        self.command_timeout = command_timeout
+        self.name = name
+        self.submit_queue = queue.Queue()
+        # Sent, waiting for "ok": deque of [gcode, future, reply lines]
+        self.in_flight = collections.deque()
+        self.read_buffer = b""
+        # time.monotonic() of the last reply line (or send while nothing was in flight)
+        self.last_reply_time = time.monotonic()
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.serial_port.timeout = SERIAL_READ_TIMEOUT
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def submit(self, gcode_str):
+        """
+        Description: Queues one GCODE command
+        Return/Output: concurrent.futures.Future, result is the list of reply lines
+        """
+        future = concurrent.futures.Future()
+        if not self.is_running:
+            future.set_exception(RuntimeError(f"{self.name} is not running"))
+            return future
+        self.submit_queue.put((gcode_str.strip(), future))
+        return future
+
+    def submit_many(self, gcode_string_list):
+        return [self.submit(gcode_str) for gcode_str in gcode_string_list]
+
+    def send_waiting_commands(self):
+        # Fill the window with commands waiting to be sent
+        while len(self.in_flight) < self.window_size:
+            # Only block when nothing is in flight (no replies to wait for)
+            block = len(self.in_flight) == 0
+            try:
+                gcode_str, future = self.submit_queue.get(block=block, timeout=IDLE_WAIT_TIME)
+            except queue.Empty:
+                return
+            if gcode_str is None:
+                # stop() was called
+                self.is_running = False
+                return
+            if not future.set_running_or_notify_cancel():
+                # Caller cancelled it before it was sent
+                continue
+            if len(gcode_str) == 0:
+                future.set_result([])
+                continue
+            try:
+                with TR.span("serial_write", gcode=gcode_str):
+                    self.serial_port.write((gcode_str + "\n").encode("utf-8"))
+                if len(self.in_flight) == 0:
+                    self.last_reply_time = time.monotonic()
+                self.in_flight.append([gcode_str, future, []])
+            except Exception as e:
+                future.set_exception(e)
+
+    def read_replies(self):
+        chunk = self.serial_port.read(max(1, self.serial_port.in_waiting))
+        if len(chunk) == 0:
+            return
+        self.read_buffer += chunk
+        while b"\n" in self.read_buffer:
+            line, self.read_buffer = self.read_buffer.split(b"\n", 1)
+            line = line.decode("utf-8", errors="replace").strip()
+            if len(line) == 0:
+                continue
+            self.last_reply_time = time.monotonic()
+            if len(self.in_flight) == 0:
+                # Not an answer to anything we sent (startup messages, etc.)
+                continue
+            # Marlin runs commands in order, so replies belong to the oldest command in flight
+            gcode_str, future, lines = self.in_flight[0]
+            lines.append(line)
+            if line.startswith("ok"):
+                self.in_flight.popleft()
+                error_lines = [item for item in lines if item.startswith(ERROR_PREFIXES)]
+                if error_lines:
+                    future.set_exception(SerialCommandError(f"{gcode_str}: {' '.join(error_lines)}", lines))
+                else:
+                    future.set_result(lines)
+
+    def check_timeout(self):
+        # A lost "ok" would keep the window full forever: fail what's in flight and start over
+        if time.monotonic() - self.last_reply_time <= self.command_timeout:
+            return
+        gcode_list = [item[0] for item in self.in_flight]
+        print(f"{self.name}: no reply for {self.command_timeout} sec, failing {len(gcode_list)} command(s): "
+              f"{gcode_list}")
+        while len(self.in_flight) != 0:
+            gcode_str, future, lines = self.in_flight.popleft()
+            if not future.done():
+                future.set_exception(SerialTimeoutError(f"{gcode_str}: no reply after {self.command_timeout} sec",
+                                                        lines))
+        # Late replies to the failed commands would be matched to the next ones
+        self.read_buffer = b""
+        self.serial_port.reset_input_buffer()
+
+    def run(self):
+        while self.is_running or len(self.in_flight) != 0:
+            if self.is_running:
+                self.send_waiting_commands()
+            if len(self.in_flight) != 0:
+                try:
+                    self.read_replies()
+                    self.check_timeout()
+                except Exception as e:
+                    print(f"{self.name}: serial read failed: {e}")
+                    self.fail_all(e)
+                    break
+        self.fail_all(RuntimeError(f"{self.name} stopped"))
+
+    def fail_all(self, exception):
+        while len(self.in_flight) != 0:
+            gcode_str, future, lines = self.in_flight.popleft()
+            if not future.done():
+                future.set_exception(exception)
+        while True:
+            try:
+                gcode_str, future = self.submit_queue.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None and not future.done():
+                future.set_exception(exception)
+
+    def stop(self, timeout=5):
+        """
+        Description: Sends everything already queued, waits for the replies, then stops the thread
+        """
+        if self.thread is None:
+            return
+        self.submit_queue.put((None, None))
+        self.thread.join(timeout=timeout)
+        self.thread = None
+
+
+def start(serial_port, window_size=WINDOW_SIZE):
+    """
+    Description: Starts the shared queue, from now on send() goes through it
+    """
+    global _command_queue
+    if _command_queue is not None:
+        return _command_queue
+    _command_queue = SerialCommandQueue(serial_port, window_size)
+    _command_queue.start()
+    return _command_queue
+
+
+def stop():
+    global _command_queue
+    if _command_queue is not None:
+        _command_queue.stop()
+        _command_queue = None
+
+
+def is_running():
+    return _command_queue is not None and _command_queue.is_running
+
+
+def send(gcode_str):
+    """
+    Description: Sends GCODE through the shared queue. If the queue isn't
+                 running, uses printer_connection.run_gcode like before.
+    Return/Output: concurrent.futures.Future with the reply lines
+    """
+    if is_running():
+        start_ns = time.monotonic_ns()
+        future = _command_queue.submit(gcode_str)
+        if TR.is_enabled():
+            # The span covers queueing, sending and waiting for the "ok" (ends in the queue thread)
+            future.add_done_callback(
+                lambda done_future: TR.add_span("run_gcode", start_ns, time.monotonic_ns(), args={"gcode": gcode_str}))
+        return future
+
+    with TR.span("run_gcode", gcode=gcode_str):
+        future = concurrent.futures.Future()
+        printer.run_gcode(gcode_str)
+        future.set_result([])
+        return future
+
+
+def run_gcode(gcode_str):
+    # Drop-in for printer.run_gcode that goes through the queue (doesn't wait for "ok")
+    return send(gcode_str)
+
+
+def send_many(gcode_string_list):
+    """
+    Description: Streams a list of GCODE commands (no round trip wait between them)
+    Return/Output: list of Futures, in the same order
+    """
+    return [send(gcode_str) for gcode_str in gcode_string_list]
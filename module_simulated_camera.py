@@ -0,0 +1,419 @@
+"""
+Simulated Camera Module
+Stand-in for picamera.PiCamera when no Raspberry Pi camera is connected.
+Has the camera settings and capture/preview/recording functions the GUI uses,
+but makes synthetic frames in memory and sleeps for the time a real camera
+would take, so run_experiment2, create_z_stack and get_x_pictures can be
+run and profiled on any Linux computer.
+
+Timing (change these to match the camera being modelled):
+-STILL_CAPTURE_LATENCY: still port capture (full sensor readout + GPU encode)
+-BURST_CAPTURE_LATENCY: still port capture_sequence/capture_continuous with burst=True
+-Video port captures take one frame time (1 / framerate)
+-RESOLUTION_CHANGE_LATENCY: sensor mode change after setting camera.resolution
+
+Frames are a fixed test pattern per resolution with a changing frame counter
+stripe, so consecutive raw frames are not identical. If the camera is given a
+get_z function (module_backends passes the simulated printer's Z), the pattern
+is blurred the further Z is from FOCUS_Z, so autofocus can be tested.
+Encoded images (JPEG/PNG) are encoded once per resolution and reused, like the
+real camera's GPU encoder they cost (almost) no CPU time on the calling thread.
+
+Recordings write fake H.264 bytes at the bitrate (to a file, a stream, or a
+SimulatedCircularIO, the stand-in for picamera.PiCameraCircularIO).
+
+Usage:
+    import module_simulated_camera as SCAM
+    camera = SCAM.SimulatedCamera()
+    camera.resolution = (4056, 3040)
+    camera.capture("test.jpg")
+
+Normally created through module_backends.create_camera() with ROBOCAM_BACKEND=sim.
+"""
+
+import io
+import os
+import threading
+import time
+from fractions import Fraction
+
+import numpy as np
+
+# ==== SIMULATED CAMERA CONSTANTS ====
+# Time (in seconds) for a still port capture
+STILL_CAPTURE_LATENCY = 0.5
+
+# Time (in seconds) per still port capture in burst mode (no gain/white balance settling between shots)
+BURST_CAPTURE_LATENCY = 0.25
+
+# Time (in seconds) for the camera to switch sensor mode after a resolution change
+RESOLUTION_CHANGE_LATENCY = 0.3
+
+# Startup values, same as PiCamera's defaults
+DEFAULT_RESOLUTION = (1280, 720)
+DEFAULT_FRAMERATE = 30
+
+# Size (in pixels) of the squares in the test pattern
+PATTERN_SQUARE_SIZE = 64
+
+# Height (in pixels) of the frame counter stripe at the top of each raw frame
+COUNTER_STRIPE_HEIGHT = 16
+
+# Defocus: blur (Gaussian sigma, in pixels per 1000 pixels of width) per mm away from FOCUS_Z
+FOCUS_Z = 1.2
+DEFOCUS_BLUR_PER_MM = 20.0
+MAX_DEFOCUS_BLUR = 24.0
+
+# Max test patterns/encoded images kept (one per resolution and blur level)
+PATTERN_CACHE_SIZE = 8
+
+# Video recording: time (in seconds) between chunks of fake H264 data
+RECORDING_CHUNK_TIME = 0.1
+
+# Format names by file extension (same as picamera)
+EXTENSION_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".bmp": "bmp",
+                     ".gif": "gif", ".h264": "h264", ".mjpg": "mjpeg", ".mjpeg": "mjpeg"}
+ENCODED_FORMATS = {"jpeg": ".jpg", "png": ".png", "bmp": ".bmp"}
+RAW_FORMATS = ["bgr", "rgb", "bgra", "rgba"]
+
+
+def get_padded_resolution(resolution):
+    # Same padding as the real camera: width up to a multiple of 32, height up to a multiple of 16
+    width, height = resolution
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+
+def get_format(output, format):
+    """
+    Description: Works out the capture format like picamera does (explicit format, else file extension)
+    """
+    if format is not None:
+        return format.lower()
+    if isinstance(output, str):
+        extension = os.path.splitext(output)[1].lower()
+        if extension in EXTENSION_FORMATS:
+            return EXTENSION_FORMATS[extension]
+    raise ValueError(f"Unable to determine capture format for output: {output}")
+
+
+def make_test_pattern(resolution):
+    """
+    Description: Makes a padded BGR test pattern (squares + gradient), so images aren't blank
+    Return/Output: numpy array, shape (padded_height, padded_width, 3)
+    """
+    padded_width, padded_height = get_padded_resolution(resolution)
+    rows = np.arange(padded_height, dtype=np.uint16)[:, np.newaxis]
+    cols = np.arange(padded_width, dtype=np.uint16)[np.newaxis, :]
+    squares = ((rows // PATTERN_SQUARE_SIZE + cols // PATTERN_SQUARE_SIZE) % 2).astype(np.uint8) * 96
+    frame = np.empty((padded_height, padded_width, 3), dtype=np.uint8)
+    frame[:, :, 0] = squares + (cols * 128 // padded_width).astype(np.uint8)
+    frame[:, :, 1] = squares + (rows * 128 // padded_height).astype(np.uint8)
+    frame[:, :, 2] = squares + 64
+    return frame
+
+
+def write_output(output, data):
+    """
+    Description: Writes bytes to a file path, a file-like object, or a writable buffer (numpy array)
+    """
+    if isinstance(output, str):
+        with open(output, "wb") as f:
+            f.write(data)
+    elif hasattr(output, "write"):
+        output.write(data)
+        if hasattr(output, "flush"):
+            output.flush()
+    else:
+        buffer = memoryview(output).cast("B")
+        if buffer.nbytes < len(data):
+            raise ValueError(f"Output buffer too small: {buffer.nbytes} bytes, frame is {len(data)} bytes")
+        buffer[:len(data)] = data
+
+
+class SimulatedCircularIO:
+    """
+    Description: Stand-in for picamera.PiCameraCircularIO, keeps the last
+                 seconds * bitrate / 8 bytes written to it
+    """
+
+    def __init__(self, camera, seconds, bitrate=17000000):
+        self.camera = camera
+        self.bitrate = bitrate
+        self.size = int(seconds * bitrate / 8)
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.data += data
+            if len(self.data) > self.size:
+                del self.data[:len(self.data) - self.size]
+        return len(data)
+
+    def copy_to(self, output, size=None, seconds=None):
+        """
+        Description: Writes the buffered bytes (only the last size bytes or seconds if given) to output
+        """
+        with self.lock:
+            data = bytes(self.data)
+        if seconds is not None:
+            size = int(seconds * self.bitrate / 8)
+        if size is not None:
+            data = data[-size:]
+        write_output(output, data)
+
+    def clear(self):
+        with self.lock:
+            self.data = bytearray()
+
+
+class SimulatedPreview:
+    """
+    Description: Stand-in for PiPreviewRenderer (only keeps the options, nothing is drawn)
+    """
+
+    def __init__(self, alpha=255, fullscreen=True, window=None, layer=2, **options):
+        self.alpha = alpha
+        self.fullscreen = fullscreen
+        self.window = window
+        self.layer = layer
+
+
+class SimulatedCamera:
+    """
+    Description: Synthetic camera with the PiCamera functions/settings used by the GUI
+    Inputs:
+      - resolution, starting resolution
+      - still_capture_latency, seconds per still port capture
+      - resolution_change_latency, seconds per sensor mode change
+      - get_z, function returning the current Z (mm), frames are blurred away from focus_z
+    """
+
+    def __init__(self, resolution=DEFAULT_RESOLUTION, framerate=DEFAULT_FRAMERATE,
+                 still_capture_latency=STILL_CAPTURE_LATENCY,
+                 resolution_change_latency=RESOLUTION_CHANGE_LATENCY, get_z=None, focus_z=FOCUS_Z):
+        self.still_capture_latency = still_capture_latency
+        self.burst_capture_latency = min(BURST_CAPTURE_LATENCY, still_capture_latency)
+        self.resolution_change_latency = resolution_change_latency
+        # Function returning the current Z (mm) for the defocus blur, None = always in focus
+        self.get_z = get_z
+        self.focus_z = focus_z
+        self._resolution = tuple(resolution)
+        self.framerate = framerate
+        self.lock = threading.Lock()
+        self.frame_counter = 0
+        self.closed = False
+
+        # Settings read by the GUI and module_metadata_recorder
+        self.rotation = 0
+        self.iso = 0
+        self.exposure_mode = "auto"
+        self.awb_mode = "auto"
+        self.awb_gains = (Fraction(3, 2), Fraction(9, 5))
+        self.meter_mode = "average"
+        self.exposure_compensation = 0
+        self.exposure_speed = 33164
+        self.shutter_speed = 0
+        self.analog_gain = Fraction(1, 1)
+        self.digital_gain = Fraction(1, 1)
+        self.contrast = 0
+        self.brightness = 50
+        self.saturation = 0
+        self.sharpness = 0
+        self.hflip = False
+        self.vflip = False
+        self.led = True
+        self.preview = None
+
+        # Test pattern and encoded image caches, by resolution
+        self.pattern_cache = {}
+        self.encoded_cache = {}
+
+        # Video recording
+        self.recording_output = None
+        self.recording_file = None
+        self.recording_thread = None
+        self.recording_stop_event = threading.Event()
+
+        # Counters, used by benchmarks
+        self.num_captures = 0
+        self.num_resolution_changes = 0
+
+    # ---- Settings ----
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @resolution.setter
+    def resolution(self, value):
+        value = tuple(int(v) for v in value)
+        if self.recording_output is not None:
+            raise RuntimeError("Recording is currently running")
+        if value != self._resolution:
+            time.sleep(self.resolution_change_latency)
+            self.num_resolution_changes += 1
+        self._resolution = value
+
+    # ---- Frames ----
+    def get_blur(self, resolution):
+        # Defocus blur sigma (pixels) for the current Z, rounded so patterns can be cached
+        if self.get_z is None:
+            return 0.0
+        blur = abs(self.get_z() - self.focus_z) * DEFOCUS_BLUR_PER_MM * resolution[0] / 1000
+        return round(min(blur, MAX_DEFOCUS_BLUR * resolution[0] / 1000) * 4) / 4
+
+    def get_test_pattern(self, resolution, blur=0.0):
+        key = (resolution, blur)
+        if key not in self.pattern_cache:
+            if len(self.pattern_cache) >= PATTERN_CACHE_SIZE:
+                self.pattern_cache.clear()
+            pattern = make_test_pattern(resolution)
+            if blur > 0:
+                import cv2
+
+                pattern = cv2.GaussianBlur(pattern, (0, 0), blur)
+            self.pattern_cache[key] = pattern
+        return self.pattern_cache[key]
+
+    def make_frame(self, resolution, format="bgr"):
+        """
+        Description: New padded raw frame from the test pattern, with the frame counter stripe
+        Return/Output: bytes of the padded frame (picamera's raw layout)
+        """
+        frame = self.get_test_pattern(resolution, self.get_blur(resolution)).copy()
+        frame[:COUNTER_STRIPE_HEIGHT, :, :] = self.frame_counter % 256
+        if format in ("rgb", "rgba"):
+            frame = frame[:, :, ::-1]
+        if format in ("bgra", "rgba"):
+            alpha = np.full(frame.shape[:2] + (1,), 255, dtype=np.uint8)
+            frame = np.concatenate((frame, alpha), axis=2)
+        return np.ascontiguousarray(frame).tobytes()
+
+    def get_encoded(self, resolution, format):
+        """
+        Description: Encoded test pattern (JPEG/PNG/BMP), encoded once per resolution, format and blur
+        """
+        blur = self.get_blur(resolution)
+        key = (resolution, format, blur)
+        if key not in self.encoded_cache:
+            import cv2
+
+            if len(self.encoded_cache) >= PATTERN_CACHE_SIZE:
+                self.encoded_cache.clear()
+            width, height = resolution
+            frame = self.get_test_pattern(resolution, blur)[:height, :width]
+            is_encoded, buffer = cv2.imencode(ENCODED_FORMATS[format], frame)
+            if not is_encoded:
+                raise ValueError(f"Could not encode test pattern as {format}")
+            self.encoded_cache[key] = buffer.tobytes()
+        return self.encoded_cache[key]
+
+    def get_capture_latency(self, use_video_port, burst=False):
+        if use_video_port:
+            return 1.0 / float(self.framerate)
+        if burst:
+            return self.burst_capture_latency
+        return self.still_capture_latency
+
+    # ---- Capture ----
+    def capture(self, output, format=None, use_video_port=False, resize=None, splitter_port=0, **options):
+        """
+        Description: Same as PiCamera.capture. Output can be a file path, a file-like
+                     object (BytesIO) or a writable buffer (numpy array) for raw formats.
+        """
+        self.capture_frame(output, format, resize, self.get_capture_latency(use_video_port))
+
+    def capture_frame(self, output, format, resize, latency):
+        if self.closed:
+            raise RuntimeError("Camera is closed")
+        format = get_format(output, format)
+        resolution = tuple(resize) if resize is not None else self._resolution
+
+        with self.lock:
+            time.sleep(latency)
+            self.frame_counter += 1
+            self.num_captures += 1
+            if format in ENCODED_FORMATS:
+                data = self.get_encoded(resolution, format)
+            elif format in RAW_FORMATS:
+                data = self.make_frame(resolution, format)
+            else:
+                raise ValueError(f"Simulated camera can't capture format: {format}")
+        write_output(output, data)
+
+    def capture_sequence(self, outputs, format="jpeg", use_video_port=False, resize=None,
+                         splitter_port=0, burst=False, **options):
+        """
+        Description: Same as PiCamera.capture_sequence, one capture per output
+        """
+        latency = self.get_capture_latency(use_video_port, burst)
+        for output in outputs:
+            self.capture_frame(output, format, resize, latency)
+
+    def capture_continuous(self, output, format=None, use_video_port=False, resize=None,
+                           splitter_port=0, burst=False, **options):
+        """
+        Description: Same as PiCamera.capture_continuous. A file name output is
+                     formatted with {counter} and {timestamp} for every frame.
+        Return/Output: generator, yields the output of each frame
+        """
+        latency = self.get_capture_latency(use_video_port, burst)
+        counter = 1
+        while True:
+            frame_output = output
+            if isinstance(output, str):
+                frame_output = output.format(counter=counter, timestamp=time.time())
+            self.capture_frame(frame_output, format, resize, latency)
+            yield frame_output
+            counter += 1
+
+    # ---- Preview ----
+    def start_preview(self, **options):
+        self.preview = SimulatedPreview(**options)
+        return self.preview
+
+    def stop_preview(self):
+        self.preview = None
+
+    # ---- Video Recording ----
+    def start_recording(self, output, format=None, resize=None, splitter_port=1, bitrate=17000000, **options):
+        """
+        Description: Writes fake H264 data at the bitrate until stop_recording()
+        """
+        if self.recording_output is not None:
+            raise RuntimeError("Recording is currently running")
+        if isinstance(output, str):
+            output = io.open(output, "wb")
+            self.recording_file = output
+        self.recording_output = output
+        self.recording_stop_event.clear()
+        chunk = b"\x00\x00\x00\x01" + bytes(max(0, int(bitrate / 8 * RECORDING_CHUNK_TIME) - 4))
+        self.recording_thread = threading.Thread(target=self.run_recording, args=(output, chunk),
+                                                 name="Simulated Camera Recording", daemon=True)
+        self.recording_thread.start()
+
+    def run_recording(self, output, chunk):
+        while not self.recording_stop_event.wait(RECORDING_CHUNK_TIME):
+            output.write(chunk)
+
+    def wait_recording(self, timeout=0, splitter_port=1):
+        if self.recording_output is None:
+            raise RuntimeError("There is no recording in progress")
+        time.sleep(timeout)
+
+    def stop_recording(self, splitter_port=1):
+        if self.recording_output is None:
+            raise RuntimeError("There is no recording in progress")
+        self.recording_stop_event.set()
+        self.recording_thread.join()
+        if self.recording_file is not None:
+            self.recording_file.close()
+        self.recording_output = None
+        self.recording_file = None
+        self.recording_thread = None
+
+    def close(self):
+        if self.recording_output is not None:
+            self.stop_recording()
+        self.preview = None
+        self.closed = True
@@ -0,0 +1,419 @@
+"""
+Simulated 3D Printer Module
+Stand-in for printer_connection when no 3D Printer is plugged in.
+Has the same run_gcode/get_serial_data/get_serial_data2/initial_setup/
+get_path_list_csv functions and a serial-like "printer" object, but keeps the
+extruder location in memory and behaves like Marlin's motion planner, so
+sync/timing code and whole experiments can be run on any computer.
+
+Motion timing:
+-"TRAPEZOID": each move takes the trapezoidal profile time from
+              module_travel_planner (feedrate/acceleration limits, F overrides the feedrate)
+-"FIXED":     each move takes MOVE_LATENCY seconds
+Moves are queued and run one after another. Like Marlin, a move's "ok" is
+held back while the planner buffer (PLANNER_BUFFER_SIZE moves) is full.
+
+Supported GCODE:
+-G0/G1 X Y Z F (absolute or relative)
+-G4 P(ms)/S(sec) (dwell, planner waits)
+-G28 (home, goes to HOME_LOCATION)
+-G90/G91 (absolute/relative positioning)
+-M114 (get current location, interpolated while moving)
+-M400 (replies are held back until all moves are done)
+Anything else just gets an "ok".
+
+Usage:
+    import module_simulated_printer as SIM
+    SIM.MOTION_MODEL = SIM.MOTION_MODEL_FIXED
+    SIM.MOVE_LATENCY = 2.0
+    SIM.run_gcode("G0X10Y10Z5")
+
+In process serial port (what module_backends uses with ROBOCAM_BACKEND=sim):
+    SIM.printer.write(b"M114\\n")
+    SIM.printer.read(SIM.printer.in_waiting)
+
+Pseudo-terminal (for code that opens a serial port with pyserial):
+    port_name = SIM.start_pty_printer()
+    serial_port = serial.Serial(port_name, 115200, timeout=1)
+"""
+
+import csv
+import os
+import re
+import select
+import threading
+import time
+import tty
+
+# ==== SIMULATED PRINTER CONSTANTS ====
+MOTION_MODEL_TRAPEZOID = "TRAPEZOID"
+MOTION_MODEL_FIXED = "FIXED"
+MOTION_MODEL = MOTION_MODEL_TRAPEZOID
+
+# Time (in seconds) each move takes to finish with MOTION_MODEL_FIXED
+MOVE_LATENCY = 1.0
+
+# Time (in seconds) for a command to reach the printer and its reply to come back
+COMMAND_LATENCY = 0.002
+
+# Moves Marlin can hold in its planner (BLOCK_BUFFER_SIZE), "ok" waits while it is full
+PLANNER_BUFFER_SIZE = 16
+
+# Location after startup and after G28
+HOME_LOCATION = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+
+GCODE_AXIS_PATTERN = re.compile(r"([XYZ])\s*(-?\d+(?:\.\d*)?|-?\.\d+)", re.IGNORECASE)
+GCODE_PARAMETER_PATTERN = re.compile(r"([FPS])\s*(-?\d+(?:\.\d*)?|-?\.\d+)", re.IGNORECASE)
+
+# ==== SIMULATED PRINTER STATE ====
+_lock = threading.Lock()
+# Notified whenever a reply is added (wakes up SimulatedSerial.read)
+_reply_added = threading.Condition(_lock)
+_is_relative = False
+# Planned moves: list of (start_time, end_time, from_location, to_location), oldest first.
+# The last one is kept after it finishes, it has the current location.
+_moves = [(0.0, 0.0, dict(HOME_LOCATION), dict(HOME_LOCATION))]
+# Time the last reply is sent. Marlin runs commands in order, so a reply that
+# is held back (M400, G28, full planner) holds back every reply after it.
+_last_reply_time = 0.0
+# Pending replies: list of (ready_time, reply_type)
+_pending_replies = []
+
+
+def reset():
+    """
+    Description: Puts the simulated printer back to its startup state
+    """
+    global _is_relative, _moves, _last_reply_time, _pending_replies
+    with _lock:
+        _is_relative = False
+        _moves = [(0.0, 0.0, dict(HOME_LOCATION), dict(HOME_LOCATION))]
+        _last_reply_time = 0.0
+        _pending_replies = []
+
+
+def get_location_at(timestamp):
+    """
+    Description: Gets extruder location at a time.monotonic() timestamp
+    Return/Output: Location dictionary, example: {"X": 1.0, "Y": 2.0, "Z": 3.0}
+    """
+    for move_start, move_end, move_from, move_to in _moves:
+        if timestamp < move_start:
+            # Waiting for this move to start
+            return dict(move_from)
+        if timestamp < move_end:
+            fraction = (timestamp - move_start) / (move_end - move_start)
+            location = {}
+            for axis in move_to:
+                location[axis] = move_from[axis] + (move_to[axis] - move_from[axis]) * fraction
+            return location
+    return dict(_moves[-1][3])
+
+
+def get_current_location():
+    """
+    Description: Extruder location right now (used by the simulated camera for defocus blur)
+    """
+    with _lock:
+        return get_location_at(time.monotonic())
+
+
+def format_m114(location):
+    # Same format as Marlin's M114 reply
+    return "X:{:.2f} Y:{:.2f} Z:{:.2f} E:0.00 Count X:{} Y:{} Z:{}\nok\n".format(
+        location["X"], location["Y"], location["Z"],
+        int(location["X"] * 80), int(location["Y"] * 80), int(location["Z"] * 400))
+
+
+def get_move_time(start_location, end_location, feedrate=None):
+    """
+    Description: Time (in seconds) a move takes with the current MOTION_MODEL
+    Inputs: feedrate, GCODE F value (mm/min) or None for the default
+    """
+    if MOTION_MODEL == MOTION_MODEL_FIXED:
+        return MOVE_LATENCY
+
+    # Imported here, module_travel_planner imports modules that use this one
+    import module_travel_planner as TP
+
+    limits = TP.get_printer_limits()
+    if feedrate is not None and feedrate > 0:
+        limits["FEEDRATE_XY"] = min(limits["FEEDRATE_XY"], feedrate / 60)
+    return TP.get_hop_time(start_location, end_location, limits)
+
+
+def get_parameter(gcode_str, name):
+    for parameter, value in GCODE_PARAMETER_PATTERN.findall(gcode_str):
+        if parameter.upper() == name:
+            return float(value)
+    return None
+
+
+def add_move(now, end_location, duration):
+    """
+    Description: Adds a move to the planner
+    Return/Output: Time when its "ok" can be sent (when there is room in the planner)
+    """
+    # Finished moves are dropped (keep the last one, it has the current location)
+    while len(_moves) > 1 and _moves[0][1] <= now:
+        _moves.pop(0)
+
+    move_start = max(now, _moves[-1][1])
+    start_location = dict(_moves[-1][3])
+    _moves.append((move_start, move_start + duration, start_location, end_location))
+
+    # Planner full: "ok" once the oldest move that is still planned finishes
+    planned_moves = [move for move in _moves if move[1] > now]
+    if len(planned_moves) > PLANNER_BUFFER_SIZE:
+        return planned_moves[-PLANNER_BUFFER_SIZE - 1][1]
+    return now
+
+
+def start_move(gcode_str, now):
+    start_location = dict(_moves[-1][3])
+    end_location = dict(start_location)
+    for axis, value in GCODE_AXIS_PATTERN.findall(gcode_str):
+        axis = axis.upper()
+        if _is_relative:
+            end_location[axis] = start_location[axis] + float(value)
+        else:
+            end_location[axis] = float(value)
+
+    duration = get_move_time(start_location, end_location, get_parameter(gcode_str, "F"))
+    return add_move(now, end_location, duration)
+
+
+def start_dwell(gcode_str, now):
+    # G4 P is in milliseconds, G4 S in seconds
+    seconds = get_parameter(gcode_str, "S")
+    if seconds is None:
+        seconds = (get_parameter(gcode_str, "P") or 0) / 1000
+    return add_move(now, dict(_moves[-1][3]), seconds)
+
+
+def start_home(now):
+    start_location = dict(_moves[-1][3])
+    return add_move(now, dict(HOME_LOCATION), get_move_time(start_location, HOME_LOCATION))
+
+
+def run_gcode(gcode_str):
+    """
+    Description: Simulated version of printer_connection.run_gcode
+    Input: gcode_str, example: "G0X10Y10Z5"
+    """
+    global _is_relative, _last_reply_time
+
+    command = gcode_str.strip().upper()
+    now = time.monotonic() + COMMAND_LATENCY
+    with _lock:
+        ready_time = max(now, _last_reply_time)
+        reply_type = "ok"
+        if command.startswith("G90"):
+            _is_relative = False
+        elif command.startswith("G91"):
+            _is_relative = True
+        elif command.startswith("G0") or command.startswith("G1"):
+            ready_time = max(ready_time, start_move(command, now))
+        elif command.startswith("G4"):
+            ready_time = max(ready_time, start_dwell(command, now))
+        elif command.startswith("G28"):
+            # Marlin doesn't answer G28 until homing is done
+            start_home(now)
+            ready_time = max(ready_time, _moves[-1][1])
+        elif command.startswith("M400"):
+            ready_time = max(ready_time, _moves[-1][1])
+        elif command.startswith("M114"):
+            reply_type = "M114"
+        _last_reply_time = ready_time
+        _pending_replies.append((ready_time + COMMAND_LATENCY, reply_type))
+        _reply_added.notify_all()
+
+
+def collect_ready_replies(now):
+    # Call with _lock held
+    global _pending_replies
+
+    serial_string = ""
+    still_pending = []
+    for ready_time, reply_type in _pending_replies:
+        if ready_time > now:
+            still_pending.append((ready_time, reply_type))
+        elif reply_type == "M114":
+            serial_string += format_m114(get_location_at(ready_time))
+        else:
+            serial_string += "ok\n"
+    _pending_replies = still_pending
+    return serial_string
+
+
+def get_serial_data2():
+    """
+    Description: Simulated version of printer_connection.get_serial_data2
+    Return/Output: String with all replies that are ready, "" if none
+    """
+    with _lock:
+        return collect_ready_replies(time.monotonic())
+
+
+def get_serial_data():
+    return get_serial_data2()
+
+
+def wait_for_serial_data(timeout):
+    """
+    Description: Like get_serial_data2, but waits up to timeout seconds for a reply to be ready
+    """
+    deadline = time.monotonic() + timeout
+    with _lock:
+        while True:
+            now = time.monotonic()
+            serial_string = collect_ready_replies(now)
+            if len(serial_string) != 0 or now >= deadline:
+                return serial_string
+            wait_time = deadline - now
+            if len(_pending_replies) != 0:
+                wait_time = min(wait_time, min(reply[0] for reply in _pending_replies) - now)
+            _reply_added.wait(max(0.0, wait_time))
+
+
+class SimulatedSerial:
+    """
+    Description: In process stand-in for the pyserial Serial object (printer_connection's printer.printer).
+                 Written lines go to run_gcode, replies are read back like from a serial port.
+    Input: timeout, read timeout in seconds (None waits forever, like pyserial)
+    """
+
+    def __init__(self, timeout=1):
+        self.timeout = timeout
+        self.read_buffer = b""
+        self.write_buffer = b""
+        self.is_open = True
+        self.lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.read_buffer += get_serial_data2().encode("utf-8")
+            return len(self.read_buffer)
+
+    def write(self, data):
+        with self.lock:
+            self.write_buffer += data
+            while b"\n" in self.write_buffer:
+                line, self.write_buffer = self.write_buffer.split(b"\n", 1)
+                line = line.decode("utf-8", errors="replace").strip()
+                if len(line) != 0:
+                    run_gcode(line)
+        return len(data)
+
+    def read(self, size=1):
+        if len(self.read_buffer) == 0:
+            # Wait without holding the lock, so other threads can still write
+            timeout = self.timeout if self.timeout is not None else 3600
+            serial_string = wait_for_serial_data(timeout)
+            with self.lock:
+                self.read_buffer += serial_string.encode("utf-8")
+        with self.lock:
+            data = self.read_buffer[:size]
+            self.read_buffer = self.read_buffer[size:]
+            return data
+
+    def readline(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        line = b""
+        while not line.endswith(b"\n"):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            line += self.read(1)
+        return line
+
+    def reset_input_buffer(self):
+        with self.lock:
+            get_serial_data2()
+            self.read_buffer = b""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+# Same name as printer_connection's serial object
+printer = SimulatedSerial()
+
+
+def get_path_list_csv(csv_filename):
+    """
+    Description: Simulated version of printer_connection.get_path_list_csv
+    Return/Output: List of CSV rows, empty list if the file doesn't exist
+    """
+    if not os.path.isfile(csv_filename):
+        print(f"Simulated printer: {csv_filename} not found, using empty path list")
+        return []
+    with open(csv_filename, newline="") as f:
+        return [row for row in csv.reader(f)]
+
+
+def initial_setup(path_list):
+    """
+    Description: Simulated version of printer_connection.initial_setup (home, absolute positioning)
+    """
+    reset()
+    run_gcode("G28")
+    run_gcode("G90")
+    # Wait for homing, then throw away the replies (like a freshly opened serial port)
+    time.sleep(max(0.0, _last_reply_time - time.monotonic()) + 2 * COMMAND_LATENCY)
+    printer.reset_input_buffer()
+
+
+def serve_pty(master_fd):
+    # Reads GCODE lines from the pseudo-terminal, writes replies back once they are ready
+    buffer = b""
+    while True:
+        ready, _, _ = select.select([master_fd], [], [], 0.01)
+        if ready:
+            try:
+                data = os.read(master_fd, 1024)
+            except OSError:
+                # Other side was closed
+                break
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.decode("utf-8", errors="replace").strip()
+                if len(line) != 0:
+                    run_gcode(line)
+
+        serial_string = get_serial_data2()
+        if len(serial_string) != 0:
+            os.write(master_fd, serial_string.encode("utf-8"))
+
+
+# Keep pseudo-terminal file descriptors open while the simulated printer runs
+_pty_fds = []
+
+
+def start_pty_printer():
+    """
+    Description: Runs the simulated printer behind a pseudo-terminal (like a USB serial port)
+    Return/Output: Serial port name to open with pyserial, example: "/dev/pts/3"
+    """
+    master_fd, slave_fd = os.openpty()
+    # Raw mode: no echo, no line editing, bytes go through as they are
+    tty.setraw(slave_fd)
+    _pty_fds.append((master_fd, slave_fd))
+
+    pty_thread = threading.Thread(target=serve_pty, args=(master_fd,), name="Simulated Printer PTY", daemon=True)
+    pty_thread.start()
+    return os.ttyname(slave_fd)
+
+
+if __name__ == "__main__":
+    # Quick check: how long does a move look like it takes?
+    run_gcode("G90")
+    run_gcode("G0X10Y20Z5")
+    for i in range(3):
+        run_gcode("M114")
+        time.sleep(0.5)
+        print(get_serial_data2())
@@ -0,0 +1,259 @@
+"""
+Tiled Image Module
+Reads and writes full resolution pictures (12 MP: 4056x3040, about 36 MB as BGR)
+one tile at a time, so processing stages (resize for display, analysis, Z stack
+fusion) don't need the whole frame in memory on a 1-2 GB Raspberry Pi that is
+also running the GUI and the camera preview.
+
+-Pictures are stored as NumPy .npy files (uncompressed BGR) and memory mapped:
+ only the tiles that are read get loaded, and the OS can drop them again
+-.npy files can hold one picture, (height, width, 3) or (height, width) like a depth map,
+ or a stack of them, (slices, height, width, 3) like a Z stack
+-TiledImageWriter appends pictures to a .npy file with plain writes (nothing stays mapped)
+-process_tiles streams a function over the tiles of a picture (with a border, for filters)
+
+Plugs in after get_well_picture / the experiment's capture pipeline: with a tiled copy
+turned on, the pipeline worker writes the raw frame it already has in memory to a .npy
+next to the JPEG (module_capture_pipeline), so nothing is decoded again, and later stages
+(example: the GUI's picture display, load_thumbnail) only read tiles from that.
+convert_to_tiled does the same for a picture that's already saved (decodes it once).
+
+Usage:
+    tiled_image = TI.convert_to_tiled(file_full_path)      # well_12.jpg -> well_12.npy
+    thumbnail = tiled_image.get_thumbnail(MON_RES)         # Reads one band of rows at a time
+    thumbnail = TI.load_thumbnail(file_full_path, MON_RES) # From the .npy copy if there is one
+    for tile, data, core in tiled_image.iter_tiles(margin=16):
+        ...
+"""
+
+import os
+
+import numpy as np
+
+# ==== TILED IMAGE CONSTANTS ====
+TILED_IMAGE_EXTENSION = ".npy"
+
+# Default tile size (in pixels), a 512x512 BGR tile is 768 KB
+TILE_SIZE = 512
+
+# Rows read at a time when making thumbnails
+THUMBNAIL_BAND_ROWS = 256
+
+
+def get_tiled_path(image_full_path):
+    """
+    Return/Output: .npy path next to the picture, example: well_12.jpg -> well_12.npy
+    """
+    return os.path.splitext(image_full_path)[0] + TILED_IMAGE_EXTENSION
+
+
+def get_tile_list(width, height, tile_size=TILE_SIZE):
+    """
+    Return/Output: List of (x, y, width, height) tiles covering the picture
+    """
+    return [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+            for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+
+class TiledImageWriter:
+    """
+    Description: Writes pictures one after another into a .npy file (for stacks, write each slice in order)
+    Inputs: file_full_path, shape, example: (3040, 4056, 3) for one picture or (40, 3040, 4056, 3) for a stack
+    """
+
+    def __init__(self, file_full_path, shape, dtype=np.uint8):
+        self.file_full_path = file_full_path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.num_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.bytes_written = 0
+        self.file = open(file_full_path, "wb")
+        header = {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": self.shape}
+        np.lib.format.write_array_header_1_0(self.file, header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Don't hide the error with an "incomplete" one
+            self.file.close()
+            return False
+        self.close()
+        return False
+
+    def write(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if self.bytes_written + array.nbytes > self.num_bytes:
+            raise ValueError(f"Too much data for {self.file_full_path}, shape is {self.shape}")
+        self.file.write(array.data)
+        self.bytes_written += array.nbytes
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.bytes_written != self.num_bytes:
+            raise ValueError(f"{self.file_full_path} is incomplete: {self.bytes_written} of {self.num_bytes} bytes")
+
+
+class TiledImage:
+    """
+    Description: Memory mapped .npy picture (or stack of pictures), read/written by tile
+    Inputs:
+      - file_full_path, .npy file
+      - mode, "r" (read only) or "r+" (read/write)
+      - is_stack, True if the first axis is the slice (pass index to the tile functions)
+    """
+
+    def __init__(self, file_full_path, mode="r", is_stack=False):
+        self.file_full_path = file_full_path
+        self.array = np.load(file_full_path, mmap_mode=mode)
+        self.is_stack = is_stack
+        picture_shape = self.array.shape[1:] if is_stack else self.array.shape
+        if len(picture_shape) not in (2, 3):
+            raise ValueError(f"Not a picture (height, width[, channels]): {file_full_path} {self.array.shape}")
+        self.height, self.width = picture_shape[:2]
+        # Number of pictures in a stack, 0 for a single picture
+        self.num_slices = self.array.shape[0] if is_stack else 0
+
+    @classmethod
+    def create(cls, file_full_path, shape, dtype=np.uint8, is_stack=False):
+        """
+        Description: New .npy file (filled in with write_tile), opened read/write
+        """
+        array = np.lib.format.open_memmap(file_full_path, mode="w+", dtype=dtype, shape=tuple(shape))
+        del array
+        return cls(file_full_path, mode="r+", is_stack=is_stack)
+
+    def get_picture(self, index=None):
+        # Memory mapped picture, nothing is read until it's sliced
+        if self.is_stack:
+            if index is None:
+                raise ValueError(f"{self.file_full_path} is a stack, pass the slice index")
+            return self.array[index]
+        return self.array
+
+    def get_tile_list(self, tile_size=TILE_SIZE):
+        return get_tile_list(self.width, self.height, tile_size)
+
+    def read_tile(self, tile, margin=0, index=None):
+        """
+        Description: Copies one tile (plus a margin around it, cut off at the picture's edges) into memory
+        Inputs: tile, (x, y, width, height), index, slice of a stack (None for a single picture)
+        Return/Output: (data, core), core is the (rows, columns) slice of data that is the tile itself
+        """
+        x, y, tile_width, tile_height = tile
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(self.width, x + tile_width + margin), min(self.height, y + tile_height + margin)
+        data = np.array(self.get_picture(index)[y0:y1, x0:x1])
+        core = (slice(y - y0, y - y0 + tile_height), slice(x - x0, x - x0 + tile_width))
+        return data, core
+
+    def write_tile(self, tile, data, index=None):
+        x, y, tile_width, tile_height = tile
+        self.get_picture(index)[y:y + tile_height, x:x + tile_width] = data
+
+    def iter_tiles(self, tile_size=TILE_SIZE, margin=0, index=None):
+        """
+        Description: Yields (tile, data, core) for every tile, only one tile is in memory at a time
+        """
+        for tile in self.get_tile_list(tile_size):
+            data, core = self.read_tile(tile, margin, index)
+            yield tile, data, core
+
+    def get_thumbnail(self, resolution, index=None):
+        """
+        Description: Downsized copy (example: for display at MON_RES), made one band of rows at a time
+        Inputs: resolution, (width, height)
+        """
+        # OpenCV is only loaded when a thumbnail is made
+        import cv2
+
+        out_width, out_height = resolution
+        source = self.get_picture(index)
+        thumbnail = np.empty((out_height, out_width) + source.shape[2:], dtype=source.dtype)
+        out_band_rows = max(1, THUMBNAIL_BAND_ROWS * out_height // self.height)
+        for out_y0 in range(0, out_height, out_band_rows):
+            out_y1 = min(out_height, out_y0 + out_band_rows)
+            y0 = out_y0 * self.height // out_height
+            y1 = out_y1 * self.height // out_height
+            band = np.asarray(source[y0:y1])
+            thumbnail[out_y0:out_y1] = cv2.resize(band, (out_width, out_y1 - out_y0), interpolation=cv2.INTER_AREA)
+        return thumbnail
+
+    def flush(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+
+    def close(self):
+        self.flush()
+        # Drops the memory map (the file is closed once nothing else uses the array)
+        self.array = None
+
+
+def save_tiled(frame, file_full_path):
+    """
+    Description: Saves an in-memory frame (example: from capture_array) as a .npy picture
+    """
+    with TiledImageWriter(file_full_path, frame.shape, frame.dtype) as writer:
+        writer.write(frame)
+    return TiledImage(file_full_path)
+
+
+def convert_to_tiled(image_full_path, tiled_full_path=None):
+    """
+    Description: Decodes a picture (JPEG/PNG) once into a .npy next to it, so later stages read tiles
+    Return/Output: TiledImage
+    """
+    import cv2
+
+    if tiled_full_path is None:
+        tiled_full_path = get_tiled_path(image_full_path)
+    frame = cv2.imread(image_full_path, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError(f"Can't read picture: {image_full_path}")
+    return save_tiled(frame, tiled_full_path)
+
+
+def load_thumbnail(image_full_path, resolution):
+    """
+    Description: Downsized copy of a saved picture for display. Reads the tiled .npy copy
+                 (a band of rows at a time) if there is one, else decodes the picture.
+    Inputs: resolution, (width, height)
+    Return/Output: numpy array (height, width, 3)
+    """
+    tiled_full_path = get_tiled_path(image_full_path)
+    if os.path.isfile(tiled_full_path):
+        tiled_image = TiledImage(tiled_full_path)
+        try:
+            return tiled_image.get_thumbnail(resolution)
+        finally:
+            tiled_image.close()
+
+    import cv2
+
+    frame = cv2.imread(image_full_path, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError(f"Can't read picture: {image_full_path}")
+    return cv2.resize(frame, tuple(resolution), interpolation=cv2.INTER_AREA)
+
+
+def process_tiles(source, function, destination=None, tile_size=TILE_SIZE, margin=0, index=None):
+    """
+    Description: Runs function on every tile of source (with margin pixels around it for filters),
+                 and writes the results into destination (a TiledImage the same size) if given
+    Inputs: function, takes a tile (numpy array), returns an array the same height/width
+    Return/Output: List of function results if destination is None, else destination
+    """
+    result_list = []
+    for tile, data, core in source.iter_tiles(tile_size, margin, index):
+        result = function(data)
+        if destination is None:
+            result_list.append((tile, result))
+        else:
+            destination.write_tile(tile, result[core])
+    if destination is None:
+        return result_list
+    destination.flush()
+    return destination
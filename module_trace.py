@@ -0,0 +1,182 @@
+"""
+Trace Module
+Lightweight timing spans for the hot paths (GCODE, motion settle, capture,
+encode/write, camera metadata), so we can see where each well's seconds go
+instead of reading "Saved Image:" / "Going to Well Number:" prints.
+
+-Spans are context managers with time.monotonic_ns() start/end timestamps
+-Finished spans go into a ring buffer (oldest are dropped), safe to use from any thread
+-Export as Chrome trace JSON: open in chrome://tracing or https://ui.perfetto.dev
+-When tracing is off, span() returns one shared do-nothing object, so it can stay in production code
+
+Turn on with the ROBOCAM_TRACE=1 environment variable, or TR.enable().
+
+Usage:
+    import module_trace as TR
+    with TR.span("capture", well=12):
+        camera.capture(file_full_path)
+    TR.export_chrome_trace("trace.json")
+    TR.print_stage_report()
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+# ==== TRACE CONSTANTS ====
+TRACE_ENV_VAR = "ROBOCAM_TRACE"
+
+# Max spans kept (about 100 bytes each), oldest are dropped first
+RING_BUFFER_SIZE = 200000
+
+# Chrome trace category for spans that don't give one
+DEFAULT_CATEGORY = "robocam"
+
+# ==== TRACE STATE ====
+_is_enabled = os.environ.get(TRACE_ENV_VAR, "0").strip().lower() in ("1", "true", "yes", "on")
+# Finished spans: (name, category, start_ns, end_ns, thread_id, args)
+_spans = collections.deque(maxlen=RING_BUFFER_SIZE)
+# Thread id -> thread name, for the Chrome trace thread labels
+_thread_names = {}
+
+
+class NullSpan:
+    """
+    Description: Span used while tracing is off, does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = NullSpan()
+
+
+class Span:
+    """
+    Description: Times a block of code and adds it to the ring buffer when the block ends
+    """
+    __slots__ = ("name", "category", "args", "start_ns")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_span(self.name, self.start_ns, time.monotonic_ns(), self.category, self.args)
+        return False
+
+
+def span(name, category=DEFAULT_CATEGORY, **args):
+    """
+    Description: Context manager that records how long its block takes
+    Inputs: name (example: "capture"), category, args (extra values shown in the trace, example: well=12)
+    """
+    if not _is_enabled:
+        return _NULL_SPAN
+    return Span(name, category, args)
+
+
+def add_span(name, start_ns, end_ns, category=DEFAULT_CATEGORY, args=None):
+    """
+    Description: Adds an already timed span (time.monotonic_ns() timestamps)
+    """
+    if not _is_enabled:
+        return
+    thread = threading.current_thread()
+    if thread.ident not in _thread_names:
+        _thread_names[thread.ident] = thread.name
+    # deque.append is thread safe, no lock needed
+    _spans.append((name, category, start_ns, end_ns, thread.ident, args))
+
+
+def enable(ring_buffer_size=None):
+    """
+    Description: Turns tracing on. A new ring_buffer_size clears the spans recorded so far.
+    """
+    global _is_enabled, _spans
+    if ring_buffer_size is not None and ring_buffer_size != _spans.maxlen:
+        _spans = collections.deque(maxlen=ring_buffer_size)
+    _is_enabled = True
+
+
+def disable():
+    global _is_enabled
+    _is_enabled = False
+
+
+def is_enabled():
+    return _is_enabled
+
+
+def clear():
+    _spans.clear()
+
+
+def get_spans():
+    """
+    Return/Output: list of (name, category, start_ns, end_ns, thread_id, args), oldest first
+    """
+    return list(_spans)
+
+
+def get_stage_totals(span_list=None):
+    """
+    Description: Total time and count per span name
+    Return/Output: Dictionary, example: {"capture": {"count": 96, "total": 48.2, "mean": 0.502}} (seconds)
+    """
+    if span_list is None:
+        span_list = get_spans()
+    totals = {}
+    for name, category, start_ns, end_ns, thread_id, args in span_list:
+        stage = totals.setdefault(name, {"count": 0, "total": 0.0, "mean": 0.0})
+        stage["count"] += 1
+        stage["total"] += (end_ns - start_ns) / 1e9
+    for stage in totals.values():
+        stage["mean"] = stage["total"] / stage["count"]
+    return totals
+
+
+def print_stage_report(span_list=None):
+    totals = get_stage_totals(span_list)
+    print("=========================")
+    print("Trace Stage Report")
+    for name, stage in sorted(totals.items(), key=lambda item: -item[1]["total"]):
+        print(f"{name}: {stage['count']} spans, total {stage['total']:.2f} sec, mean {stage['mean'] * 1000:.1f} ms")
+    print("=========================")
+
+
+def export_chrome_trace(file_full_path, span_list=None):
+    """
+    Description: Saves spans in the Chrome trace event format ("X" complete events, microseconds)
+    """
+    if span_list is None:
+        span_list = get_spans()
+    pid = os.getpid()
+    trace_events = []
+    for thread_id, thread_name in list(_thread_names.items()):
+        trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                             "args": {"name": thread_name}})
+    for name, category, start_ns, end_ns, thread_id, args in span_list:
+        event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": thread_id,
+                 "ts": start_ns / 1000, "dur": (end_ns - start_ns) / 1000}
+        if args:
+            event["args"] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                             for key, value in args.items()}
+        trace_events.append(event)
+
+    with open(file_full_path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    print(f"Saved trace: {file_full_path} ({len(span_list)} spans)")
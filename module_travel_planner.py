@@ -0,0 +1,211 @@
+"""
+Travel Planner Module
+Predicts how long the 3D Printer takes to move between wells, using a
+trapezoidal velocity profile (accelerate, cruise, decelerate) with the
+printer's feedrate and acceleration limits.
+
+Used by run_experiment2 to:
+-Know when the extruder should arrive at each well (so syncing can start right before it)
+-Predict the cycle time of one run (one pass through all wells)
+-Compare predicted vs actual cycle time, and how many runs fit in the experiment time
+
+Printer limits are read from the settings module if they exist, else the defaults below are used.
+"""
+
+import math
+import time
+
+import settings as C
+import module_motion_sync as MS
+import module_run_scheduler as RS
+
+# ==== DEFAULT PRINTER LIMITS ====
+# Feedrate in mm/s, acceleration in mm/s^2
+# (Override in settings.py with the same names)
+DEFAULT_FEEDRATE_XY = 50.0
+DEFAULT_FEEDRATE_Z = 5.0
+DEFAULT_ACCELERATION_XY = 500.0
+DEFAULT_ACCELERATION_Z = 100.0
+
+# Time (in seconds) spent at each well that isn't travel (settle + capture + saving)
+# Updated with the measured value after every run.
+DEFAULT_WELL_OVERHEAD_TIME = 1.0
+
+
+def get_printer_limits():
+    """
+    Description: Gets feedrate and acceleration limits from settings, or defaults
+    Return/Output: Dictionary with FEEDRATE_XY, FEEDRATE_Z, ACCELERATION_XY, ACCELERATION_Z
+    """
+    limits = {
+        "FEEDRATE_XY": getattr(C, "FEEDRATE_XY", DEFAULT_FEEDRATE_XY),
+        "FEEDRATE_Z": getattr(C, "FEEDRATE_Z", DEFAULT_FEEDRATE_Z),
+        "ACCELERATION_XY": getattr(C, "ACCELERATION_XY", DEFAULT_ACCELERATION_XY),
+        "ACCELERATION_Z": getattr(C, "ACCELERATION_Z", DEFAULT_ACCELERATION_Z),
+    }
+    return limits
+
+
+def get_trapezoid_time(distance, max_speed, acceleration):
+    """
+    Description: Time to travel distance starting and ending at rest
+    Inputs: distance (mm), max_speed (mm/s), acceleration (mm/s^2)
+    Return/Output: Time in seconds
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+
+    # Distance needed to reach max speed (and the same to stop again)
+    accel_distance = max_speed * max_speed / (2 * acceleration)
+
+    if 2 * accel_distance >= distance:
+        # Triangle profile, never reaches max speed
+        return 2 * math.sqrt(distance / acceleration)
+
+    cruise_distance = distance - 2 * accel_distance
+    return 2 * max_speed / acceleration + cruise_distance / max_speed
+
+
+def get_hop_time(from_location, to_location, limits=None):
+    """
+    Description: Predicted time to move between 2 locations.
+                 XY moves together, Z has its own (slower) limits, the slowest one wins.
+    Inputs: from_location/to_location, dictionaries like {"X": 1.0, "Y": 2.0, "Z": 3.0}
+    Return/Output: Time in seconds
+    """
+    if limits is None:
+        limits = get_printer_limits()
+
+    dx = to_location.get("X", from_location.get("X", 0.0)) - from_location.get("X", 0.0)
+    dy = to_location.get("Y", from_location.get("Y", 0.0)) - from_location.get("Y", 0.0)
+    dz = to_location.get("Z", from_location.get("Z", 0.0)) - from_location.get("Z", 0.0)
+
+    xy_time = get_trapezoid_time(math.hypot(dx, dy), limits["FEEDRATE_XY"], limits["ACCELERATION_XY"])
+    z_time = get_trapezoid_time(dz, limits["FEEDRATE_Z"], limits["ACCELERATION_Z"])
+    return max(xy_time, z_time)
+
+
+def get_location_list(gcode_string_list):
+    """
+    Description: Converts GCODE strings (from prepare_experiment.convert_list_to_gcode_strings)
+                 into location dictionaries, missing axes keep the previous value.
+    """
+    location_list = []
+    previous = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+    for gcode_str in gcode_string_list:
+        location = dict(previous)
+        location.update(MS.get_target_location(gcode_str))
+        location_list.append(location)
+        previous = location
+    return location_list
+
+
+def get_arrival_times(gcode_string_list, start_location=None, limits=None):
+    """
+    Description: Predicted travel time for each hop in the well list
+    Inputs:
+      - gcode_string_list, GCODE move list for one run
+      - start_location, where the extruder is before the run. Default is the
+        last well, since runs go back to the first well after the last.
+    Return/Output: List of hop times (in seconds), one per well
+    """
+    if limits is None:
+        limits = get_printer_limits()
+
+    location_list = get_location_list(gcode_string_list)
+    if len(location_list) == 0:
+        return []
+
+    if start_location is None:
+        start_location = location_list[-1]
+
+    hop_times = []
+    previous = start_location
+    for location in location_list:
+        hop_times.append(get_hop_time(previous, location, limits))
+        previous = location
+    return hop_times
+
+
+def get_runs_that_fit(total_seconds, run_seconds, cycle_seconds, overrun_policy=RS.OVERRUN_POLICY):
+    """
+    Description: Number of runs run_experiment2 will do, by running its scheduler
+                 (module_run_scheduler: runs start every run_seconds, overrun policy
+                 if a run takes longer) on a simulated clock
+    Return/Output: Number of runs (integer)
+    """
+    if cycle_seconds <= 0:
+        return 0
+    now = [0.0]
+    scheduler = RS.RunScheduler(total_seconds, run_seconds, overrun_policy, start_time=0.0, clock=lambda: now[0],
+                                is_verbose=False)
+    while True:
+        scheduled_time = scheduler.plan_next_run()
+        if scheduled_time is None:
+            return len(scheduler.record_list)
+        now[0] = max(now[0], scheduled_time)
+        scheduler.start_run(len(scheduler.record_list))
+        now[0] += cycle_seconds
+
+
+class CycleTimeReport:
+    """
+    Description: Keeps predicted vs actual cycle times for each run
+    Usage:
+        report = CycleTimeReport(gcode_string_list)
+        report.start_run()
+        ... go through wells ...
+        report.end_run()
+    """
+
+    def __init__(self, gcode_string_list, well_overhead_time=DEFAULT_WELL_OVERHEAD_TIME, limits=None):
+        self.limits = limits
+        self.hop_times = get_arrival_times(gcode_string_list, limits=limits)
+        self.well_overhead_time = well_overhead_time
+        self.run_start = None
+        self.last_location = None
+        self.actual_cycle_times = []
+
+    def get_predicted_travel_time(self):
+        return sum(self.hop_times)
+
+    def get_predicted_cycle_time(self):
+        return self.get_predicted_travel_time() + self.well_overhead_time * len(self.hop_times)
+
+    def start_run(self, gcode_string_list=None):
+        """
+        Description: Starts timing a run. If the well order changed (optimized or
+                     alternating direction), pass the run's GCODE list to re-plan hops
+                     starting from where the last run ended.
+        """
+        if gcode_string_list is not None and len(gcode_string_list) != 0:
+            self.hop_times = get_arrival_times(gcode_string_list, start_location=self.last_location, limits=self.limits)
+            self.last_location = get_location_list(gcode_string_list)[-1]
+        self.run_start = time.monotonic()
+
+    def end_run(self):
+        """
+        Description: Saves actual cycle time, updates well overhead time with what was measured,
+                     prints predicted vs actual
+        Return/Output: Actual cycle time (in seconds)
+        """
+        predicted = self.get_predicted_cycle_time()
+        actual = time.monotonic() - self.run_start
+        self.actual_cycle_times.append(actual)
+
+        # Learn the per-well overhead from the run so later predictions get better
+        if len(self.hop_times) != 0:
+            measured_overhead = (actual - self.get_predicted_travel_time()) / len(self.hop_times)
+            self.well_overhead_time = max(0.0, measured_overhead)
+
+        print(f"Cycle time: predicted {predicted:.1f} sec, actual {actual:.1f} sec ({actual - predicted:+.1f} sec)")
+        return actual
+
+    def print_budget(self, total_seconds, run_seconds, overrun_policy=RS.OVERRUN_POLICY):
+        cycle_seconds = self.get_predicted_cycle_time()
+        if len(self.actual_cycle_times) != 0:
+            cycle_seconds = self.actual_cycle_times[-1]
+        runs = get_runs_that_fit(total_seconds, run_seconds, cycle_seconds, overrun_policy)
+        print(f"Predicted cycle time: {cycle_seconds:.1f} sec, about {runs} run(s) fit in {total_seconds:.0f} sec")
+        return runs
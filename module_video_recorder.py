@@ -0,0 +1,237 @@
+"""
+Video Recorder Module
+Per-well video for experiments: records H.264 with the camera's GPU encoder
+straight into the experiment folder, then muxes it into an .mp4 in a
+background process, so the extruder can go to the next well right away.
+
+-record_video: one clip (VIDEO_DURATION_SECONDS at VIDEO_BITRATE) into an .h264 file
+-VideoMuxer: worker thread that runs MP4Box (gpac) or ffmpeg as a separate process
+ for each clip (-c copy, no re-encoding). Without either tool the .h264 is kept.
+-EventClipRecorder: records into an in-memory ring buffer (picamera.PiCameraCircularIO),
+ save_clip() writes the last few seconds when something happens (event-triggered clips)
+
+Usage:
+    muxer = VR.VideoMuxer()
+    h264_full_path = VR.record_video(camera, VR.get_video_path(file_full_path))
+    muxer.submit(h264_full_path, camera.framerate, on_saved=print)    # on_saved gets the .mp4 path
+    muxer.close()    # Waits for the last .mp4
+
+    clip_recorder = VR.EventClipRecorder(camera, muxer=muxer)
+    clip_recorder.start()
+    clip_recorder.save_clip(file_full_path)    # Last CLIP_SECONDS seconds
+    clip_recorder.stop()
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import module_backends as BK
+import module_trace as TR
+
+# ==== VIDEO RECORDER CONSTANTS ====
+VIDEO_FORMAT = "h264"
+VIDEO_EXTENSION = ".h264"
+MP4_EXTENSION = ".mp4"
+
+# Default clip length (in seconds) and bitrate (bits per second, picamera's max is 25 Mbps)
+VIDEO_DURATION_SECONDS = 5
+VIDEO_BITRATE = 10000000
+
+# Event-triggered clips: seconds kept in the ring buffer
+CLIP_SECONDS = 10
+
+# Mux tools, tried in this order
+MUX_TOOL_MP4BOX = "MP4Box"
+MUX_TOOL_FFMPEG = "ffmpeg"
+MUX_TOOL_LIST = [MUX_TOOL_MP4BOX, MUX_TOOL_FFMPEG]
+
+# Delete the .h264 once its .mp4 is saved
+DELETE_H264_AFTER_MUX = True
+
+# Max time (in seconds) one mux may take
+MUX_TIMEOUT = 120
+
+
+def get_video_path(file_full_path):
+    """
+    Return/Output: .h264 path for a well file path, example: well_12.jpg -> well_12.h264
+    """
+    return os.path.splitext(file_full_path)[0] + VIDEO_EXTENSION
+
+
+def get_mux_tool():
+    """
+    Return/Output: First mux tool found on the PATH ("MP4Box" or "ffmpeg"), None if neither is installed
+    """
+    for mux_tool in MUX_TOOL_LIST:
+        if shutil.which(mux_tool) is not None:
+            return mux_tool
+    return None
+
+
+def get_mux_command(mux_tool, h264_full_path, mp4_full_path, framerate):
+    # Raw H.264 has no timestamps, so the framerate has to be given
+    fps = float(framerate)
+    if mux_tool == MUX_TOOL_MP4BOX:
+        return [mux_tool, "-quiet", "-fps", f"{fps:g}", "-add", h264_full_path, "-new", mp4_full_path]
+    if mux_tool == MUX_TOOL_FFMPEG:
+        return [mux_tool, "-y", "-loglevel", "error", "-framerate", f"{fps:g}", "-i", h264_full_path,
+                "-c", "copy", mp4_full_path]
+    raise ValueError(f"Unknown mux tool: {mux_tool}, choose from {MUX_TOOL_LIST}")
+
+
+def record_video(camera, h264_full_path, duration_seconds=VIDEO_DURATION_SECONDS, bitrate=VIDEO_BITRATE):
+    """
+    Description: Records one H.264 clip (GPU encoder) at the camera's current resolution
+    Return/Output: h264_full_path
+    """
+    with TR.span("record_video", seconds=duration_seconds):
+        camera.start_recording(h264_full_path, format=VIDEO_FORMAT, bitrate=bitrate)
+        try:
+            camera.wait_recording(duration_seconds)
+        finally:
+            camera.stop_recording()
+    print(f"Recorded Video: {h264_full_path}")
+    return h264_full_path
+
+
+class VideoMuxer:
+    """
+    Description: Worker thread that muxes .h264 clips into .mp4 files, one mux process at a time
+    Inputs: mux_tool, "MP4Box" or "ffmpeg" (default: whichever is installed), delete_h264
+    """
+
+    def __init__(self, mux_tool=None, delete_h264=DELETE_H264_AFTER_MUX, name="Video Muxer"):
+        self.name = name
+        self.mux_tool = get_mux_tool() if mux_tool is None else mux_tool
+        self.delete_h264 = delete_h264
+        self.job_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.num_muxed = 0
+        self.num_failed = 0
+        self.mux_times = []
+        self.is_closed = False
+        if self.mux_tool is None:
+            print(f"{self.name}: MP4Box/ffmpeg not found, videos are kept as .h264 "
+                  f"(install with: sudo apt install gpac)")
+        self.worker = threading.Thread(target=self.run_worker, name=name, daemon=True)
+        self.worker.start()
+
+    def submit(self, h264_full_path, framerate, on_saved=None):
+        """
+        Description: Queues a clip to be muxed, returns right away.
+                     on_saved is called with the path of the video that is kept: the .mp4 once
+                     it is muxed, or the .h264 if there is no mux tool or muxing failed.
+        """
+        if self.is_closed:
+            raise RuntimeError(f"{self.name} is closed")
+        if self.mux_tool is None:
+            if on_saved is not None:
+                on_saved(h264_full_path)
+            return
+        self.job_queue.put((h264_full_path, framerate, on_saved))
+
+    def mux(self, h264_full_path, framerate):
+        mp4_full_path = os.path.splitext(h264_full_path)[0] + MP4_EXTENSION
+        command = get_mux_command(self.mux_tool, h264_full_path, mp4_full_path, framerate)
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=MUX_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode(errors="replace").strip())
+        if self.delete_h264:
+            os.remove(h264_full_path)
+        return mp4_full_path
+
+    def run_worker(self):
+        while True:
+            item = self.job_queue.get()
+            if item is None:
+                self.job_queue.task_done()
+                break
+
+            h264_full_path, framerate, on_saved = item
+            mux_start = time.monotonic()
+            saved_full_path = h264_full_path
+            try:
+                with TR.span("mux_video"):
+                    saved_full_path = self.mux(h264_full_path, framerate)
+                with self.lock:
+                    self.num_muxed += 1
+                    self.mux_times.append(time.monotonic() - mux_start)
+                print(f"Saved Video: {saved_full_path}")
+            except Exception as e:
+                with self.lock:
+                    self.num_failed += 1
+                print(f"{self.name}: could not mux {h264_full_path}: {e}")
+            finally:
+                # The .h264 is kept when muxing fails
+                if on_saved is not None:
+                    try:
+                        on_saved(saved_full_path)
+                    except Exception as e:
+                        print(f"{self.name}: on_saved failed for {saved_full_path}: {e}")
+                self.job_queue.task_done()
+
+    def flush(self):
+        """
+        Description: Waits until every queued clip is muxed
+        """
+        self.job_queue.join()
+
+    def close(self):
+        if self.is_closed:
+            return
+        pending = self.job_queue.qsize()
+        if pending != 0:
+            print(f"{self.name}: muxing {pending} remaining video(s)...")
+        self.flush()
+        self.is_closed = True
+        self.job_queue.put(None)
+        self.worker.join()
+        mean_mux_time = sum(self.mux_times) / len(self.mux_times) if self.mux_times else 0.0
+        print(f"{self.name}: muxed {self.num_muxed}, failed {self.num_failed}, mean mux {mean_mux_time:.2f} sec")
+
+
+class EventClipRecorder:
+    """
+    Description: Keeps the last clip_seconds of H.264 in memory (PiCameraCircularIO),
+                 save_clip() writes them to a file when an event happens
+    Inputs: muxer, VideoMuxer for the saved clips (None keeps them as .h264)
+    """
+
+    def __init__(self, camera, clip_seconds=CLIP_SECONDS, bitrate=VIDEO_BITRATE, muxer=None):
+        self.camera = camera
+        self.clip_seconds = clip_seconds
+        self.bitrate = bitrate
+        self.muxer = muxer
+        self.stream = None
+
+    def start(self):
+        if self.stream is not None:
+            return
+        self.stream = BK.create_circular_io(self.camera, self.clip_seconds, self.bitrate)
+        self.camera.start_recording(self.stream, format=VIDEO_FORMAT, bitrate=self.bitrate)
+
+    def save_clip(self, file_full_path, seconds=None):
+        """
+        Description: Writes the buffered video (last seconds, default: all of it) while recording keeps going
+        Return/Output: .h264 path
+        """
+        if self.stream is None:
+            raise RuntimeError("Event clip recorder is not started")
+        h264_full_path = get_video_path(file_full_path)
+        with TR.span("save_clip"):
+            self.stream.copy_to(h264_full_path, seconds=seconds)
+        print(f"Saved Clip: {h264_full_path}")
+        if self.muxer is not None:
+            self.muxer.submit(h264_full_path, self.camera.framerate)
+        return h264_full_path
+
+    def stop(self):
+        if self.stream is None:
+            return
+        self.camera.stop_recording()
+        self.stream = None
@@ -0,0 +1,240 @@
+"""
+Window Helper Module
+Xlib helpers for the Camera Preview pseudo window.
+
+WindowManagerHelper:
+Keeps one X display connection open for the whole GUI session (instead of a
+new Display() in every function), remembers window objects it has already
+looked up, and gets a window's screen location with a single
+translate_coords request instead of climbing every parent window.
+
+PreviewWindowWatcher:
+Instead of asking the X server where the pseudo window is on every GUI loop,
+listen for ConfigureNotify events, which the X server sends only when the
+window moves or is resized.
+
+Usage:
+    window_helper = WH.get_window_helper()
+    preview_win_id = window_helper.find_window_at(x_start, y_start)
+    window_helper.move_window(preview_win_id, 0, 36)
+
+    watcher = WH.PreviewWindowWatcher(preview_win_id)
+    # In GUI loop:
+    moved_location = watcher.get_moved_location()
+    if moved_location is not None:
+        x, y = moved_location
+
+Testing without a monitor (Xvfb stand-in):
+    Xvfb :99 -screen 0 1920x1080x24 &
+    Set WINDOW_HELPER_DISPLAY = ":99" (or DISPLAY=:99) before calling get_window_helper()
+"""
+
+import bisect
+import random
+
+from Xlib import X
+from Xlib.display import Display
+
+# X display to connect to, None uses the DISPLAY environment variable
+WINDOW_HELPER_DISPLAY = None
+
+# Default Screen Index, 0 here.
+# Assumes one monitor is connected to Raspberry Pi
+DEFAULT_SCREEN_INDEX = 0
+
+# Random picks to try before falling back to picking from the gaps between excluded values
+MAX_RANDOM_PICK_TRIES = 32
+
+# Start coordinate used if every x (or y) on the screen is already a window's location
+DEFAULT_START_COORDINATE = 0
+
+# Shared WindowManagerHelper (see get_window_helper)
+_window_helper = None
+
+
+def pick_free_coordinate(max_value, exclude_list, rng=random):
+    """
+    Description: Picks a random integer in range(0, max_value) that is not in exclude_list,
+                 without building a list of every possible value.
+                 -Rejection sampling: a few windows only block a few values, so a random pick almost always works
+                 -Sorted gaps: if that keeps failing, pick the n-th free value by skipping over the sorted excluded values
+    Inputs: max_value (example: screen width), exclude_list (values already used)
+    Return/Output: integer, or None if every value is excluded
+    """
+    exclude_set = set(exclude_list)
+
+    for i in range(MAX_RANDOM_PICK_TRIES):
+        value = rng.randrange(max_value)
+        if value not in exclude_set:
+            return value
+
+    excluded_sorted = sorted(value for value in exclude_set if 0 <= value < max_value)
+    num_free = max_value - len(excluded_sorted)
+    if num_free <= 0:
+        return None
+
+    # n-th free value: start at n, then move past every excluded value at or below it
+    value = rng.randrange(num_free)
+    num_skipped = 0
+    while True:
+        new_num_skipped = bisect.bisect_right(excluded_sorted, value + num_skipped)
+        if new_num_skipped == num_skipped:
+            return value + num_skipped
+        num_skipped = new_num_skipped
+
+
+class WindowManagerHelper:
+    """
+    Description: One X display connection + window lookups for the GUI
+    Input: display_name, X display to connect to (None uses $DISPLAY)
+    """
+
+    def __init__(self, display_name=None):
+        self.display = Display(display_name)
+        self.screen = self.display.screen(DEFAULT_SCREEN_INDEX)
+        self.root = self.screen.root
+        # Screen size comes with the connection setup, it doesn't change while the GUI runs
+        self.screen_resolution = (self.screen.width_in_pixels, self.screen.height_in_pixels)
+        # Window id -> Xlib window object
+        self.window_cache = {}
+        # Window found with find_window_at (the preview pseudo window)
+        self.preview_window_id = 0
+
+    def get_screen_resolution(self):
+        """
+        Return/Output: max_screen_width, max_screen_height in pixels
+        """
+        return self.screen_resolution
+
+    def get_window(self, window_id):
+        # Window objects are only created once per id
+        if window_id not in self.window_cache:
+            self.window_cache[window_id] = self.display.create_resource_object("window", window_id)
+        return self.window_cache[window_id]
+
+    def get_top_level_windows(self):
+        children = self.root.query_tree().children
+        for win in children:
+            self.window_cache[win.id] = win
+        return children
+
+    def get_window_location(self, win):
+        """
+        Description: Location of a window's top-left corner relative to the top-left of the screen.
+                     One translate_coords request (the X server does the parent climbing).
+        Return/Output: x, y in pixels
+        """
+        reply = self.root.translate_coords(win, 0, 0)
+        return reply.x, reply.y
+
+    def get_xy_loc_of_all_windows(self):
+        loc_x_list = []
+        loc_y_list = []
+        for win in self.get_top_level_windows():
+            x, y = self.get_window_location(win)
+            loc_x_list.append(x)
+            loc_y_list.append(y)
+        return loc_x_list, loc_y_list
+
+    def get_unique_xy_loc(self):
+        """
+        Description: Random top-left location that no other window uses, so the
+                     preview pseudo window can be found by its location later.
+                     If every x (or y) is taken, DEFAULT_START_COORDINATE is used for it
+                     (the other coordinate still keeps the location unique)
+        Return/Output: x_start, y_start
+        """
+        loc_x_list, loc_y_list = self.get_xy_loc_of_all_windows()
+        max_screen_width, max_screen_height = self.get_screen_resolution()
+        x_start = pick_free_coordinate(max_screen_width, loc_x_list)
+        y_start = pick_free_coordinate(max_screen_height, loc_y_list)
+        if x_start is None:
+            print(f"Every x location is taken by a window, using x = {DEFAULT_START_COORDINATE}")
+            x_start = DEFAULT_START_COORDINATE
+        if y_start is None:
+            print(f"Every y location is taken by a window, using y = {DEFAULT_START_COORDINATE}")
+            y_start = DEFAULT_START_COORDINATE
+        return x_start, y_start
+
+    def find_window_at(self, x_start, y_start):
+        """
+        Description: Finds the top level window whose top-left corner is at x_start, y_start
+                     and remembers it as the preview window
+        Return/Output: window id, or 0 if not found
+        """
+        for win in self.get_top_level_windows():
+            x, y = self.get_window_location(win)
+            if x == x_start and y == y_start:
+                self.preview_window_id = win.id
+                return win.id
+        return 0
+
+    def get_window_location_from_id(self, window_id):
+        return self.get_window_location(self.get_window(window_id))
+
+    def move_window(self, window_id, x_new, y_new):
+        self.get_window(window_id).configure(x=x_new, y=y_new)
+        self.display.flush()
+
+    def set_window_name(self, window_id, new_window_name):
+        self.get_window(window_id).set_wm_name(new_window_name)
+        self.display.flush()
+
+    def close(self):
+        self.window_cache = {}
+        self.display.close()
+
+
+def get_window_helper():
+    """
+    Description: Gets the shared WindowManagerHelper, connects on first use
+    """
+    global _window_helper
+    if _window_helper is None:
+        _window_helper = WindowManagerHelper(WINDOW_HELPER_DISPLAY)
+    return _window_helper
+
+
+def close_window_helper():
+    global _window_helper
+    if _window_helper is not None:
+        _window_helper.close()
+        _window_helper = None
+
+
+class PreviewWindowWatcher:
+    """
+    Description: Listens for move events of one window
+    Inputs:
+      - window_id, X window id of the preview pseudo window (from find_window_at)
+      - window_helper, WindowManagerHelper to share the display connection with (default: get_window_helper())
+    """
+
+    def __init__(self, window_id, window_helper=None):
+        if window_helper is None:
+            window_helper = get_window_helper()
+        self.window_helper = window_helper
+        self.display = window_helper.display
+        self.window_id = window_id
+        self.window = window_helper.get_window(window_id)
+        # StructureNotify: ConfigureNotify is sent when this window moves or changes size
+        self.window.change_attributes(event_mask=X.StructureNotifyMask)
+        self.display.flush()
+
+    def get_moved_location(self):
+        """
+        Description: Reads any waiting X events without blocking
+        Return/Output: (x, y) of the latest move, or None if the window hasn't moved
+        """
+        moved_location = None
+        # pending_events() doesn't block, only returns what already arrived
+        while self.display.pending_events() > 0:
+            event = self.display.next_event()
+            if event.type == X.ConfigureNotify and event.window.id == self.window_id:
+                moved_location = (event.x, event.y)
+        return moved_location
+
+    def close(self):
+        # Stop listening, the display connection belongs to the window helper
+        self.window.change_attributes(event_mask=X.NoEventMask)
+        self.display.flush()
@@ -0,0 +1,156 @@
+"""
+Headless Experiment Runner
+Runs an experiment from the command line (or as a service) on rigs with no
+monitor: no PySimpleGUI window, no X display or preview pseudo window (Xlib),
+and OpenCV is only loaded if the experiment needs it. Uses the same experiment
+engine as the GUI's "Start Experiment" (module_experiment_engine), so folders,
+journals, run schedules and metadata are the same.
+
+-Start: CSV of wells, capture mode, run interval, experiment duration, output folder
+-Resume: continue a stopped/crashed experiment folder from its journal (--resume)
+-Queue: run the job queue in the output folder, taking turns between its jobs (--queue),
+ a CSV given with --queue is added to the queue first
+Ctrl+C or SIGTERM (systemctl stop) stops after the current run, like "Stop Experiment".
+Times take s/m/h suffixes (plain numbers are seconds).
+
+Usage:
+    python3 run_experiment_headless.py plate.csv --mode pictures --interval 10m --duration 48h --output /data
+    python3 run_experiment_headless.py --resume /data/2026-10-17_093000
+    python3 run_experiment_headless.py plate_b.csv --interval 30m --duration 24h --queue --priority 1
+    ROBOCAM_BACKEND=sim python3 run_experiment_headless.py plate.csv --interval 30 --duration 120 --output /tmp
+"""
+
+import argparse
+import os
+import signal
+import threading
+
+import module_backends as BK
+import module_experiment_engine as EE
+import module_experiment_journal as EJ
+import module_job_queue as JQ
+import module_run_scheduler as RS
+import module_serial_queue as SQ
+import module_video_recorder as VR
+import prepare_experiment as P
+
+# ==== HEADLESS RUNNER CONSTANTS ====
+# Longest wait (in seconds) for the camera's digital gain to settle at startup
+HEADLESS_GAIN_SETTLE_TIMEOUT = 2
+
+# Seconds per time suffix (--interval, --duration)
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_seconds(text):
+    """
+    Description: Time text for argparse, example: "90", "90s", "10m", "1.5h"
+    Return/Output: seconds (float)
+    """
+    text = text.strip().lower()
+    unit = 1
+    if text and text[-1] in TIME_UNITS:
+        unit = TIME_UNITS[text[-1]]
+        text = text[:-1]
+    try:
+        seconds = float(text) * unit
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a time: {text!r} (examples: 90, 90s, 10m, 1.5h)")
+    if seconds < 0:
+        raise argparse.ArgumentTypeError("time can't be negative")
+    return seconds
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Run a 3D Printer sampling experiment without the GUI")
+    parser.add_argument("csv", nargs="?", help="CSV of well locations")
+    parser.add_argument("--mode", choices=EE.MODE_LIST, default=EE.MODE_PICTURES,
+                        help="take pictures, videos, or only go to the wells (default: %(default)s)")
+    parser.add_argument("--interval", type=parse_seconds, default=0,
+                        help="time between run starts, example: 10m (default: 0, runs back to back)")
+    parser.add_argument("--duration", type=parse_seconds, default=0,
+                        help="experiment time, example: 48h (default: 0, one run)")
+    parser.add_argument("--output", default=EE.PIC_SAVE_FOLDER,
+                        help="folder the experiment folder (and job queue) is made in (default: %(default)s)")
+    parser.add_argument("--resume", metavar="FOLDER", help="continue the experiment in FOLDER from its journal")
+    parser.add_argument("--queue", action="store_true",
+                        help="run the job queue in the output folder (a CSV given is added to it first)")
+    parser.add_argument("--priority", type=int, default=JQ.DEFAULT_PRIORITY,
+                        help="priority of the CSV's job with --queue, higher goes first (default: %(default)s)")
+    parser.add_argument("--optimize-path", action="store_true", help="visit wells in shortest-path order")
+    parser.add_argument("--alternate", action="store_true", help="alternate the well order direction every run")
+    parser.add_argument("--focus-map", action="store_true", help="autofocus wells with a per-well focus map")
+    parser.add_argument("--tiled-copy", action="store_true",
+                        help="also save each picture as a .npy for tiled processing (about 36 MB each at 12 MP)")
+    parser.add_argument("--overrun-policy", choices=RS.OVERRUN_POLICY_LIST, default=RS.OVERRUN_POLICY,
+                        help="what to do when a run starts late (default: %(default)s)")
+    parser.add_argument("--video-seconds", type=float, default=VR.VIDEO_DURATION_SECONDS,
+                        help="video length per well in seconds (default: %(default)s)")
+    parser.add_argument("--video-bitrate", type=float, default=VR.VIDEO_BITRATE / 1000000,
+                        help="video bitrate in Mbps (default: %(default)s)")
+    parser.add_argument("--pic-resolution", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        default=list(EE.PIC_RES), help="still picture resolution (default: %(default)s)")
+    parser.add_argument("--settle", type=parse_seconds, default=HEADLESS_GAIN_SETTLE_TIMEOUT,
+                        help="longest wait for the camera's gain to settle at startup (default: %(default)s sec)")
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.resume is not None and (args.csv is not None or args.queue):
+        parser.error("--resume can't be used with a CSV or --queue")
+    if args.resume is not None and not os.path.isfile(EJ.get_journal_path(args.resume)):
+        parser.error(f"no experiment journal in: {args.resume}")
+    if args.resume is None and args.csv is None and not args.queue:
+        parser.error("give a CSV, --resume FOLDER or --queue")
+    if args.csv is not None and not os.path.isfile(args.csv):
+        parser.error(f"CSV not found: {args.csv}")
+
+    pic_res = tuple(args.pic_resolution)
+    values = EE.get_values(args.mode, args.optimize_path, args.alternate, args.focus_map, args.video_seconds,
+                           args.video_bitrate, args.overrun_policy, args.tiled_copy)
+
+    # "Stop Experiment": Ctrl+C / SIGTERM end the experiment after the current run
+    stop_event = threading.Event()
+
+    def stop(signal_number, frame):
+        if not stop_event.is_set():
+            print(f"Got {signal.Signals(signal_number).name}, stopping after the current run")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def is_running():
+        return not stop_event.is_set()
+
+    # Setup 3D Printer (printer_connection, or the simulated printer with ROBOCAM_BACKEND=sim)
+    printer = BK.get_printer_module()
+    path_list = P.get_path_list_csv(args.csv) if args.csv is not None else []
+    printer.initial_setup(path_list)
+    # One thread owns the serial port, experiment GCODE goes through its queue
+    SQ.start(printer.printer)
+
+    camera = BK.create_camera()
+    try:
+        EE.setup_camera(camera, EE.VID_RES, gain_settle_timeout=args.settle)
+
+        if args.resume is not None:
+            EE.run_single_experiment(EE.open_resumed_experiment(args.resume, camera, EE.VID_RES), is_running)
+        elif args.queue:
+            job_queue = JQ.JobQueue(JQ.get_job_queue_path(args.output))
+            if args.csv is not None:
+                job_queue.add_job(args.csv, args.duration, args.interval, values, args.priority)
+            EE.run_job_queue(job_queue, camera, is_running, args.output, pic_res, EE.VID_RES)
+        else:
+            experiment = EE.create_experiment(values, camera, args.csv, args.duration, args.interval, args.output,
+                                              pic_res, EE.VID_RES)
+            EE.run_single_experiment(experiment, is_running)
+    finally:
+        SQ.stop()
+        camera.close()
+
+
+if __name__ == "__main__":
+    main()